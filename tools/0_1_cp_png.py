@@ -1,28 +1,100 @@
 import os, sys
+import json
+import hashlib
 import logging
 import shutil
-from PIL import Image
 from collections import defaultdict
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 import multiprocessing as mp
 from tqdm import tqdm
 import threading
 import time
+from jsonl_io import JsonlWriter, iter_lines, loads
+from image_codec import CODEC_PROFILES, DEFAULT_PROFILE, IMAGE_EXTS, backend_info, get_profile, make_codec, profile_id
 
 # 定义需要特殊处理的书籍名称（精确匹配，避免误作用于其他书籍）
 SPECIAL_BOOK_NAME = "9787536989627百校联盟高中毕业升学真题详解2026高一期末冲刺全国十大名校月考期中期末真卷精选名校名卷英语外研版高一2025"
 
+# 每个进程任务最多处理的文件数（同一本书的文件放在同一任务中），减少任务提交和结果回传的开销
+CHUNK_SIZE = 64
+
+# 转换清单：记录每个源文件最近一次成功处理时的 (大小, 修改时间, 内容哈希)、目标路径和目标文件大小，位于输出目录下
+MANIFEST_NAME = ".convert_manifest.jsonl"
+
+# 当前进程使用的编码器及其配置标识，主进程和每个工作进程启动时通过 set_codec_profile 设置
+CODEC = make_codec(get_profile(DEFAULT_PROFILE))
+CODEC_ID = profile_id(get_profile(DEFAULT_PROFILE))
+DEFAULT_CODEC_ID = CODEC_ID  # 旧清单记录没有 codec 字段，按默认配置生成
+
+def set_codec_profile(profile):
+    """
+    设置当前进程的编码配置（也用作进程池的 initializer）
+    """
+    global CODEC, CODEC_ID
+    CODEC = make_codec(profile)
+    CODEC_ID = profile_id(profile)
+
+def load_manifest(manifest_path):
+    """
+    读取转换清单，返回 源文件路径 -> 记录（同一源文件以最后一条为准）
+    """
+    manifest = {}
+    if not os.path.exists(manifest_path):
+        return manifest
+    for _, line in iter_lines(manifest_path):
+        try:
+            entry = loads(line)
+        except json.JSONDecodeError:
+            continue  # 中断时可能留下不完整的最后一行
+        manifest[entry["source"]] = entry
+    return manifest
+
+def save_manifest(manifest_path, manifest):
+    """
+    压缩转换清单：每个源文件只保留一条记录，先写临时文件再替换
+    """
+    tmp_path = f"{manifest_path}.tmp"
+    with JsonlWriter(tmp_path) as writer:
+        for entry in manifest.values():
+            writer.write(entry)
+    os.replace(tmp_path, manifest_path)
+
+def is_up_to_date(entry, st, target_file_path):
+    """
+    源文件大小、修改时间、目标路径和编码配置都与清单一致，且目标文件仍存在、大小与清单一致时视为已处理
+    目标文件被删除或替换后重新处理
+    """
+    return (entry is not None
+            and entry["target"] == target_file_path
+            and entry.get("codec", DEFAULT_CODEC_ID) == CODEC_ID
+            and entry["size"] == st.st_size
+            and entry["mtime_ns"] == st.st_mtime_ns
+            and target_matches(entry, target_file_path))
+
+def target_matches(entry, target_file_path):
+    """
+    检查目标文件是否与清单记录一致：非图片文件不生成目标文件（target_size 为 None），
+    旧清单记录没有 target_size 字段，只检查目标文件是否存在
+    """
+    if "target_size" in entry and entry["target_size"] is None:
+        return True
+    try:
+        target_size = os.stat(target_file_path).st_size
+    except OSError:
+        return False
+    return entry.get("target_size", target_size) == target_size
+
 def process_single_file(args):
     """
     处理单个文件的任务函数，用于多进程处理
-    返回处理状态和可能的错误信息
+    返回处理状态、可能的错误信息和写入转换清单的记录
     """
-    (source_file_path, target_file_path, book_name, test_package_path, is_special_book) = args
+    (source_file_path, target_file_path, book_name, test_package_path, is_special_book, known_hash) = args
+    # 先写临时文件，完成后再重命名为目标文件，中断时不会留下写了一半的图片
+    tmp_path = f"{target_file_path}.tmp"
     
     try:
-        # 如果目标文件已存在则跳过
-        if os.path.exists(target_file_path):
-            return True, None
 
         # 计算相对于试题包的路径
         foldername = os.path.dirname(source_file_path)
@@ -47,38 +119,54 @@ def process_single_file(args):
         base_name = os.path.splitext(filename)[0]
         target_file_name = f'{book_name}-{rel_parts[-1]}-{base_name}.jpg'
         
+        st = os.stat(source_file_path)
+        entry = {"source": source_file_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                 "hash": None, "target": target_file_path, "codec": CODEC_ID, "target_size": None}
+        ext = os.path.splitext(filename)[1].lower()
+        if ext not in IMAGE_EXTS:
+            return True, None, entry
+
+        # 源文件只读一次，同时用于计算哈希和转换
+        with open(source_file_path, 'rb') as f:
+            data = f.read()
+        entry["hash"] = hashlib.sha1(data).hexdigest()
+        # 仅修改时间变化、内容未变（如重新拷贝）时不重新转换
+        if entry["hash"] == known_hash and os.path.exists(target_file_path):
+            entry["target_size"] = os.path.getsize(target_file_path)
+            return True, None, entry
+
         # 确保目标目录存在
         target_subdir = os.path.dirname(target_file_path)
         os.makedirs(target_subdir, exist_ok=True)
 
-        # 复制或转换
-        ext = filename.lower()
-        if ext.endswith(('.png', '.jpeg', '.tif', '.bmp', '.gif', '.webp')):
-            with Image.open(source_file_path) as img:
-                # 使用更快的重采样算法
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                # 使用更快的JPEG编码参数
-                img.save(target_file_path, "JPEG", quality=85, optimize=False, progressive=False)
-        elif ext.endswith('.jpg'):
-            shutil.copy2(source_file_path, target_file_path)
+        # 复制或转换（由编码配置决定是否缩放、重新编码）
+        if CODEC.convert(data, ext, tmp_path):
+            shutil.copystat(source_file_path, tmp_path)
+        os.replace(tmp_path, target_file_path)
+        entry["target_size"] = os.path.getsize(target_file_path)
         
-        return True, None
+        return True, None, entry
     except Exception as e:
-        return False, f"处理 {source_file_path} 时发生错误: {str(e)}"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False, f"处理 {source_file_path} 时发生错误: {str(e)}", None
 
-def collect_tasks(input_subfolder, output_subfolder, test_package_path, target_package_path):
+def collect_tasks(input_subfolder, output_subfolder, test_package_path, target_package_path, manifest=None):
     """
-    收集指定目录下的所有处理任务
+    收集指定目录下的所有处理任务，清单中记录为未变化的源文件不再生成任务
+    返回 (任务列表, 跳过的文件数)
     """
     tasks = []
+    skipped = 0
     book_name = os.path.basename(input_subfolder)
     is_special_book = (book_name == SPECIAL_BOOK_NAME)
     
     for foldername, _, filenames in os.walk(test_package_path):
         for filename in filenames:
             source_file_path = os.path.join(foldername, filename)
-            if not os.path.isfile(source_file_path):
+            try:
+                st = os.stat(source_file_path)
+            except OSError:
                 continue
                 
             # 计算相对路径以确定目标文件名
@@ -104,23 +192,33 @@ def collect_tasks(input_subfolder, output_subfolder, test_package_path, target_p
             target_subdir = os.path.join(target_package_path, *rel_parts[-2:])
             target_file_path = os.path.join(target_subdir, target_file_name)
             
-            # 添加到任务列表
-            tasks.append((source_file_path, target_file_path, book_name, test_package_path, is_special_book))
+            entry = manifest.get(source_file_path) if manifest else None
+            if is_up_to_date(entry, st, target_file_path):
+                skipped += 1
+                continue
+
+            # 添加到任务列表（附带清单中的哈希，内容和编码配置都未变且目标文件完好时无需重新转换）
+            same_output = (entry is not None and entry["target"] == target_file_path
+                           and entry.get("codec", DEFAULT_CODEC_ID) == CODEC_ID
+                           and target_matches(entry, target_file_path))
+            known_hash = entry["hash"] if same_output else None
+            tasks.append((source_file_path, target_file_path, book_name, test_package_path, is_special_book, known_hash))
             
-    return tasks
+    return tasks, skipped
 
-def copy_and_convert(input_subfolder, output_subfolder):
+def copy_and_convert(input_subfolder, output_subfolder, manifest=None):
     """
     处理单个书籍目录（其下直接包含 试题包/试题库/试题）
     input_subfolder: 例如 /.../中教万联新全优.../
     output_subfolder: 对应的输出目录
+    返回 (任务列表, 跳过的未变化文件数)
     """
     if not os.path.exists(input_subfolder):
         print(f"错误：路径不存在 - {input_subfolder}")
-        return []
+        return [], 0
     if not os.path.isdir(input_subfolder):
         print(f"错误：{input_subfolder} 不是一个文件夹")
-        return []
+        return [], 0
 
     # 直接在 input_subfolder 下找试题包（不再遍历其子目录）
     test_package_path = None
@@ -131,54 +229,93 @@ def copy_and_convert(input_subfolder, output_subfolder):
             break
     if not test_package_path:
         logging.error(f'{input_subfolder} 中没有找到试题包/试题库/试题')
-        return []
+        return [], 0
 
     target_package_path = os.path.join(output_subfolder, "试题包")
     os.makedirs(target_package_path, exist_ok=True)
 
     # 收集所有需要处理的文件任务
-    tasks = collect_tasks(input_subfolder, output_subfolder, test_package_path, target_package_path)
-    return tasks
+    return collect_tasks(input_subfolder, output_subfolder, test_package_path, target_package_path, manifest)
+
+def process_file_chunk(tasks):
+    """
+    进程池任务：依次处理一组文件，返回每个文件的处理结果
+    """
+    return [process_single_file(task) for task in tasks]
 
-def process_all_books(subject_tasks, max_workers=None):
+def iter_chunks(book_tasks, chunk_size=CHUNK_SIZE):
+    """
+    按书籍切分任务块，每块最多 chunk_size 个文件
+    book_tasks 为逐本书籍产生任务列表的可迭代对象，按需取用，不必事先收集全部书籍的任务
+    """
+    for tasks in book_tasks:
+        for start in range(0, len(tasks), chunk_size):
+            yield tasks[start:start + chunk_size]
+
+def process_all_books(book_tasks, max_workers=None, manifest_path=None, manifest=None, chunk_size=CHUNK_SIZE,
+                      profile=None):
     """
     并行处理所有书籍任务，并显示总体进度
+    book_tasks 逐本书籍产生任务列表（可以是生成器，边遍历目录边提交），
+    任务按块提交，在途任务块数量有上限，父进程内存不随批次规模增长
+    传入 manifest_path 时，每个成功处理的文件追加写入转换清单，结束后压缩清单
+    profile 为编码配置，工作进程启动时设置，未传入时使用默认配置
+    返回 (成功数, 失败数)
     """
+    if profile is None:
+        profile = get_profile(DEFAULT_PROFILE)
     if not max_workers:
         max_workers = min(mp.cpu_count(), 8)  # 限制最大进程数防止系统过载
     
-    total_tasks = sum(len(tasks) for tasks in subject_tasks.values())
-    if total_tasks == 0:
-        print("没有需要处理的任务")
-        return
-    
     success_count = 0
     error_count = 0
+    if manifest is None:
+        manifest = {}
+    # 边处理边追加清单，中途中断时已完成的文件下次不会重复处理
+    manifest_writer = JsonlWriter(manifest_path, 'a') if manifest_path else None
     
-    # 创建进度条
-    with tqdm(total=total_tasks, desc="总体处理进度", unit="文件") as pbar:
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_source = {}
-            for tasks in subject_tasks.values():
-                for task in tasks:
-                    future = executor.submit(process_single_file, task)
-                    future_to_source[future] = task[0]  # task[0]是source_file_path
-            
-            # 处理完成的任务
-            for future in as_completed(future_to_source):
-                success, error_msg = future.result()
-                if success:
-                    success_count += 1
-                else:
-                    error_count += 1
-                    logging.error(error_msg)
-                
-                # 更新进度条
-                pbar.update(1)
-                pbar.set_postfix(成功=success_count, 失败=error_count)
+    # 创建进度条（总数随任务块提交增长）
+    with tqdm(total=0, desc="总体处理进度", unit="文件") as pbar:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=set_codec_profile,
+                                 initargs=(profile,)) as executor:
+            chunks = iter_chunks(book_tasks, chunk_size)
+            max_pending = max_workers * 2  # 每个进程最多排队两个任务块
+            pending = set()
+            while True:
+                # 补充任务块直到在途数量达到上限
+                for chunk in islice(chunks, max_pending - len(pending)):
+                    pending.add(executor.submit(process_file_chunk, chunk))
+                    pbar.total += len(chunk)
+                    pbar.refresh()
+                if not pending:
+                    break
+
+                # 处理完成的任务块
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results = future.result()
+                    for success, error_msg, entry in results:
+                        if success:
+                            success_count += 1
+                            if manifest_writer is not None:
+                                manifest_writer.write(entry)
+                                manifest[entry["source"]] = entry
+                        else:
+                            error_count += 1
+                            logging.error(error_msg)
+
+                    # 更新进度条
+                    pbar.update(len(results))
+                    pbar.set_postfix(成功=success_count, 失败=error_count)
     
-    print(f"全部处理完成: 成功 {success_count}, 失败 {error_count}")
+    if manifest_writer is not None:
+        manifest_writer.close()
+        save_manifest(manifest_path, manifest)
+    if success_count + error_count == 0:
+        print("没有需要处理的任务")
+    else:
+        print(f"全部处理完成: 成功 {success_count}, 失败 {error_count}")
+    return success_count, error_count
 
 def get_subject_paths(input_dir):
     """
@@ -238,10 +375,45 @@ def get_book_paths(subject_path):
                 
     return book_paths
 
+def iter_book_tasks(input_dir, output_dir, manifest=None, stats=None):
+    """
+    逐本书籍遍历目录并收集任务，每次只产生一本书籍的任务列表（没有待处理文件的书籍不产生）
+    stats 传入字典时累计 books（有待处理文件的书籍数）、files（待处理文件数）、skipped（跳过的未变化文件数）
+    """
+    if stats is None:
+        stats = {}
+    for key in ("books", "files", "skipped"):
+        stats.setdefault(key, 0)
+
+    for subject, subject_path in get_subject_paths(input_dir).items():
+        book_paths = get_book_paths(subject_path)
+        
+        for book_key, input_subfolder in book_paths.items():
+            if not os.path.exists(input_subfolder):
+                continue
+                
+            # 构建输出路径
+            if "/" in book_key:  # 包含分类的情况
+                category, book = book_key.split("/", 1)
+                output_subfolder = os.path.join(output_dir, f"{subject}-{category}", book)
+            else:
+                output_subfolder = os.path.join(output_dir, subject, book_key)
+                
+            os.makedirs(output_subfolder, exist_ok=True)
+            
+            # 收集此书籍的任务
+            tasks, skipped = copy_and_convert(input_subfolder, output_subfolder, manifest)
+            stats["skipped"] += skipped
+            if tasks:
+                stats["books"] += 1
+                stats["files"] += len(tasks)
+                yield tasks
+
 if __name__ == "__main__":
-    # 核心修改：接收三个参数：1.输入路径 2.输出路径 3.batch名称
-    if len(sys.argv) != 4:
-        print("用法：python 0_1_cp_png.py <输入路径> <输出路径> <batch名称>")
+    # 核心修改：接收三个参数：1.输入路径 2.输出路径 3.batch名称，可选第四个参数：编码配置名称
+    if len(sys.argv) not in (4, 5):
+        print("用法：python 0_1_cp_png.py <输入路径> <输出路径> <batch名称> [编码配置]")
+        print(f"编码配置可选：{', '.join(CODEC_PROFILES)}，默认 {DEFAULT_PROFILE}")
         print("示例：python 0_1_cp_png.py "
               "/DL_data_new/自动化切题/原始数据/教辅QA/正式交付数据/图片包/信息科技1009 "
               "/DL_data_new/ftpdata/jjhu32/code/中高考ocr切题/信息科技1009/0_raw_png_信息科技1009 "
@@ -252,6 +424,9 @@ if __name__ == "__main__":
     input_dir = sys.argv[1]    # 第一个参数：输入路径
     output_dir = sys.argv[2]   # 第二个参数：输出路径
     batch = sys.argv[3]        # 第三个参数：明确传入的batch名称
+    profile_name = sys.argv[4] if len(sys.argv) == 5 else DEFAULT_PROFILE
+    profile = get_profile(profile_name)
+    set_codec_profile(profile)
 
     # 保留原逻辑：创建必要目录和日志配置
     os.makedirs(output_dir, exist_ok=True)
@@ -264,38 +439,21 @@ if __name__ == "__main__":
         filemode='w'
         )
 
-    # 收集所有任务
-    all_tasks = {}
-    
-    print("正在收集处理任务...")
-    subject_paths = get_subject_paths(input_dir)
-    
-    for subject, subject_path in subject_paths.items():
-        book_paths = get_book_paths(subject_path)
-        
-        for book_key, input_subfolder in book_paths.items():
-            if not os.path.exists(input_subfolder):
-                continue
-                
-            # 构建输出路径
-            if "/" in book_key:  # 包含分类的情况
-                category, book = book_key.split("/", 1)
-                output_subfolder = os.path.join(output_dir, f"{subject}-{category}", book)
-            else:
-                output_subfolder = os.path.join(output_dir, subject, book_key)
-                
-            os.makedirs(output_subfolder, exist_ok=True)
-            
-            # 收集此书籍的任务
-            tasks = copy_and_convert(input_subfolder, output_subfolder)
-            if tasks:
-                task_key = f"{subject}/{book_key}"
-                all_tasks[task_key] = tasks
-
-    # 执行所有任务
-    print(f"开始处理 {len(all_tasks)} 个书籍目录，共 {sum(len(t) for t in all_tasks.values())} 个文件...")
-    process_all_books(all_tasks)
+    print(f"编码配置：{profile_name} {profile}，{backend_info()}")
+    logging.info(f"编码配置：{profile_name} {profile}，{backend_info()}")
 
+    # 边遍历目录边处理任务（转换清单中未变化且编码配置相同的源文件直接跳过），
+    # 父进程同一时间只持有一本书籍的任务列表和在途任务块
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    stats = {}
+    
+    print("开始收集并处理任务...")
+    process_all_books(iter_book_tasks(input_dir, output_dir, manifest, stats),
+                      manifest_path=manifest_path, manifest=manifest, profile=profile)
+    print(f"跳过未变化的文件 {stats['skipped']} 个")
+    print(f"共处理 {stats['books']} 个书籍目录，{stats['files']} 个文件")
+    logging.info(f"跳过未变化的文件 {stats['skipped']} 个，处理 {stats['books']} 个书籍目录，{stats['files']} 个文件")
 
 # 总体进度条：
 
@@ -308,7 +466,7 @@ if __name__ == "__main__":
 # 优化了图像转换流程
 # 架构优化：
 
-# 将任务收集与执行分离，先收集所有任务再并行处理
+# 将任务收集与执行分离，逐本书籍收集任务并按块提交到进程池并行处理
 # 更清晰的代码结构和函数划分
 # 避免了每个书籍目录都创建进程池的开销
 # 内存效率：
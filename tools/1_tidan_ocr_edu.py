@@ -1,13 +1,15 @@
 import os
-import json
 import sys
 import shutil
 import logging
 import zipfile  # 压缩所需库
+import zlib
 from pathlib import Path
 from collections import defaultdict
 from tqdm import tqdm
 from prompt_loader import *
+from jsonl_io import JsonlWriter, dumpb
+from page_index import load_page_index
 import threading
 from concurrent.futures import ThreadPoolExecutor
 import multiprocessing as mp
@@ -17,140 +19,227 @@ current_dir = Path(__file__).parent
 config_path = current_dir / "prompts.yaml"
 loader = PromptLoader(str(config_path))
 ocr_prompt = loader.build_prompt(stage="1_ocr", workflow="教辅QA")
+ocr_check_prompt = "严格对照图片，逐字检查修正ocr文本，并输出最终结果。输出结果必须与图片内容完全一致，仅输出修正后的文本，不要添加任何说明、总结或额外内容。"
+
+# 每行JSON中不变的 query 部分只序列化一次，逐行只拼接 img_path 和 id
+OCR_LINE_PREFIX = b'{"query":' + dumpb([ocr_prompt, ocr_check_prompt]) + b',"img_path":'
+
+def render_ocr_line(img_path_field, id_obj):
+    """
+    拼接一行OCR任务JSON，与 {"query": [...], "img_path": ..., "id": ...} 序列化结果相同
+    """
+    return b"".join((OCR_LINE_PREFIX, dumpb(img_path_field), b',"id":', dumpb(id_obj), b"}"))
 
 # ================== 新增：目录压缩函数 ==================
-def zip_directory(source_dir, zip_output_path):
+ZIP_READ_BUFFER = 4 * 1024 * 1024    # 读取源文件的缓冲大小
+ZIP_WRITE_BUFFER = 16 * 1024 * 1024  # 写压缩包的缓冲大小
+
+def list_zip_entries(source_dir, planned_files=()):
+    """
+    收集压缩包内容，返回 [(源文件路径, 包内路径)]
+    source_dir 下的文件按路径排序；planned_files 为尚未在磁盘上生成的文件（如未落盘的 TOTAL_pic），直接从源文件读取
+    """
+    entries = []
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            entries.append((file_path, os.path.relpath(file_path, source_dir)))
+    entries.extend(planned_files)
+    return entries
+
+def write_stored_zip(entries, zip_output_path, force_zip64=False):
+    """
+    顺序写入存储模式（不压缩）的ZIP包，写入时同步计算每个文件的 CRC 和大小
+    返回 包内路径 -> (大小, CRC)，供 verify_zip 校验
+    force_zip64 为 True 时所有文件都使用 ZIP64 头（单个文件超过 4GB 时会自动启用）
     """
-    将指定目录压缩为ZIP包（优化版本）
+    written = {}
+    with open(zip_output_path, 'wb', buffering=ZIP_WRITE_BUFFER) as fout, \
+            zipfile.ZipFile(fout, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+        for file_path, arcname in tqdm(entries, desc="写入压缩包", unit="文件"):
+            try:
+                zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+                zinfo.compress_type = zipfile.ZIP_STORED
+                crc = 0
+                size = 0
+                with open(file_path, 'rb') as fsrc, zipf.open(zinfo, 'w', force_zip64=force_zip64) as fdst:
+                    while True:
+                        chunk = fsrc.read(ZIP_READ_BUFFER)
+                        if not chunk:
+                            break
+                        crc = zlib.crc32(chunk, crc)
+                        size += len(chunk)
+                        fdst.write(chunk)
+                if size != zinfo.file_size:
+                    # 日志文件等在压缩过程中仍在写入，以实际读取的内容为准
+                    logging.warning(f"压缩期间文件大小发生变化：{arcname}（{zinfo.file_size} → {size}）")
+                written[arcname] = (size, crc)
+                logging.debug(f"压缩包添加文件：{arcname}")
+            except Exception as e:
+                logging.error(f"添加文件到压缩包失败：{arcname} → 错误：{str(e)}")
+    return written
+
+def verify_zip(zip_output_path, written):
+    """
+    校验压缩包：只读取中央目录，与写入时计算的大小和 CRC 逐一比对，无需重新读取文件数据
+    """
+    try:
+        with zipfile.ZipFile(zip_output_path) as zipf:
+            infos = {info.filename: info for info in zipf.infolist()}
+    except zipfile.BadZipFile as e:
+        logging.error(f"压缩包无法打开：{zip_output_path} → 错误：{str(e)}")
+        return False
+
+    if len(infos) != len(written):
+        logging.error(f"压缩包文件数不一致：{zip_output_path}（期望 {len(written)}，实际 {len(infos)}）")
+        return False
+    for arcname, (size, crc) in written.items():
+        info = infos.get(arcname)
+        if info is None or info.file_size != size or info.compress_size != size or info.CRC != crc:
+            logging.error(f"压缩包校验失败：{arcname}")
+            return False
+    return True
+
+def zip_directory(source_dir, zip_output_path, planned_files=(), force_zip64=False):
+    """
+    将指定目录压缩为ZIP包（存储模式，单线程顺序写入）
     :param source_dir: 待压缩的源目录路径
     :param zip_output_path: 压缩包输出路径（含文件名）
+    :param planned_files: 额外写入的 [(源文件路径, 包内路径)]，用于不落盘的 TOTAL_pic
+    :param force_zip64: 是否对所有文件强制使用 ZIP64
     """
     if not os.path.exists(source_dir):
         logging.error(f"待压缩目录不存在：{source_dir}")
         print(f"待压缩目录不存在：{source_dir}")
         return False
     
-    # 使用存储模式（无压缩）来最大化速度
-    with zipfile.ZipFile(zip_output_path, 'w', zipfile.ZIP_STORED) as zipf:
-        # 收集所有文件路径
-        file_paths = []
-        for root, _, files in os.walk(source_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_paths.append((file_path, os.path.relpath(file_path, source_dir)))
-        
-        # 使用多线程写入文件
-        with ThreadPoolExecutor(max_workers=min(len(file_paths), mp.cpu_count())) as executor:
-            def write_file(args):
-                file_path, arcname = args
-                try:
-                    zipf.write(file_path, arcname)
-                    logging.debug(f"压缩包添加文件：{arcname}")
-                    return True
-                except Exception as e:
-                    logging.error(f"添加文件到压缩包失败：{arcname} → 错误：{str(e)}")
-                    return False
-            
-            # 批量处理文件写入
-            results = list(executor.map(write_file, file_paths))
+    entries = list_zip_entries(source_dir, planned_files)
+    written = write_stored_zip(entries, zip_output_path, force_zip64)
     
     # 验证压缩包有效性
-    if os.path.exists(zip_output_path) and os.path.getsize(zip_output_path) > 0:
+    if len(written) == len(entries) and verify_zip(zip_output_path, written):
         zip_size = os.path.getsize(zip_output_path) / 1024 / 1024  # 转MB单位
-        logging.info(f"压缩包生成成功：{zip_output_path}（大小：{zip_size:.2f}MB）")
+        logging.info(f"压缩包生成成功：{zip_output_path}（{len(written)} 个文件，大小：{zip_size:.2f}MB）")
         print(f"\n 压缩包生成成功：{zip_output_path}")
         print(f"压缩包大小：{zip_size:.2f}MB")
         return True
     else:
-        logging.error(f"压缩包生成失败或为空：{zip_output_path}")
+        logging.error(f"压缩包生成失败或校验未通过：{zip_output_path}")
         print(f" 压缩包生成失败：{zip_output_path}")
         return False
 
-def merge_all_images(src_root, dst_folder, img_extensions=(".png", ".jpg", ".jpeg", ".bmp", ".gif")):
-    if not os.path.exists(dst_folder):
-        os.makedirs(dst_folder)
-    name_count = {}  # 处理重复文件名
-    
-    # 收集所有文件路径
-    file_paths = []
-    for root, _, files in os.walk(src_root):
-        for file in files:
-            if file.lower().endswith(img_extensions):
-                src_path = os.path.join(root, file)
-                file_paths.append(src_path)
-    
-    # 使用多线程复制文件
-    with ThreadPoolExecutor(max_workers=min(len(file_paths), mp.cpu_count())) as executor:
-        def copy_file(src_path):
-            try:
-                file = os.path.basename(src_path)
-                base_name = os.path.splitext(file)[0]
-                ext = os.path.splitext(file)[1]
-                
-                # 重命名重复文件（如 "1.jpg" 重复则改为 "1_1.jpg"）
-                new_name = file
-                if new_name in name_count:
-                    name_count[new_name] += 1
-                    new_name = f"{base_name}_{name_count[new_name]}{ext}"
-                else:
-                    name_count[new_name] = 0
+# TOTAL_pic 中图片的生成方式，失败时（如跨文件系统）依次退回到后一种方式
+LINK_MODES = ("hardlink", "reflink", "copy")
+
+def plan_merge(src_root, img_extensions=(".png", ".jpg", ".jpeg", ".bmp", ".gif"), index=None):
+    """
+    规划合并后的文件名，返回 [(源文件路径, 目标文件名)]
+    按路径排序后依次分配名称，重复文件名依次改为 "1_1.jpg"、"1_2.jpg"，
+    同一输入每次得到相同的结果，且不会与已有名称冲突
+    index 为 src_root 的图片索引（PageIndex），未传入时现场遍历
+    """
+    if index is None:
+        index = load_page_index(src_root)
+    src_paths = [page.path for page in index.pages if page.path.lower().endswith(img_extensions)]
+
+    used_names = set()
+    name_count = {}
+    plan = []
+    for src_path in src_paths:
+        file = os.path.basename(src_path)
+        new_name = file
+        if new_name in used_names:
+            base_name, ext = os.path.splitext(file)
+            count = name_count.get(file, 0)
+            while new_name in used_names:
+                count += 1
+                new_name = f"{base_name}_{count}{ext}"
+            name_count[file] = count
+        used_names.add(new_name)
+        plan.append((src_path, new_name))
+    return plan
+
+def reflink_file(src_path, dst_path):
+    """
+    使用 copy_file_range 在内核中复制文件，支持的文件系统（btrfs、xfs、NFS 4.2 等）上共享数据块或在服务端完成复制
+    """
+    with open(src_path, 'rb') as fsrc, open(dst_path, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+    shutil.copystat(src_path, dst_path)
 
-                dst_path = os.path.join(dst_folder, new_name)
+def materialize_file(src_path, dst_path, link_mode="hardlink"):
+    """
+    按 link_mode 生成目标文件，返回实际使用的方式
+    """
+    if os.path.lexists(dst_path):
+        # 重新运行时硬链接已指向同一文件，无需处理
+        if link_mode == "hardlink" and os.path.samefile(src_path, dst_path):
+            return link_mode
+        os.remove(dst_path)
+
+    for mode in LINK_MODES[LINK_MODES.index(link_mode):]:
+        try:
+            if mode == "hardlink":
+                os.link(src_path, dst_path)
+            elif mode == "reflink":
+                if not hasattr(os, "copy_file_range"):
+                    continue
+                reflink_file(src_path, dst_path)
+            else:
                 shutil.copy2(src_path, dst_path)  # 保留文件元数据
-                return True
-            except Exception as e:
-                logging.error(f"复制文件失败：{src_path} → 错误：{str(e)}")
-                return False
-        
-        # 批量处理文件复制
-        results = list(executor.map(copy_file, file_paths))
-    
-    print(f" 所有图片已合并至：{dst_folder}")
+            return mode
+        except OSError:
+            if mode == "copy":
+                raise
+            if os.path.lexists(dst_path):
+                os.remove(dst_path)
 
-def extract_section_and_source(test_package_path):
-    """从试题包路径提取section（书籍名）和source_type（学段学科）"""
-    normalized_path = os.path.normpath(test_package_path)
-    path_parts = normalized_path.split(os.sep)
-    
-    # 提取section：试题包的上级目录（书籍文件夹名）
-    try:
-        test_package_idx = path_parts.index("试题包")
-        section = path_parts[test_package_idx - 1]
-    except (ValueError, IndexError):
-        raise ValueError(f"路径中未找到'试题包'目录：{test_package_path}")
-    
-    # 提取source_type：优先取试题包上两级（适配 "图片包/学段学科/书籍/试题包" 结构）
-    try:
-        test_package_idx = path_parts.index("试题包")
-        source_type = path_parts[test_package_idx - 2]  # 原始source_type（仅用于JSON内标识）
-    except Exception as e:
-        source_type = "unknown_source"
-        logging.error(f"未知source_type（路径：{test_package_path}）→ 错误：{str(e)}")
+def merge_all_images(src_root, dst_folder, img_extensions=(".png", ".jpg", ".jpeg", ".bmp", ".gif"), link_mode="hardlink",
+                     index=None):
+    """
+    将 src_root 下的所有图片合并到 dst_folder，返回合并规划 [(源文件路径, 目标文件名)]
+    先统一规划文件名再并行生成文件，线程之间不共享可变状态
+    """
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"未知的图片合并方式：{link_mode}，可选：{', '.join(LINK_MODES)}")
+    os.makedirs(dst_folder, exist_ok=True)
+    plan = plan_merge(src_root, img_extensions, index)
     
-    return section, source_type
+    def merge_file(item):
+        src_path, new_name = item
+        try:
+            return materialize_file(src_path, os.path.join(dst_folder, new_name), link_mode)
+        except Exception as e:
+            logging.error(f"复制文件失败：{src_path} → 错误：{str(e)}")
+            return None
 
-def get_single_sub_type(url):
-    """判断文件路径的sub类型（题目/答案/混合）"""
-    lower_url = url.lower().split('/')[-2]
-    has_question = ("题目" in lower_url) or ("试题" in lower_url)
-    has_answer = "答案" in lower_url
-    
-    if has_question and not has_answer:
-        return "题目"
-    elif has_answer and not has_question:
-        return "答案"
-    else:
-        logging.error(f"未知sub_type（路径：{url}）")
-        return "题目/答案"
+    # 文件名已确定，多线程只负责生成文件
+    with ThreadPoolExecutor(max_workers=max(1, min(len(plan), mp.cpu_count()))) as executor:
+        results = list(executor.map(merge_file, plan))
 
-def collect_all_test_package_images(root_dir):
-    """遍历根目录，收集所有试题包的JPG图片并分组"""
+    mode_counts = defaultdict(int)
+    for mode in results:
+        mode_counts[mode or "失败"] += 1
+    logging.info(f"图片合并完成：{dst_folder} → {dict(mode_counts)}")
+    print(f" 所有图片已合并至：{dst_folder}")
+    return plan
+
+def collect_all_test_package_images(root_dir, index=None):
+    """根据图片索引收集所有试题包的JPG图片并分组，index 未传入时现场遍历"""
     if not os.path.exists(root_dir):
         print(f" 根目录不存在：{root_dir}")
         return None
     if not os.path.isdir(root_dir):
         print(f" 根路径不是文件夹：{root_dir}")
         return None
+    if index is None:
+        index = load_page_index(root_dir)
     
     all_image_groups = defaultdict(lambda: {"package_nums": [], "urls": []})
     total_scanned = 0
@@ -160,39 +249,26 @@ def collect_all_test_package_images(root_dir):
     logging.info(f"开始遍历根目录：{root_dir}（仅识别JPG/JPEG图片）")
     print("="*60)
     
-    # 遍历书籍文件夹
-    for book_folder in os.listdir(root_dir):
-        book_folder_path = os.path.join(root_dir, book_folder)
-        if not os.path.isdir(book_folder_path):
-            continue
-        
-        # 定位"试题包"目录
-        test_package_path = os.path.join(book_folder_path, "试题包")
-        if not os.path.exists(test_package_path) or not os.path.isdir(test_package_path):
+    # 书籍文件夹
+    for book_folder, has_package in index.books.items():
+        if not has_package:
             logging.error(f"书籍 {book_folder} 下无'试题包'，跳过")
             continue
-        
         processed_test_packages += 1
-        logging.info(f"[{processed_test_packages}] 处理书籍：{book_folder} → 试题包路径：{test_package_path}")
+        logging.info(f"[{processed_test_packages}] 处理书籍：{book_folder} → 试题包路径：{os.path.join(root_dir, book_folder, '试题包')}")
+    
+    # 收集试题包下的JPG图片（类型和所属试题包编号已在索引中）
+    for page in index.pages:
+        if page.package_num is None or not page.path.lower().endswith((".jpg", ".jpeg")):
+            continue
+        total_scanned += 1
+        if page.sub_type == "题目/答案":
+            logging.error(f"未知sub_type（路径：{page.path}）")
         
-        # 收集试题包下的JPG图片
-        for dirpath, _, filenames in os.walk(test_package_path):
-            for filename in filenames:
-                if filename.lower().endswith((".jpg", ".jpeg")):
-                    total_scanned += 1
-                    img_abs_path = os.path.join(dirpath, filename)
-                    img_filename = filename
-                    
-                    # 提取图片类型和所属试题包编号
-                    sub_type = get_single_sub_type(img_abs_path)
-                    rel_dir = os.path.relpath(dirpath, test_package_path)
-                    rel_parts = rel_dir.split(os.sep)
-                    package_num = rel_parts[0] if (rel_parts and rel_parts[0]) else "root"
-                    
-                    # 按（书籍名+图片名+类型）分组，避免重复
-                    group_key = (book_folder, img_filename, sub_type)
-                    all_image_groups[group_key]["package_nums"].append(package_num)
-                    all_image_groups[group_key]["urls"].append(img_abs_path)
+        # 按（书籍名+图片名+类型）分组，避免重复
+        group_key = (page.book, os.path.basename(page.path), page.sub_type)
+        all_image_groups[group_key]["package_nums"].append(page.package_num)
+        all_image_groups[group_key]["urls"].append(page.path)
     
     # 输出遍历统计
     print("\n" + "="*60)
@@ -204,12 +280,15 @@ def collect_all_test_package_images(root_dir):
     return all_image_groups
 
 # 保留原有source_type拼接逻辑（仅用于JSON内标识，不影响路径）
-def generate_ocr_json(root_dir, output_jsonl, batch, source):
-    """生成OCR任务的JSONL文件"""
+def generate_ocr_json(root_dir, output_jsonl, batch, source, index=None, img_path_prefix=None):
+    """
+    生成OCR任务的JSONL文件
+    img_path_prefix 不为空时直接写入合并后的img_path（[[前缀/图片名], []]，多模多轮格式），合并时无需重新解析
+    """
     logging.info(f"开始生成JSONL：{root_dir} → 输出：{output_jsonl}")
 
     # 收集图片数据
-    all_image_groups = collect_all_test_package_images(root_dir)
+    all_image_groups = collect_all_test_package_images(root_dir, index)
     if not all_image_groups:
         logging.error("无有效图片数据，无法生成JSONL")
         return
@@ -222,40 +301,36 @@ def generate_ocr_json(root_dir, output_jsonl, batch, source):
     
     # 生成JSONL
     print(f"\n开始生成JSON数据（输出路径：{output_jsonl}）")
-    with open(output_jsonl, "w", encoding="utf-8") as f:
+    # section 为书籍文件夹名，原始source_type 为其上级目录（"图片包/学段学科/书籍/试题包" 结构）
+    original_source_type = os.path.basename(os.path.normpath(root_dir))
+    # 拼接处理后的source_type（仅用于JSON内标识，不影响后续路径）
+    source_type = f"{batch}_{original_source_type}_{source}"
+    with JsonlWriter(output_jsonl) as f:
         for (book_folder, img_filename, sub_type) in tqdm(all_image_groups.keys(), desc="生成JSON"):
             try:
                 group_data = all_image_groups[(book_folder, img_filename, sub_type)]
-                sample_url = group_data["urls"][0]
-                section, original_source_type = extract_section_and_source(sample_url)  # 原始source_type
-                
-                # 拼接处理后的source_type（仅用于JSON内标识，不影响后续路径）
-                source_type = f"{batch}_{original_source_type}_{source}"
                 
                 # 统一图片文件名格式（去除后缀后重新拼接，确保为.jpg）
                 name_without_ext = os.path.splitext(img_filename)[0]
                 img_path = f"{name_without_ext}.jpg"
+                if img_path_prefix:
+                    img_path_field = [[os.path.join(img_path_prefix, img_path)], []]
+                else:
+                    img_path_field = [img_path]
                 
-                # 构建JSON对象（多模多轮格式）
-                json_obj = {
-                    "query": [
-                        ocr_prompt, 
-                        "严格对照图片，逐字检查修正ocr文本，并输出最终结果。输出结果必须与图片内容完全一致，仅输出修正后的文本，不要添加任何说明、总结或额外内容。"
-                    ],
-                    "img_path": [img_path],
-                    "id": {
-                        "source_type": source_type,  # 处理后的source_type（仅JSON内标识）
-                        "section": section,
-                        "sub": sub_type,
-                        "package_num": sorted(group_data["package_nums"]),
-                        "url": sorted(group_data["urls"], key=lambda x: x.split('/')[-3]),  # 按目录排序路径
-                        "total_images": "1",
-                        "all_image_paths": [img_path]
-                    }
+                # 构建id（多模多轮格式），query 部分已预先序列化
+                id_obj = {
+                    "source_type": source_type,  # 处理后的source_type（仅JSON内标识）
+                    "section": book_folder,
+                    "sub": sub_type,
+                    "package_num": sorted(group_data["package_nums"]),
+                    "url": sorted(group_data["urls"], key=lambda x: x.split('/')[-3]),  # 按目录排序路径
+                    "total_images": "1",
+                    "all_image_paths": [img_path]
                 }
                 
                 # 写入JSONL（禁用ASCII转义，保留中文）
-                f.write(json.dumps(json_obj, ensure_ascii=False) + "\n")
+                f.write_line(render_ocr_line(img_path_field, id_obj))
             
             except Exception as e:
                 err_msg = str(e)[:80] + "..." if len(str(e)) > 80 else str(e)
@@ -269,7 +344,7 @@ def generate_ocr_json(root_dir, output_jsonl, batch, source):
 
 def process_subfolder(args):
     """处理单个子文件夹的任务函数"""
-    root, batch, source, sub_folder, input_png_dir, output_dir = args
+    root, batch, source, sub_folder, input_png_dir, output_dir, link_mode, materialize_pic, img_path_prefix = args
     
     print(f"\n" + "="*60)
     print(f" 正在处理子文件夹：{sub_folder}")
@@ -280,12 +355,22 @@ def process_subfolder(args):
     output_subfolder = os.path.join(output_dir, sub_folder)
     os.makedirs(output_subfolder, exist_ok=True)
     
-    # 合并图片到子文件夹下的"TOTAL_pic"目录
-    merge_all_images(subfolder_png_path, os.path.join(output_subfolder, "TOTAL_pic"))
+    # 遍历一次生成图片索引，图片合并和JSON生成共用；索引缓存在输入目录下，目录未变化时重新运行直接读取
+    index = load_page_index(subfolder_png_path, os.path.join(input_png_dir, f".page_index_{sub_folder}.jsonl"))
+    
+    # 合并图片到子文件夹下的"TOTAL_pic"目录；不落盘时只规划文件名，压缩时直接读取源图片
+    if materialize_pic:
+        plan = merge_all_images(subfolder_png_path, os.path.join(output_subfolder, "TOTAL_pic"), link_mode=link_mode,
+                                index=index)
+        planned_files = []
+    else:
+        plan = plan_merge(subfolder_png_path, index=index)
+        planned_files = [(src_path, os.path.join(sub_folder, "TOTAL_pic", new_name)) for src_path, new_name in plan]
     # 生成JSON（仍传入batch和source，用于JSON内标识）
-    generate_ocr_json(subfolder_png_path, os.path.join(output_subfolder, f"{sub_folder}.json"), batch, source)
+    generate_ocr_json(subfolder_png_path, os.path.join(output_subfolder, f"{sub_folder}.json"), batch, source, index,
+                      img_path_prefix)
     
-    return sub_folder
+    return sub_folder, planned_files
 
 if __name__ == "__main__":
     # 命令行参数检查（共6个参数：root、batch、date、name、model、source）
@@ -304,6 +389,9 @@ if __name__ == "__main__":
     merge = 1  # 是否合并JSON文件（1=合并，0=不合并）
     w_size = 1
     s_size = 1
+    link_mode = "hardlink"  # TOTAL_pic 图片生成方式：hardlink（硬链接）、reflink（copy_file_range）、copy（复制）
+    materialize_pic = True  # 是否在结果目录生成 TOTAL_pic（False 时压缩包直接从原始图片写入）
+    force_zip64 = False  # 是否对压缩包内所有文件强制使用 ZIP64
     
     # 核心路径配置
     input_png_dir = f"{root}/{batch}/0_raw_png_{batch}"  # 原始PNG目录（源文件夹所在目录）
@@ -342,7 +430,12 @@ if __name__ == "__main__":
     # 1. 并行处理每个子文件夹（图片合并 + 单文件夹JSON生成）
     with ThreadPoolExecutor(max_workers=min(len(sub_folders), mp.cpu_count())) as executor:
         # 准备任务参数
-        tasks = [(root, batch, source, sub_folder, input_png_dir, output_dir) for sub_folder in sub_folders]
+        # 合并时img_path直接使用最终路径：日期/结果目录名/源文件夹名（原始source_type）/TOTAL_pic/图片名
+        # 如需去除日期，将前缀改为 os.path.join(zip_root_dir, sub_folder, "TOTAL_pic")
+        zip_root_dir = os.path.basename(output_dir)
+        tasks = [(root, batch, source, sub_folder, input_png_dir, output_dir, link_mode, materialize_pic,
+                  os.path.join(date, zip_root_dir, sub_folder, "TOTAL_pic") if merge else None)
+                 for sub_folder in sub_folders]
         # 并行处理所有子文件夹
         results = list(tqdm(executor.map(process_subfolder, tasks), total=len(sub_folders), desc="处理子文件夹"))
 
@@ -361,42 +454,11 @@ if __name__ == "__main__":
         # 合并后的JSON文件路径（与结果目录同级）
         merge_tidan_file = f"{output_dir}.json"
         
-        # 写入合并后的JSON（核心修改：用源文件夹名替换处理后的source_type）
-        with open(merge_tidan_file, "w", encoding="utf-8") as merge_file:
+        # 各子文件夹的JSON已写入最终的img_path（使用源文件夹名），按顺序直接拼接即可
+        with open(merge_tidan_file, 'wb') as merge_file:
             for original_file_path in original_tidan_file_list:
-                if not os.path.exists(original_file_path):
-                    logging.warning(f"源JSON文件不存在，跳过：{original_file_path}")
-                    continue
-                
-                # 【核心修改1：从源JSON文件路径中解析出"源文件夹名"（原始source_type）】
-                # 源JSON路径格式：output_dir/源文件夹名/源文件夹名.json → 取"源文件夹名"层级
-                src_folder = os.path.basename(os.path.dirname(original_file_path))
-                
-                with open(original_file_path, "r", encoding="utf-8") as original_file:
-                    for line in original_file:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            data = json.loads(line)
-                            # 修正img_path：使用源文件夹名（原始source_type），而非处理后的source_type
-                            zip_root_dir = os.path.basename(output_dir)
-                            # 去除日期
-                            # new_img_path = [
-                            #     os.path.join(zip_root_dir, src_folder, "TOTAL_pic", img_path)
-                            #     for img_path in data["img_path"]
-                            # ]
-                            # 保留日期
-                            new_img_path = [
-                                os.path.join(date, zip_root_dir, src_folder, "TOTAL_pic", img_path)
-                                for img_path in data["img_path"]
-                            ]
-                            # 保持多模多轮格式
-                            data["img_path"] = [new_img_path, []]
-                            merge_file.write(json.dumps(data, ensure_ascii=False) + "\n")
-                        except Exception as e:
-                            logging.error(f"合并JSON行失败（文件：{original_file_path}）→ 错误：{str(e)}")
-                            continue
+                with open(original_file_path, 'rb') as original_file:
+                    shutil.copyfileobj(original_file, merge_file, ZIP_WRITE_BUFFER)
         
         # 合并成功后，删除源JSON文件
         if os.path.exists(merge_tidan_file) and os.path.getsize(merge_tidan_file) > 0:
@@ -421,7 +483,8 @@ if __name__ == "__main__":
     print(f"\n" + "="*60)
     print(f"开始压缩结果目录...")
     logging.info(f"开始压缩目录：{output_dir} → 压缩包：{zip_output_path}")
-    zip_success = zip_directory(output_dir, zip_output_path)
+    planned_files = [item for _, sub_planned in results for item in sub_planned]
+    zip_success = zip_directory(output_dir, zip_output_path, planned_files, force_zip64)
 
     # 4. 输出最终任务总结
     print(f"\n" + "="*80)
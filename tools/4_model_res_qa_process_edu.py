@@ -6,6 +6,8 @@ import multiprocessing as mp
 from tqdm import tqdm
 from collections import defaultdict
 import functools
+from jsonl_io import iter_lines, loads
+from qa_columnar import qa_file_name, remove_other_formats, write_qa_file
 
 def robust_json_parse(json_str):
     """更健壮的JSON解析方法，处理特殊字符和格式问题"""
@@ -16,7 +18,7 @@ def robust_json_parse(json_str):
         attempts += 1
         try:
             # 尝试标准解析
-            return json.loads(json_str), None
+            return loads(json_str), None
         except json.JSONDecodeError as e:
             # 特定错误修复
             error_msg = str(e).lower()
@@ -80,49 +82,99 @@ def robust_json_parse(json_str):
                 try:
                     # 尝试处理未转义的控制字符
                     cleaned_str = re.sub(r'[\x00-\x1f]', ' ', json_str)
-                    return json.loads(cleaned_str), None
+                    return loads(cleaned_str), None
                 except:
                     try:
                         # 尝试处理单引号问题
                         normalized_str = re.sub(r"'(.*?)'", r'"\1"', json_str)
-                        return json.loads(normalized_str), None
+                        return loads(normalized_str), None
                     except:
                         try:
                             # 处理Markdown代码块标记
                             clean_str = re.sub(r'^```json\s*|\s*```$', '', json_str, flags=re.MULTILINE)
                             clean_str = clean_str.strip()
-                            return json.loads(clean_str), None
+                            return loads(clean_str), None
                         except Exception as e2:
                             return None, f"解析失败: {str(e)}\n备用解析失败: {str(e2)}"
     
     return None, f"经过{max_attempts}次尝试后解析仍然失败"
 
+# 扫描 JSON 边界时只关心的字符：大括号、双引号、反斜杠
+JSON_BOUNDARY_PATTERN = re.compile(r'[{}"\\]')
+BRACE_PATTERN = re.compile(r'[{}]')
+
+def iter_outermost_json_spans(text, track_strings=True):
+    """
+    单遍扫描文本，惰性返回最外层 {} 的 (起始下标, 结束下标)。
+    track_strings=True 时跟踪字符串和转义状态，字符串内的大括号不计入层级；
+    若扫描结束时仍有未闭合的对象（多为模型输出中未转义的引号），从该对象起退回只数大括号。
+    """
+    pattern = JSON_BOUNDARY_PATTERN if track_strings else BRACE_PATTERN
+    depth = 0          # 大括号的嵌套层级
+    start = -1         # 当前最外层对象的起始下标
+    in_string = False
+    pos = 0
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            break
+        i = match.start()
+        char = text[i]
+        pos = i + 1
+        if in_string:
+            if char == '\\':
+                pos = i + 2  # 跳过被转义的字符
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            # 对象外的引号属于普通文本，忽略
+            if depth > 0:
+                in_string = True
+        elif char == '{':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif char == '}':
+            # 对象外多余的右大括号直接忽略，避免层级变为负数
+            if depth > 0:
+                depth -= 1
+                if depth == 0:
+                    yield start, i + 1
+
+    if depth > 0 and track_strings:
+        for span_start, span_end in iter_outermost_json_spans(text[start:], track_strings=False):
+            yield start + span_start, start + span_end
+
+def parse_qa_object(json_str):
+    """
+    解析一段 JSON 文本，是有效的题目对象（至少包含题目编号或背景知识）时返回该对象，否则返回 None
+    """
+    try:
+        json_obj, _ = robust_json_parse(json_str)
+    except:
+        return None  # 如果解析失败，忽略该段
+    if isinstance(json_obj, dict) and ("题目编号" in json_obj or "题目背景知识" in json_obj):
+        return json_obj
+    return None
+
 def extract_outermost_json_objects(text):
     """
     提取文本中以最外层 {} 为界的完整 JSON 数据。
+    按字符串跟踪切出的片段无法解析为题目对象时（多为未转义的引号使字符串边界错位，
+    把相邻的多个对象并成一段），改为只数大括号重新切分该片段，再逐段解析。
     """
     json_objects = []  # 存储完整的 JSON 对象
-    buffer = ""        # 临时存储当前正在处理的内容
-    brace_count = 0    # 记录大括号的嵌套层级
 
-    # 按字符逐一处理文本
-    for char in text:
-        if char == '{':
-            brace_count += 1  # 遇到左大括号，嵌套层级加1
-        elif char == '}':
-            brace_count -= 1  # 遇到右大括号，嵌套层级减1
-
-        buffer += char  # 把当前字符添加到暂存区
-        if brace_count == 0 and buffer.strip():  # 如果嵌套层级归0，意味着找到一个完整的 JSON 对象
-            try:
-                # 尝试解析 JSON 数据
-                json_obj,_ = robust_json_parse(buffer.strip())
-                # 验证是否是有效的题目对象（至少包含题目编号或背景知识）
-                if isinstance(json_obj, dict) and ("题目编号" in json_obj or "题目背景知识" in json_obj):
-                     json_objects.append(json_obj)
-            except:
-                pass  # 如果解析失败，忽略该段
-            buffer = ""  # 清空缓冲区，准备处理下一个 JSON 对象
+    for start, end in iter_outermost_json_spans(text):
+        json_obj = parse_qa_object(text[start:end])
+        if json_obj is not None:
+            json_objects.append(json_obj)
+            continue
+        span = text[start:end]
+        for sub_start, sub_end in iter_outermost_json_spans(span, track_strings=False):
+            json_obj = parse_qa_object(span[sub_start:sub_end])
+            if json_obj is not None:
+                json_objects.append(json_obj)
 
     return json_objects
 
@@ -154,69 +206,66 @@ def process_single_file(args):
     source_type = match.group(2) if match else source_type_default
 
     # 读取并初步处理输入文件
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        for line_num, line in enumerate(infile, start=1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                original_data = json.loads(line)
-            except json.JSONDecodeError as e:
-                continue
+    for line_num, line in iter_lines(input_file):
+        try:
+            original_data = loads(line)
+        except json.JSONDecodeError as e:
+            continue
 
-            section = original_data['id'].get("file_name", "unknown_section")
+        section = original_data['id'].get("file_name", "unknown_section")
 
-            # 提取基础字段 (不包括 query)
-            base_fields = {
-                "img_path": original_data['id'].get("img_path", [str(line_num)]),
-                "source_type": original_data['id'].get("source_type", source_type),
-                "section": original_data['id'].get("section", section),
-                "url": original_data['id'].get("url", None)
-            }
+        # 提取基础字段 (不包括 query)
+        base_fields = {
+            "img_path": original_data['id'].get("img_path", [str(line_num)]),
+            "source_type": original_data['id'].get("source_type", source_type),
+            "section": original_data['id'].get("section", section),
+            "url": original_data['id'].get("url", None)
+        }
 
-            if 'answer_mode4' in original_data:
-                answer_mode4_content = original_data.get("answer_mode4", "")
-            elif 'answer' in original_data:
-                answer_mode4_content = original_data.get("answer", "")
-            else:
-                logging.info('模型结果答案字段异常')
-            
-            # 尝试解析 answer_mode4 中的 JSON 对象
-            parsed_objects = []
-            if isinstance(answer_mode4_content, str) and answer_mode4_content.strip():
-                # 使用提供的函数尝试解析
-                parsed_objects = extract_outermost_json_objects(answer_mode4_content)
-            elif isinstance(answer_mode4_content, dict):
-                # 如果已经是 dict
-                parsed_objects = [answer_mode4_content]
+        if 'answer_mode4' in original_data:
+            answer_mode4_content = original_data.get("answer_mode4", "")
+        elif 'answer' in original_data:
+            answer_mode4_content = original_data.get("answer", "")
+        else:
+            logging.info('模型结果答案字段异常')
+        
+        # 尝试解析 answer_mode4 中的 JSON 对象
+        parsed_objects = []
+        if isinstance(answer_mode4_content, str) and answer_mode4_content.strip():
+            # 使用提供的函数尝试解析
+            parsed_objects = extract_outermost_json_objects(answer_mode4_content)
+        elif isinstance(answer_mode4_content, dict):
+            # 如果已经是 dict
+            parsed_objects = [answer_mode4_content]
 
-            if len(parsed_objects) == 0:
-                scan_file_list.append(base_fields['section'])
+        if len(parsed_objects) == 0:
+            scan_file_list.append(base_fields['section'])
 
-            # 根据解析出的对象进行拆分和重组
-            for answer_obj in parsed_objects:
-                if not isinstance(answer_obj, dict):
-                    continue # 安全检查
+        # 根据解析出的对象进行拆分和重组
+        for answer_obj in parsed_objects:
+            if not isinstance(answer_obj, dict):
+                continue # 安全检查
 
-                # 情况1: 包含共享背景知识 (有 "题目背景知识" 和 "sub_qa")
-                if "题目背景知识" in answer_obj and "sub_qa" in answer_obj:
-                    new_record = {**base_fields, **answer_obj}
-                    all_processed_records.append(new_record)
-                
-                # 情况2: 独立题干 (看起来像一个独立的题目对象，有 "题目编号")
-                elif "题目编号" in answer_obj:
-                    background_info = {
-                        "题目是否包含背景知识": "否",
-                        "题目背景知识": "无",
-                    }
-                    new_record = {**base_fields, **background_info, **answer_obj}
-                    all_processed_records.append(new_record)
+            # 情况1: 包含共享背景知识 (有 "题目背景知识" 和 "sub_qa")
+            if "题目背景知识" in answer_obj and "sub_qa" in answer_obj:
+                new_record = {**base_fields, **answer_obj}
+                all_processed_records.append(new_record)
+            
+            # 情况2: 独立题干 (看起来像一个独立的题目对象，有 "题目编号")
+            elif "题目编号" in answer_obj:
+                background_info = {
+                    "题目是否包含背景知识": "否",
+                    "题目背景知识": "无",
+                }
+                new_record = {**base_fields, **background_info, **answer_obj}
+                all_processed_records.append(new_record)
 
     return all_processed_records, scan_file_list
 
-def process_and_split_jsonl(input_dir, output_dir):
+def process_and_split_jsonl(input_dir, output_dir, qa_format="jsonl"):
     """
-    并行处理JSONL文件，提取字段，拆分answer_mode4，并按source_type和section组织输出为JSON Lines。
+    并行处理JSONL文件，提取字段，拆分answer_mode4，并按source_type和section组织输出。
+    qa_format 为输出格式：jsonl（JSON Lines）或 parquet（列式，需要 pyarrow）
     """
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
@@ -277,14 +326,13 @@ def process_and_split_jsonl(input_dir, output_dir):
             safe_section = "".join(c for c in section if c.isalnum() or c in (' ', '-', '_')).rstrip()
             safe_section = safe_section.replace(' ', '_')
 
-            # 处理重名文件 (JSON Lines 格式)
-            file_path = os.path.join(source_dir, f"{safe_section}.json")
+            # 处理重名文件
+            file_path = os.path.join(source_dir, qa_file_name(safe_section, qa_format))
             
-            # 写入 JSON Lines 文件 (每行一个 JSON 对象)
+            # 写入中间文件（JSON Lines 每行一个 JSON 对象，parquet 为记录表和小问表）
             try:
-                with open(file_path, 'w', encoding='utf-8') as outfile:
-                    for record in section_records:
-                        outfile.write(json.dumps(record, ensure_ascii=False) + '\n')
+                write_qa_file(file_path, section_records)
+                remove_other_formats(file_path)
                 logging.info(f"已创建文件: {file_path} (包含 {len(section_records)} 条记录)")
             except Exception as e:
                 logging.error(f"[错误] 写入文件 {file_path} 时失败: {e}")
@@ -297,6 +345,8 @@ if __name__ == "__main__":
     # 或者修改 input_jsonl_file 为文件的完整路径
     root = sys.argv[1]
     batch = sys.argv[2]
+    # 可选第三个参数：输出格式 jsonl（默认）或 parquet
+    qa_format = sys.argv[3] if len(sys.argv) > 3 else "jsonl"
     input_dir = rf"{root}/{batch}/5_model_res_qa_{batch}"
     output_dir = rf"{root}/{batch}/6_extract_qa_{batch}"
     os.makedirs(output_dir, exist_ok=True)
@@ -308,4 +358,4 @@ if __name__ == "__main__":
         filemode='w'
     )
 
-    process_and_split_jsonl(input_dir, output_dir)
\ No newline at end of file
+    process_and_split_jsonl(input_dir, output_dir, qa_format)
\ No newline at end of file
@@ -1,21 +1,34 @@
-import json
 import os, sys
 import logging
+import multiprocessing as mp
+from array import array
 from collections import defaultdict
 from tqdm import tqdm
 from data_filter_fuc_edu import *
-from rapidfuzz import process, fuzz
-import hashlib
+from qa_dedup_index import NearDupIndex, SpilledNearDupIndex, DedupStore, check_dedup, subject_key, text_digest
+from jsonl_io import JsonlWriter, loads
+from qa_columnar import (ColumnFlags, is_parquet, is_qa_file, qa_file_stem, read_qa_tables, remove_other_formats,
+                         tables_to_records, write_qa_file)
+from token_count import TokenCounter, load_calibration, set_token_counter
+from filter_rules import get_filter_rules
 
 
-def check_dedup(text1, text2, ps_th=80, fs_th=80):
+# 超过该大小的输入文件自动使用流式去重：不保留记录和题目文本，gram 倒排表落在临时 SQLite 库中，
+# 内存中只保留每道题目的 gram 数、文本摘要和记录偏移（每道题目数百字节），以及有上限的写入缓冲和 SQLite 页缓存
+STREAMING_FILE_SIZE = 256 * 1024 * 1024
+
+# 初步筛选按批执行，每批的记录数
+FILTER_BATCH_SIZE = 512
+
+# process_record 未传入预先计算的筛选结果时，逐条执行检查
+UNCHECKED = object()
+
+
+def filter_chain(source_type):
     """
-    使用 rapidfuzz 进行文本相似度比较，提高去重效率
+    根据 source_type 选择 DataFilter 的检查链（映射关系见 filter_rules.yaml），未知 source_type 返回 None
     """
-    partial_similarity = fuzz.partial_ratio(text1, text2)  # 部分匹配比率
-    full_similarity = fuzz.ratio(text1, text2)  # 完全匹配比率
-    # 两个相似度任意一个超过阈值都判定重复
-    return partial_similarity >= ps_th or full_similarity >= fs_th
+    return get_filter_rules().chain_for(source_type)
 
 
 def replace_with_none(lst, target):
@@ -28,6 +41,13 @@ def replace_with_none(lst, target):
     return lst
 
 
+def split_qa_count(record):
+    """
+    记录拆分后的题量：共享题干按小问计数
+    """
+    return len(record["sub_qa"]) if "sub_qa" in record else 1
+
+
 def sanitize_record(record):
     """
     在写入前标准化 None 字段为空字符串
@@ -60,62 +80,61 @@ class QuestionDeduplicator:
     """
     题目去重器，用于高效处理大量题目的去重工作
     """
-    def __init__(self):
-        self.record_list = []  # 具体记录
+    def __init__(self, store=None, source_path=None):
+        self.record_list = []  # 具体记录；流式模式下为记录在输入文件中的字节偏移
         self.final_dedup_record_index = []  # 决定最终记录是否写入去重文件
-        self.q_list = []  # 所有题目信息，方便快速查重
-        self.q_dict = defaultdict(lambda: defaultdict(list))  # 所有题目在record中对应的index
+        # 流式模式：不保留记录和题目文本，需要历史记录、校验相似题目或写出结果时按偏移从输入文件重新读取
+        self.source_file = open(source_path, 'rb') if source_path else None
+        # 所有题目信息的近似重复索引，方便快速查重；流式模式下索引不保存文本（按题目来源回读），倒排表放在临时库
+        if self.source_file is None:
+            self.q_index = NearDupIndex()
+        else:
+            self.q_index = SpilledNearDupIndex(text_source=self._question_text)
+        self.q_record = array('q')  # 索引中每道题目所在记录的下标
+        self.q_sub = array('i')  # 索引中每道题目在 sub_qa 中的下标，独立题干为 -1
+        self.q_dict = defaultdict(lambda: defaultdict(list))  # 所有题目（文本摘要）在record中对应的index
         self.record_index = -1
         self.data_filter = DataFilter()
-        # 使用哈希表加速查找
-        self.q_hash = {}  # 题目内容的hash值到题目列表索引的映射
+        self.store = store  # 跨批次持久化去重库（DedupStore），为None时只做文件内去重
 
-    def _get_text_hash(self, text):
+    def _get_record(self, index):
         """
-        计算文本的hash值，用于快速筛选候选匹配项
+        按记录下标取出完整记录
         """
-        return hashlib.md5(text.encode('utf-8')).hexdigest()[:8]
+        if self.source_file is None:
+            return self.record_list[index]
+        self.source_file.seek(self.record_list[index])
+        return loads(self.source_file.readline())
+
+    def _question_text(self, q_idx):
+        """
+        流式模式下按索引中的题目下标回读题目文本
+        """
+        record = self._get_record(self.q_record[q_idx])
+        sub_i = self.q_sub[q_idx]
+        return record['sub_qa'][sub_i]['题目内容'] if sub_i >= 0 else record['题目内容']
+
+    def _index_question(self, q, sub_i=None):
+        """
+        将当前记录的题目加入索引和字典，sub_i 为共享题干中的小问下标
+        """
+        self.q_index.add(q)
+        self.q_record.append(self.record_index)
+        self.q_sub.append(-1 if sub_i is None else sub_i)
+        entry = self.q_dict[text_digest(q)]
+        entry['record_index'].append(self.record_index)
+        entry['sub_index'].append(sub_i)
+
+    def close(self):
+        if self.source_file is not None:
+            self.source_file.close()
+            self.q_index.close()
 
     def _find_similar_questions(self, q):
         """
-        使用hash优化的方法寻找相似题目
+        在近似重复索引中寻找与q判重（check_dedup为真）的最相似题目
         """
-        # 如果q_list为空，直接返回None
-        if not self.q_list:
-            return None
-            
-        # 使用hash进行快速筛选
-        q_hash = self._get_text_hash(q)
-        candidates = []
-        
-        # 如果有相同的hash，则优先检查这些候选
-        if q_hash in self.q_hash:
-            for idx in self.q_hash[q_hash]:
-                candidates.append((self.q_list[idx], idx))
-        
-        # 如果候选较少，也加入一些相邻的题目作为候选
-        if len(candidates) < 10 and len(self.q_list) > 0:
-            # 添加最近的几个题目作为候选
-            start_idx = max(0, len(self.q_list) - 10)
-            for i in range(start_idx, len(self.q_list)):
-                if i not in [idx for _, idx in candidates]:
-                    candidates.append((self.q_list[i], i))
-        
-        # 如果仍然没有候选，则使用全部题目
-        if not candidates:
-            candidates = [(q_text, i) for i, q_text in enumerate(self.q_list)]
-            
-        # 使用rapidfuzz找出最佳匹配
-        if candidates:
-            candidate_texts = [text for text, _ in candidates]
-            best_match = process.extractOne(q, candidate_texts)
-            if best_match is not None:
-                best_text, score, idx = best_match
-                # 找到原始索引
-                original_idx = candidates[idx][1]
-                return best_text, original_idx
-                
-        return None
+        return self.q_index.find_best(q)
 
     def _process_shared_questions(self, record):
         """
@@ -131,22 +150,14 @@ class QuestionDeduplicator:
             match_result = self._find_similar_questions(q)
             if match_result is not None:
                 best_match_text, best_match_idx = match_result
-                is_dedup = check_dedup(q, best_match_text)
-                dedup_record_index = self.q_dict[best_match_text]['record_index']
+                dedup_record_index = self.q_dict[text_digest(best_match_text)]['record_index']
 
                 for i in dedup_record_index:
-                    if is_dedup and (i is not None):
+                    if i is not None:
                         dedup_record_index_list.append(i)
 
-            # 更新题目列表和字典
-            self.q_list.append(q)
-            q_hash = self._get_text_hash(q)
-            if q_hash not in self.q_hash:
-                self.q_hash[q_hash] = []
-            self.q_hash[q_hash].append(len(self.q_list) - 1)
-            
-            self.q_dict[q]['record_index'].append(self.record_index)
-            self.q_dict[q]['sub_index'].append(sub_i)
+            # 更新题目索引和字典
+            self._index_question(q, sub_i)
 
         # 处理重复情况
         return self._handle_shared_duplicates(record, dedup_record_index_list)
@@ -163,11 +174,11 @@ class QuestionDeduplicator:
         # 有重复
         if len(set(dedup_record_index_list)) > 1:
             self.final_dedup_record_index.append(None)
-            logging.info(f'==========与多个记录重复==========\n当前记录:{record}\n重复记录:{[self.record_list[i] for i in dedup_record_index_list]}')
+            logging.info(f'==========与多个记录重复==========\n当前记录:{record}\n重复记录:{[self._get_record(i) for i in dedup_record_index_list]}')
             return True
 
         # 判断到底是留历史记录还是新记录
-        history_record = self.record_list[dedup_record_index_list[0]]
+        history_record = self._get_record(dedup_record_index_list[0])
         if 'sub_qa' in history_record:  # 历史记录为共享题干
             logging.info(f'共享题干-共享题干重复：\n{record}\n{history_record}')
             bg = record['题目背景知识']
@@ -181,9 +192,9 @@ class QuestionDeduplicator:
                     logging.info(f'共享题干内部小问重复，可能有识别错误\n当前记录:{record}')
                     return True
                 for history_qa in history_record['sub_qa']:
-                    history_q = history_qa['题目内容']
-                    self.q_dict[history_q]['record_index'] = replace_with_none(
-                        self.q_dict[history_q]['record_index'], 
+                    history_key = text_digest(history_qa['题目内容'])
+                    self.q_dict[history_key]['record_index'] = replace_with_none(
+                        self.q_dict[history_key]['record_index'], 
                         dedup_record_index_list[0]
                     )
                 self.final_dedup_record_index.append(self.record_index)
@@ -194,9 +205,9 @@ class QuestionDeduplicator:
         else:  # 历史记录为独立题干，没有背景信息，选择保留当前记录
             logging.info(f'共享题干-独立题干重复：\n{record}\n{history_record}')
             self.final_dedup_record_index[dedup_record_index_list[0]] = None  # 删除历史记录
-            history_q = history_record['题目内容']
-            self.q_dict[history_q]['record_index'] = replace_with_none(
-                self.q_dict[history_q]['record_index'], 
+            history_key = text_digest(history_record['题目内容'])
+            self.q_dict[history_key]['record_index'] = replace_with_none(
+                self.q_dict[history_key]['record_index'], 
                 dedup_record_index_list[0]
             )
             self.final_dedup_record_index.append(self.record_index)
@@ -212,22 +223,21 @@ class QuestionDeduplicator:
         match_result = self._find_similar_questions(q)
         if match_result is not None:
             best_match_text, best_match_idx = match_result
-            is_dedup = check_dedup(q, best_match_text)
-            dedup_record_index = self.q_dict[best_match_text]['record_index']
+            dedup_record_index = self.q_dict[text_digest(best_match_text)]['record_index']
             unique_non_none_elements = {x for x in dedup_record_index if x is not None}
             
             # 判断是否一个best_match_text对应了多个记录
             if len(unique_non_none_elements) > 1:
                 self.final_dedup_record_index.append(None)
                 valid_dup_indices = [i for i in dedup_record_index if i is not None]
-                logging.info(f'==========与多个记录重复==========\n当前记录:{record}\n重复记录:{[self.record_list[i] for i in valid_dup_indices]}')
+                logging.info(f'==========与多个记录重复==========\n当前记录:{record}\n重复记录:{[self._get_record(i) for i in valid_dup_indices]}')
                 # 更新题目列表和字典
                 self._update_question_data(q)
                 return True
 
-            if is_dedup and (len(unique_non_none_elements) > 0):  # 重复的情况
+            if len(unique_non_none_elements) > 0:  # 重复的情况
                 i = unique_non_none_elements.pop()
-                history_record = self.record_list[i]
+                history_record = self._get_record(i)
                 if 'sub_qa' in history_record:  # 历史记录为共享题干，保留历史记录
                     logging.info(f'独立题干-共享题干重复：\n{record}\n{history_record}')
                     # 更新题目列表和字典
@@ -237,9 +247,9 @@ class QuestionDeduplicator:
                 else:  # 历史记录也为独立题干时，保留最新的
                     logging.info(f'独立题干-独立题干重复：\n{record}\n{history_record}')
                     self.final_dedup_record_index[i] = None
-                    history_q = history_record['题目内容']
-                    self.q_dict[history_q]['record_index'] = replace_with_none(
-                        self.q_dict[history_q]['record_index'], 
+                    history_key = text_digest(history_record['题目内容'])
+                    self.q_dict[history_key]['record_index'] = replace_with_none(
+                        self.q_dict[history_key]['record_index'], 
                         i
                     )
 
@@ -250,60 +260,94 @@ class QuestionDeduplicator:
 
     def _update_question_data(self, q):
         """
-        更新题目数据到列表和字典中
+        更新题目数据到索引和字典中
         """
-        self.q_list.append(q)
-        q_hash = self._get_text_hash(q)
-        if q_hash not in self.q_hash:
-            self.q_hash[q_hash] = []
-        self.q_hash[q_hash].append(len(self.q_list) - 1)
-        
-        self.q_dict[q]['record_index'].append(self.record_index)
-        self.q_dict[q]['sub_index'].append(None)
+        self._index_question(q)
 
-    def _filter_record(self, record):
+    def filter_batch(self, records, column_flags=None, first_row=0):
         """
-        对记录进行初步筛选
+        批量执行初步筛选，返回每条记录的错误类型（通过为 None），同一检查链的记录一起检查
+        未知 source_type 的记录留给 _filter_record 处理
+        column_flags 为 parquet 输入文件的列式预判结果，first_row 为本批第一条记录在文件中的行号
         """
-        source_type = record['source_type']
-        # 粗筛
-        if '英语' in source_type:
-            check_result = self.data_filter.check_english(record)
-        elif '政治' in source_type or '道德与法治' in source_type:
-            check_result = self.data_filter.check_politics(record)
-        elif '历史' in source_type:
-            check_result = self.data_filter.check_history(record)
-        elif '语文' in source_type:
-            check_result = self.data_filter.check_chinese(record)
-        elif '文综' in source_type:
-            check_result = self.data_filter.check_history(record)
-        elif '雅思托福真题01' in source_type:
-            check_result = self.data_filter.check_english(record)
-        else:
+        err_types = [None] * len(records)
+        chain_indices = defaultdict(list)
+        for i, record in enumerate(records):
+            chain = filter_chain(record['source_type'])
+            if chain is not None:
+                chain_indices[chain].append(i)
+        for chain, indices in chain_indices.items():
+            chain_err_types = self.data_filter.check_batch([records[i] for i in indices], chain, column_flags,
+                                                           [first_row + i for i in indices])
+            for i, err_type in zip(indices, chain_err_types):
+                err_types[i] = err_type
+        return err_types
+
+    def _filter_record(self, record, err_type=UNCHECKED):
+        """
+        对记录进行初步筛选，err_type 为 filter_batch 预先计算的结果
+        """
+        chain = filter_chain(record['source_type'])
+        if chain is None:
             logging.error(f'source type错误！')
             self.final_dedup_record_index.append(None)
             record['err_type'] = '未知source_type'
             return False, record
 
-        if check_result is not False:
+        # 粗筛
+        if err_type is UNCHECKED:
+            check_result = self.data_filter.check_chain(record, chain)
+            err_type = check_result[1] if check_result is not False else None
+
+        if err_type is not None:
             self.final_dedup_record_index.append(None)
-            _, record['err_type'] = check_result
+            record['err_type'] = err_type
             return False, record
 
         return True, record
 
-    def process_record(self, record):
+    def _record_questions(self, record):
         """
-        处理单条记录
+        记录中参与去重的题目内容列表
         """
-        self.record_list.append(record)
+        if 'sub_qa' in record:
+            return [qa['题目内容'] for qa in record['sub_qa']]
+        return [record['题目内容']]
+
+    def _is_history_duplicate(self, record):
+        """
+        检查记录是否与去重库中的历史题目重复；
+        共享题干记录没有历史背景知识可比，只有全部小问都命中时才判定重复
+        """
+        questions = self._record_questions(record)
+        if not questions:
+            return False
+        subject = subject_key(record['source_type'])
+        for q in questions:
+            match_result = self.store.find_best(subject, q)
+            if match_result is None:
+                return False
+        return True
+
+    def process_record(self, record, offset=None, err_type=UNCHECKED):
+        """
+        处理单条记录，流式模式下需传入记录在输入文件中的字节偏移
+        err_type 为 filter_batch 预先计算的筛选结果，未传入时逐条筛选
+        """
+        self.record_list.append(record if self.source_file is None else offset)
         self.record_index += 1
 
         # 初步筛选
-        passed_filter, processed_record = self._filter_record(record)
+        passed_filter, processed_record = self._filter_record(record, err_type)
         if not passed_filter:
             return processed_record
 
+        # 与历史批次重复的记录在文件内去重前直接筛除
+        if self.store is not None and self._is_history_duplicate(record):
+            self.final_dedup_record_index.append(None)
+            record['err_type'] = '历史批次重复'
+            return record
+
         # 根据题型分别处理
         if 'sub_qa' in record:
             # 共享题干数据
@@ -314,52 +358,195 @@ class QuestionDeduplicator:
 
         return record
 
+    def _iter_results(self):
+        """
+        按顺序返回留存的记录（None 字段已标准化为空字段）
+        """
+        for index in self.final_dedup_record_index:
+            if index is not None:
+                yield sanitize_record(self._get_record(index))
+
     def write_results(self, output_file_path):
         """
-        将去重后的结果写入文件
+        将去重后的结果写入文件，输出格式与输入文件一致（jsonl 或 parquet）
         """
+        if is_parquet(output_file_path):
+            records = list(self._iter_results())
+            write_qa_file(output_file_path, records)
+            return sum(split_qa_count(record) for record in records)
+
         split_qa_num = 0
-        with open(output_file_path, 'w', encoding='utf-8') as output_file:
-            for index in self.final_dedup_record_index:
-                if index is not None:
-                    record = self.record_list[index]
-                    # 标准化 None 字段为空字段
-                    record = sanitize_record(record)
-
-                    if "sub_qa" in record:
-                        split_qa_num += len(record["sub_qa"])
-                    else:
-                        split_qa_num += 1
-                    output_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        with JsonlWriter(output_file_path) as output_file:
+            for record in self._iter_results():
+                split_qa_num += split_qa_count(record)
+                output_file.write(record)
         
         return split_qa_num
 
+    def save_to_store(self, batch, section):
+        """
+        将留存记录的题目追加到去重库
+        """
+        for index in self.final_dedup_record_index:
+            if index is not None:
+                record = self._get_record(index)
+                subject = subject_key(record['source_type'])
+                for q in self._record_questions(record):
+                    self.store.add(subject, q, batch=batch, section=section)
+        self.store.commit()
+
 
-def dedup_by_file(input_file_path, output_file_path, err_file_path):
+def dedup_by_file(input_file_path, output_file_path, err_file_path, store=None, batch='', streaming=None):
     """
-    对单个文件进行去重处理
+    对单个文件进行去重处理，传入store时同时与历史批次去重并追加留存题目
+    streaming为None时，超过STREAMING_FILE_SIZE的文件自动使用流式模式，输出与非流式一致
+    parquet 输入文件不支持流式模式（按字节偏移回读），始终整体读入
     """
-    deduplicator = QuestionDeduplicator()
-
-    with open(input_file_path, 'r', encoding='utf-8') as input_file, \
-         open(err_file_path, 'w', encoding='utf-8') as err_file:
-        
-        for line in input_file:
-            record = json.loads(line)
-            processed_record = deduplicator.process_record(record)
-            
-            # 如果记录被过滤掉，写入错误文件
-            if processed_record is not record:
-                err_file.write(json.dumps(processed_record, ensure_ascii=False) + '\n')
+    if is_parquet(input_file_path):
+        streaming = False
+    elif streaming is None:
+        streaming = os.path.getsize(input_file_path) > STREAMING_FILE_SIZE
+    deduplicator = QuestionDeduplicator(store, input_file_path if streaming else None)
+
+    column_flags = None
+    with JsonlWriter(err_file_path) as err_file:
+        def process_batch(pending, first_row=0):
+            # 先批量筛选，再按顺序逐条去重
+            err_types = deduplicator.filter_batch([record for record, _ in pending], column_flags, first_row)
+            for (record, offset), err_type in zip(pending, err_types):
+                processed_record = deduplicator.process_record(record, offset, err_type)
+                # 如果记录被过滤掉，写入错误文件
+                if 'err_type' in processed_record:
+                    err_file.write(processed_record)
+            pending.clear()
+
+        pending = []
+        first_row = 0  # 本批第一条记录在 parquet 文件中的行号
+        if is_parquet(input_file_path):
+            # 答案缺失、题目过短先在列上批量预判，只有预判不能确定的记录逐条检查
+            record_table, sub_table = read_qa_tables(input_file_path)
+            column_flags = ColumnFlags(record_table, sub_table, deduplicator.data_filter.INVALID_ANSWERS)
+            for record in tables_to_records(record_table, sub_table):
+                pending.append((record, None))
+                if len(pending) >= FILTER_BATCH_SIZE:
+                    batch_size = len(pending)
+                    process_batch(pending, first_row)
+                    first_row += batch_size
+        else:
+            with open(input_file_path, 'rb') as input_file:
+                offset = 0
+                for line in input_file:
+                    pending.append((loads(line), offset))
+                    offset += len(line)
+                    if len(pending) >= FILTER_BATCH_SIZE:
+                        process_batch(pending)
+        process_batch(pending, first_row)
 
     total_num = len(deduplicator.final_dedup_record_index)
     count_none = len(list(filter(lambda x: x is None, deduplicator.final_dedup_record_index)))
     left_num = total_num - count_none
     split_qa_num = deduplicator.write_results(output_file_path)
+    remove_other_formats(output_file_path)
+    if store is not None:
+        deduplicator.save_to_store(batch, os.path.basename(input_file_path))
+    deduplicator.close()
     
     return total_num, count_none, left_num, split_qa_num
 
 
+def plan_sub_folder(input_dir, output_dir, sub_folder):
+    """
+    收集单个子文件夹的待处理文件（输入、输出、错误文件路径），并创建输出目录
+    """
+    subfolder_path = os.path.join(input_dir, sub_folder)
+    output_subfolder = os.path.join(output_dir, sub_folder)
+    os.makedirs(output_subfolder, exist_ok=True)
+    os.makedirs(output_subfolder+'err', exist_ok=True)
+    file_tasks = []
+    for filename in os.listdir(subfolder_path):
+        if is_qa_file(filename):
+            input_file_path = os.path.join(subfolder_path, filename)
+            output_file_path = os.path.join(output_subfolder, filename)
+            # 错误文件始终为 JSON Lines，便于人工查看
+            err_file_path = os.path.join(output_subfolder+'err', f'err_{qa_file_stem(filename)}.json')
+            file_tasks.append((input_file_path, output_file_path, err_file_path))
+    return file_tasks
+
+
+def report_sub_folder(sub_folder, total_num, count_none, left_num, split_qa_num):
+    """
+    输出单个子文件夹的去重统计
+    """
+    logging.info(f'批次{sub_folder}: 原始题量-{total_num} 筛除题量-{count_none} 留存题量-{left_num} 拆分题量-{split_qa_num}')
+    print(f'批次{sub_folder}: 原始题量-{total_num} 筛除题量-{count_none} 留存题量-{left_num} 拆分题量-{split_qa_num}')
+
+
+def dedup_sub_folder(input_dir, output_dir, sub_folder, store=None, batch=''):
+    """
+    串行处理单个子文件夹，返回该子文件夹的 (原始题量, 筛除题量, 留存题量, 拆分题量)
+    """
+    totals = [0, 0, 0, 0]
+    for input_file_path, output_file_path, err_file_path in plan_sub_folder(input_dir, output_dir, sub_folder):
+        stats = dedup_by_file(input_file_path, output_file_path, err_file_path, store, batch)
+        totals = [a + b for a, b in zip(totals, stats)]
+    report_sub_folder(sub_folder, *totals)
+    return tuple(totals)
+
+
+class ListLogHandler(logging.Handler):
+    """
+    收集子进程中的日志记录，交由主进程按串行顺序回放到日志文件
+    """
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # 提前格式化消息，保证记录可以跨进程传输
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def dedup_shard(args):
+    """
+    进程池任务：按顺序处理一组文件，返回每个文件的统计结果、日志记录和筛选检查的执行统计
+    """
+    file_tasks, store_path, batch = args
+    handler = ListLogHandler()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [handler]
+    root_logger.setLevel(logging.INFO)
+
+    store = DedupStore(store_path) if store_path else None
+    rule_stats = get_filter_rules().stats
+    results = []
+    for input_file_path, output_file_path, err_file_path in file_tasks:
+        handler.records = []
+        rule_snapshot = rule_stats.snapshot()
+        stats = dedup_by_file(input_file_path, output_file_path, err_file_path, store, batch)
+        results.append((input_file_path, stats, handler.records, rule_stats.since(rule_snapshot)))
+    if store is not None:
+        store.close()
+    return results
+
+
+def plan_shards(plan, store_path):
+    """
+    将待处理文件划分为进程池任务：
+    不使用去重库时每个文件独立成一个任务；
+    使用去重库时同一学科（共用去重库分区）的文件按串行顺序放在同一任务中，保证结果与串行一致
+    """
+    if not store_path:
+        return [[file_task] for _, file_tasks in plan for file_task in file_tasks]
+
+    shards = defaultdict(list)
+    for sub_folder, file_tasks in plan:
+        shards[subject_key(sub_folder)].extend(file_tasks)
+    return list(shards.values())
+
+
 if __name__ == "__main__":
     # 请确保 Pasted_Text_1754376870865.txt 文件与脚本在同一目录下
     # 或者修改 input_jsonl_file 为文件的完整路径、
@@ -367,6 +554,12 @@ if __name__ == "__main__":
     # batch = '8.18重新传输文件-22'
     root = sys.argv[1]
     batch = sys.argv[2]
+    # 可选第三个参数：跨批次去重库路径（SQLite），不传或传空字符串则只做文件内去重
+    store_path = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] else None
+    # 可选第四个参数：进程数，大于1时按子文件夹/文件分片并行处理，输出与串行一致
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    # 可选第五个参数：分词计数标定文件（token_count.py 生成），传入时长度过滤使用近似计数，误差范围内回退 jieba
+    calibration_path = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] else None
     input_dir = rf"{root}/{batch}/6_extract_qa_{batch}" 
     output_dir = rf"{root}/{batch}/7_qa_filter_{batch}"
     # input_dir = rf"/yrfs2/ftpdata/zyzhou28/code/文科切题ocr多模/{batch}/5_qa_filter" 
@@ -388,22 +581,58 @@ if __name__ == "__main__":
     print(f"输出目录: {output_dir}")
     print(f"找到 {len(sub_folders)} 个子文件夹，开始处理...")
 
+    if calibration_path:
+        set_token_counter(TokenCounter("approx", load_calibration(calibration_path)))
+        print(f"长度过滤使用近似分词计数，标定文件: {calibration_path}")
+
+    store = None
+    if store_path:
+        store = DedupStore(store_path)
+        dropped = store.drop_batch(batch)
+        print(f"去重库: {store_path}（清理本批次旧数据 {dropped} 条）")
+        logging.info(f"去重库: {store_path}，清理本批次旧数据 {dropped} 条")
+
+    # 按串行处理顺序收集每个子文件夹的待处理文件
+    plan = []
     for sub_folder in sub_folders:
-        subfolder_path = os.path.join(input_dir, sub_folder)
-        output_subfolder = os.path.join(output_dir, sub_folder)
-        os.makedirs(output_subfolder, exist_ok=True)
-        os.makedirs(output_subfolder+'err', exist_ok=True)
+        plan.append((sub_folder, plan_sub_folder(input_dir, output_dir, sub_folder)))
+
+    # 并行模式：各分片在子进程中处理，统计结果和日志回传主进程
+    shard_results = {}
+    if workers > 1:
+        if store is not None:
+            store.close()
+            store = None
+        shards = plan_shards(plan, store_path)
+        args_list = [(file_tasks, store_path, batch) for file_tasks in shards]
+        with mp.Pool(processes=max(1, min(workers, len(shards)))) as pool:
+            for results in tqdm(pool.imap_unordered(dedup_shard, args_list), total=len(args_list), desc="去重分片"):
+                for input_file_path, stats, records, rule_counters in results:
+                    shard_results[input_file_path] = (stats, records)
+                    get_filter_rules().stats.merge(rule_counters)
+
+    for sub_folder, file_tasks in plan:
         total_num_sub_folder, count_none_sub_folder, left_num_sub_folder, split_qa_sub_folder = 0, 0, 0, 0
-        for filename in tqdm(os.listdir(subfolder_path)):
-            if filename.endswith(".json"):
-                input_file_path = os.path.join(subfolder_path, filename)
-                output_file_path = os.path.join(output_subfolder, filename)
-                err_file_path = os.path.join(output_subfolder+'err', f'err_{filename}')
+        for input_file_path, output_file_path, err_file_path in (file_tasks if workers > 1 else tqdm(file_tasks)):
+            if workers > 1:
+                # 按串行顺序回放子进程日志并合并统计
+                (total_num, count_none, left_num, split_qa_num), records = shard_results[input_file_path]
+                for record in records:
+                    logging.getLogger().handle(record)
+            else:
                 # print(f'正在处理{input_file_path}')
-                total_num, count_none, left_num, split_qa_num = dedup_by_file(input_file_path, output_file_path, err_file_path)
-                total_num_sub_folder += total_num
-                count_none_sub_folder += count_none
-                left_num_sub_folder += left_num
-                split_qa_sub_folder += split_qa_num
-        logging.info(f'批次{sub_folder}: 原始题量-{total_num_sub_folder} 筛除题量-{count_none_sub_folder} 留存题量-{left_num_sub_folder} 拆分题量-{split_qa_sub_folder}')
-        print(f'批次{sub_folder}: 原始题量-{total_num_sub_folder} 筛除题量-{count_none_sub_folder} 留存题量-{left_num_sub_folder} 拆分题量-{split_qa_sub_folder}')
\ No newline at end of file
+                total_num, count_none, left_num, split_qa_num = dedup_by_file(input_file_path, output_file_path, err_file_path, store, batch)
+            total_num_sub_folder += total_num
+            count_none_sub_folder += count_none
+            left_num_sub_folder += left_num
+            split_qa_sub_folder += split_qa_num
+        report_sub_folder(sub_folder, total_num_sub_folder, count_none_sub_folder, left_num_sub_folder, split_qa_sub_folder)
+
+    # 筛选检查的执行统计：每条检查的执行次数、命中次数和耗时
+    print(f"筛选检查统计（检查顺序: {get_filter_rules().ordering}）:")
+    for line in get_filter_rules().report_lines():
+        logging.info(line)
+        print(f"  {line}")
+
+    if store is not None:
+        store.close()
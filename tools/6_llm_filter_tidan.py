@@ -8,23 +8,23 @@ from pathlib import Path
 from sympy import EX
 from tqdm import tqdm
 from prompt_loader import *
+from jsonl_io import JsonlWriter, dumpb, iter_lines, loads
+from prompt_dedup import template_ref
+from verdict_cache import VERDICT_KEY, VerdictCache, VerdictLookup, availability_stage, verdicts_path, with_answer
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
+from contextlib import ExitStack, nullcontext
 from collections import defaultdict
 import multiprocessing as mp
+import threading
 
 # 加载第三阶段 prompt
 current_dir = Path(__file__).parent
 config_path = current_dir / "prompts.yaml"
+# PromptLoader 的配置和预编译模板来自进程内共用的只读注册表，可以在线程间直接共享
+loader = PromptLoader(str(config_path))
 
-# 创建线程局部存储，避免多线程环境下重复创建loader实例
-thread_local = threading.local()
-
-def get_thread_loader():
-    """获取线程本地的prompt loader实例"""
-    if not hasattr(thread_local, 'loader'):
-        thread_local.loader = PromptLoader(str(config_path))
-    return thread_local.loader
+# 每批生成的任务行数，生成后直接写入输出文件
+PROMPT_BATCH_SIZE = 1024
 
 # gcl修改：所有xxx.get("字段名", "").strip()改为(xxx.get("字段名") or "").strip()
 def extract_qa_text(entry):
@@ -90,75 +90,109 @@ def extract_subject_from_source(source_type: str) -> str:
             
     raise ValueError(f"无法从 source_type '{source_type}' 中识别学科")
 
-def process_single_line(data, file_path, subject):
-    """处理单行数据"""
-    try:
-        q_text, a_text = extract_qa_text(data)
-    except Exception as e:
-        logging.error(f"处理时发生错误{e}，原数据如下:{data}")
-        return None
+def render_prompt_line(query_json, id_info):
+    """拼接一行可用性检查任务JSON，与 {"query": prompt, "id": id_info} 序列化结果相同"""
+    return b"".join((b'{"query":', query_json, b',"id":', dumpb(id_info), b"}"))
 
-    # 动态构建第三阶段 prompt
-    answer_for_prompt = "没有答案" if 'only_q' in file_path else a_text
-    
-    # 获取线程本地loader
-    local_loader = get_thread_loader()
-    
+def render_batch(renderer, records, only_q, verdicts=None, hits=None):
+    """
+    用预编译模板批量生成一批记录的任务行
+    传入 verdicts（VerdictLookup）时整批查询判定缓存：命中的记录连同缓存结果（提单行 + answer）追加到 hits，
+    不生成任务行；未命中的记录在 id 中附带 verdict_key
+    """
+    items = []
+    for data in records:
+        # 提取问题和答案文本
+        try:
+            q_text, a_text = extract_qa_text(data)
+        except Exception as e:
+            logging.error(f"处理时发生错误{e}，原数据如下:{data}")
+            continue
+        items.append((data, q_text, "没有答案" if only_q else a_text))
+
+    keys = [None] * len(items)
+    cached = {}
+    if verdicts is not None:
+        keys = verdicts.keys((q_text, answer_for_prompt) for _, q_text, answer_for_prompt in items)
+        cached = verdicts.lookup(keys)
+
+    lines = []
+    for (data, q_text, answer_for_prompt), key in zip(items, keys):
+        # 动态构建第三阶段 prompt
+        hit = cached.get(key)
+        try:
+            query_json = renderer.render_json(query=q_text, answer=answer_for_prompt)
+        except Exception as e:
+            logging.error(f"构建prompt时发生错误: {e}")
+            continue
+
+        # 创建输出对象
+        id_info = {
+            "original_data": data,
+            "source_type": data.get('source_type', ''),
+            "section": data.get('section', ''),
+            "url": data.get('url', ''),
+            "img_path": data.get('img_path', '')
+        }
+        if key is not None:
+            id_info[VERDICT_KEY] = key
+        if hit is not None:
+            hits.append(with_answer(render_prompt_line(query_json, id_info), hit))
+        else:
+            lines.append(render_prompt_line(query_json, id_info))
+    return lines
+
+def process_single_file(file_path, subject, out_f, lock, verdicts=None, hits_f=None):
+    """
+    处理单个文件，按批生成任务行，每批生成后直接写入 out_f（lock 保证多线程时整批写入），返回写入的行数
+    传入 verdicts 时命中判定缓存的记录写入 hits_f，不生成任务行（见 verdict_cache.py）
+    """
     try:
-        full_prompt = local_loader.build_prompt(
-            stage="3_check_availability",
-            subject=subject,
-            query=q_text,
-            answer=answer_for_prompt
-        )
+        renderer = loader.compile_check_availability(subject)
     except Exception as e:
         logging.error(f"构建prompt时发生错误: {e}")
-        return None
-
-    # 创建输出对象
-    id_info = {
-        "original_data": data,
-        "source_type": data.get('source_type', ''),
-        "section": data.get('section', ''),
-        "url": data.get('url', ''),
-        "img_path": data.get('img_path', '')
-    }
+        return 0
+    only_q = 'only_q' in file_path
+    file_name = os.path.basename(file_path)
 
-    output_obj = {
-        "query": full_prompt,
-        "id": id_info,
-    }
-    
-    return json.dumps(output_obj, ensure_ascii=False)
+    count = 0
+    batch = []
+
+    def flush_batch():
+        nonlocal count
+        hits = []
+        lines = render_batch(renderer, batch, only_q, verdicts, hits)
+        batch.clear()
+        with lock:
+            for line in lines:
+                out_f.write_line(line)
+            if hits_f is not None:
+                for line in hits:
+                    hits_f.write_line(line)
+        count += len(lines)
 
-def process_single_file(file_path, subject):
-    """处理单个文件，返回处理结果列表"""
-    results = []
-    file_name = os.path.basename(file_path)
-    
     # 读取输入文件
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f, 1):
-                if not line.strip():
-                    continue
-                    
-                try:
-                    data = json.loads(line)
-                except json.JSONDecodeError as e:
-                    logging.error(f"JSON解析错误 in {file_name} line {line_num}: {e}")
-                    continue
-                
-                result = process_single_line(data, file_path, subject)
-                if result:
-                    results.append(result)
+        for line_num, line in iter_lines(file_path):
+            try:
+                data = loads(line)
+            except json.JSONDecodeError as e:
+                logging.error(f"JSON解析错误 in {file_name} line {line_num}: {e}")
+                continue
+            batch.append(data)
+            if len(batch) >= PROMPT_BATCH_SIZE:
+                flush_batch()
+        flush_batch()
     except Exception as e:
         logging.error(f"读取文件 {file_path} 时发生错误: {e}")
-        
-    return results
 
-def process_folder(input_folder, output_file, max_workers=4):
-    """处理文件夹中的所有JSON文件并合并为一个输出文件"""
+    return count
+
+def process_folder(input_folder, output_file, max_workers=4, verdict_cache_path=None, verdict_model=""):
+    """
+    处理文件夹中的所有JSON文件并合并为一个输出文件
+    传入 verdict_cache_path（判定缓存库）时命中缓存的结果写入 {output_file}.verdicts（见 verdict_cache.py）
+    """
     source_type = os.path.basename(input_folder)
 
     # 动态加载第三阶段 prompt
@@ -178,38 +212,64 @@ def process_folder(input_folder, output_file, max_workers=4):
     processed_count = 0
     total_files = len(json_files)
     
+    verdict_store = VerdictCache(verdict_cache_path) if verdict_cache_path else None
+    verdicts = None
+    if verdict_store is not None:
+        # 缓存键包含本学科可用性检查模板的摘要和模型名
+        stage = availability_stage(template_ref(loader.compile_check_availability(subject)), verdict_model)
+        verdicts = VerdictLookup(verdict_store, subject, stage)
+
     # 打开输出文件准备写入（JSON Lines格式）
-    with open(output_file, 'w', encoding='utf-8') as out_f:
-        # 使用线程池并发处理文件
-        with ThreadPoolExecutor(max_workers=min(max_workers, len(json_files))) as executor:
-            # 提交所有任务
-            future_to_file = {
-                executor.submit(process_single_file, file_path, subject): file_path 
-                for file_path in json_files
-            }
-            
-            # 处理完成的任务
-            for future in tqdm(as_completed(future_to_file), total=total_files, desc="Processing files"):
-                file_path = future_to_file[future]
-                try:
-                    results = future.result()
-                    # 写入结果
-                    for result_line in results:
-                        out_f.write(result_line + "\n")
-                    processed_count += 1
-                except Exception as e:
-                    logging.error(f"处理文件 {file_path} 时出错: {e}")
+    write_lock = threading.Lock()
+    try:
+        with JsonlWriter(output_file) as out_f, \
+                (JsonlWriter(verdicts_path(output_file)) if verdicts is not None else nullcontext()) as hits_f:
+            # 使用线程池并发处理文件，每个文件按批生成后直接写入输出文件
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(json_files))) as executor:
+                # 提交所有任务
+                future_to_file = {
+                    executor.submit(process_single_file, file_path, subject, out_f, write_lock, verdicts,
+                                    hits_f): file_path
+                    for file_path in json_files
+                }
+
+                # 处理完成的任务
+                for future in tqdm(as_completed(future_to_file), total=total_files, desc="Processing files"):
+                    file_path = future_to_file[future]
+                    try:
+                        future.result()
+                        processed_count += 1
+                    except Exception as e:
+                        logging.error(f"处理文件 {file_path} 时出错: {e}")
+    finally:
+        if verdict_store is not None:
+            verdict_store.close()
     
     print(f"\n处理完成！已处理 {processed_count} 个文件。")
     print(f"结果已保存到: {output_file}")
     return processed_count
 
+def append_lines(src_path, dst_paths):
+    """逐行读取 src_path 并追加写入 dst_paths 中的每个文件，返回行数"""
+    count = 0
+    with ExitStack() as stack:
+        writers = [stack.enter_context(JsonlWriter(path, 'a')) for path in dst_paths]
+        for _, line in iter_lines(src_path):
+            for writer in writers:
+                writer.write_line(line)
+            count += 1
+    return count
+
 # 原脚本其他部分保持不变，只修改循环处理部分
 
 if __name__ == "__main__":
     # 保留原脚本的参数和路径设置
     root = sys.argv[1]
     batch = sys.argv[2]
+    # 可选第三个参数：判定缓存库路径（SQLite），命中缓存的题目不再提单，结果写入各输出文件的 .verdicts（见 verdict_cache.py）
+    verdict_cache_path = sys.argv[3] if len(sys.argv) > 3 else None
+    # 可选第四个参数：可用性检查使用的模型名，计入判定缓存键，更换模型后不会命中旧模型的结果
+    verdict_model = sys.argv[4] if len(sys.argv) > 4 else ""
     input_png_dir = f'{root}/{batch}/7_qa_filter_{batch}'
     output_parent_dir = f'{root}/{batch}/8_tidan_filter_{batch}'
     
@@ -225,6 +285,12 @@ if __name__ == "__main__":
     for path in [normal_path, only_q_path, merged_path]:
         with open(path, 'w', encoding='utf-8') as f:
             pass
+        if verdict_cache_path:
+            with open(verdicts_path(path), 'w', encoding='utf-8') as f:
+                pass
+        elif os.path.exists(verdicts_path(path)):
+            # 之前使用判定缓存生成过，删除过期的缓存结果文件
+            os.remove(verdicts_path(path))
 
     # 初始化计数器
     count_normal = 0  # 有答案的
@@ -257,39 +323,26 @@ if __name__ == "__main__":
         temp_output = os.path.join(output_parent_dir, f'temp_{sub_folder}_llm_filter_{batch.replace(".", "")}.json')
         
         # 调用原处理函数生成单个子文件夹的JSON结果
-        processed_count = process_folder(subfolder_path, temp_output, max_workers)
+        processed_count = process_folder(subfolder_path, temp_output, max_workers, verdict_cache_path, verdict_model)
         
         # 判断是否为 only_q 类型
         is_only_q = 'only_q' in sub_folder
         target_path = only_q_path if is_only_q else normal_path
 
         line_count = 0
-        # 读取临时文件并写入对应文件 + 合并文件
+        # 逐行读取临时文件，同时写入对应类型文件和合并文件
         try:
-            with open(temp_output, 'r', encoding='utf-8') as temp_f:
-                lines = [line for line in temp_f if line.strip()]
+            line_count = append_lines(temp_output, (target_path, merged_path))
         except Exception as e:
-            logging.error(f"读取临时文件 {temp_output} 时出错: {e}")
-            lines = []
+            logging.error(f"复制临时文件 {temp_output} 到 {target_path}、{merged_path} 时出错: {e}")
 
-        # 写入对应类型文件
-        try:
-            with open(target_path, 'a', encoding='utf-8') as type_f:
-                for line in lines:
-                    type_f.write(line)
-        except Exception as e:
-            logging.error(f"写入目标文件 {target_path} 时出错: {e}")
-
-        # 写入合并文件
-        try:
-            with open(merged_path, 'a', encoding='utf-8') as merged_f:
-                for line in lines:
-                    merged_f.write(line)
-        except Exception as e:
-            logging.error(f"写入合并文件 {merged_path} 时出错: {e}")
+        # 命中判定缓存的结果同样写入对应类型文件和合并文件的 .verdicts
+        if verdict_cache_path:
+            hit_count = append_lines(verdicts_path(temp_output), (verdicts_path(target_path), verdicts_path(merged_path)))
+            os.remove(verdicts_path(temp_output))
+            print(f"   {sub_folder} 命中判定缓存 {hit_count} 条")
 
         # 更新计数
-        line_count = len(lines)
         if is_only_q:
             count_only_q += line_count
             print(f"✅ [only_q]  {sub_folder} -> {os.path.basename(target_path)} (+{line_count}行)")
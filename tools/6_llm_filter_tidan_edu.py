@@ -1,29 +1,28 @@
 import logging
 import os, sys
 import json
-import glob
 import sys
 import shutil
 from pathlib import Path
 from sympy import EX
 from tqdm import tqdm
 from prompt_loader import *
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from jsonl_io import JsonlWriter, dumpb, iter_lines, loads
+from qa_columnar import is_parquet, is_qa_file, iter_qa_records
+from prompt_dedup import PromptSidecar, check_prompt_mode, compact_record, sidecar_path, template_ref
+from verdict_cache import VERDICT_KEY, VerdictCache, VerdictLookup, availability_stage, verdicts_path, with_answer
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import threading
+from contextlib import nullcontext
 
 # 加载第三阶段 prompt
 current_dir = Path(__file__).parent
 config_path = current_dir / "prompts.yaml"
+# PromptLoader 的配置和预编译模板来自进程内共用的只读注册表，可以在线程间直接共享
 loader = PromptLoader(str(config_path))
 
-# 创建线程局部存储，避免多线程环境下重复创建loader实例
-thread_local = threading.local()
-
-def get_thread_loader():
-    """获取线程本地的prompt loader实例"""
-    if not hasattr(thread_local, 'loader'):
-        thread_local.loader = PromptLoader(str(config_path))
-    return thread_local.loader
+# 每批生成的任务行数，生成后直接写入输出文件
+PROMPT_BATCH_SIZE = 1024
 
 # 10.11gcl修改：所有xxx.get("字段名", "").strip()改为(xxx.get("字段名") or "").strip()
 def extract_qa_text(entry):
@@ -87,111 +86,320 @@ def extract_subject_from_source(source_type: str) -> str:
             
     raise ValueError(f"无法从 source_type '{source_type}' 中识别学科")
 
-def process_single_file(file_path, subject, source_type):
-    """处理单个文件，返回处理结果列表"""
-    results = []
+def iter_input_records(file_path):
+    """逐条读取输入文件（jsonl 或 parquet）中的记录，JSON解析失败的行记录日志后跳过"""
+    if is_parquet(file_path):
+        yield from iter_qa_records(file_path)
+        return
+
     file_name = os.path.basename(file_path)
-    
-    # 读取输入文件
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line_num, line in enumerate(f, 1):
-            try:
-                data = json.loads(line)
-            except json.JSONDecodeError as e:
-                logging.error(f"JSON解析错误 in {file_name} line {line_num}: {e}")
-                continue
+    for line_num, line in iter_lines(file_path):
+        try:
+            yield loads(line)
+        except json.JSONDecodeError as e:
+            logging.error(f"JSON解析错误 in {file_name} line {line_num}: {e}")
 
-            # 提取问题和答案文本
-            try:
-                q_text, a_text = extract_qa_text(data)
-            except Exception as e:
-                logging.error(f"处理时发生错误{e}，原数据如下:{data}")
-                continue
+def render_prompt_line(query_json, id_info):
+    """拼接一行可用性检查任务JSON，与 {"query": prompt, "id": id_info} 序列化结果相同"""
+    return b"".join((b'{"query":', query_json, b',"id":', dumpb(id_info), b"}"))
 
-            # 动态构建第三阶段 prompt
-            answer_for_prompt = "没有答案" if 'only_q' in file_path else a_text
-            
-            # 获取线程本地loader
-            local_loader = get_thread_loader()
-            
+def render_batch(renderer, records, only_q, ref=None, verdicts=None, hits=None):
+    """
+    用预编译模板批量生成一批记录的任务行
+    传入 ref（模板摘要）时为 compact 方式：只写模板引用和 query/answer，模板见旁路文件
+    传入 verdicts（VerdictLookup）时整批查询判定缓存：命中的记录连同缓存结果（提单行 + answer）追加到 hits，
+    不生成任务行；未命中的记录在 id 中附带 verdict_key
+    """
+    items = []
+    for data in records:
+        # 提取问题和答案文本
+        try:
+            q_text, a_text = extract_qa_text(data)
+        except Exception as e:
+            logging.error(f"处理时发生错误{e}，原数据如下:{data}")
+            continue
+        items.append((data, q_text, "没有答案" if only_q else a_text))
+
+    keys = [None] * len(items)
+    cached = {}
+    if verdicts is not None:
+        keys = verdicts.keys((q_text, answer_for_prompt) for _, q_text, answer_for_prompt in items)
+        cached = verdicts.lookup(keys)
+
+    lines = []
+    for (data, q_text, answer_for_prompt), key in zip(items, keys):
+        # 动态构建第三阶段 prompt
+        hit = cached.get(key)
+        query_json = None
+        if ref is None or hit is not None:
             try:
-                full_prompt = local_loader.build_prompt(
-                    stage="3_check_availability",
-                    subject=subject,
-                    query=q_text,
-                    answer=answer_for_prompt
-                )
+                query_json = renderer.render_json(query=q_text, answer=answer_for_prompt)
             except Exception as e:
                 logging.error(f"构建prompt时发生错误: {e}")
                 continue
 
-            # 创建输出对象
-            id_info = {
-                "original_data": data,
-                "source_type": data.get('source_type', ''),
-                "section": data.get('section', ''),
-                "url": data.get('url', ''),
-                "img_path": data.get('img_path', '')
-            }
-            output_obj = {
-                "query": full_prompt,
-                "id": id_info,
-            }
-            
-            results.append(json.dumps(output_obj, ensure_ascii=False))
+        # 创建输出对象
+        id_info = {
+            "original_data": data,
+            "source_type": data.get('source_type', ''),
+            "section": data.get('section', ''),
+            "url": data.get('url', ''),
+            "img_path": data.get('img_path', '')
+        }
+        if key is not None:
+            id_info[VERDICT_KEY] = key
+        if hit is not None:
+            hits.append(with_answer(render_prompt_line(query_json, id_info), hit))
+        elif ref is None:
+            lines.append(render_prompt_line(query_json, id_info))
+        else:
+            lines.append(dumpb(compact_record(ref, {"query": q_text, "answer": answer_for_prompt}, id=id_info)))
+    return lines
+
+def availability_lookup(verdict_store, subject, verdict_model=""):
+    """
+    判定缓存查询：缓存键包含本学科可用性检查模板的摘要和模型名，未使用缓存时返回 None
+    """
+    if verdict_store is None:
+        return None
+    stage = availability_stage(template_ref(loader.compile_check_availability(subject)), verdict_model)
+    return VerdictLookup(verdict_store, subject, stage)
+
+def process_single_file(file_path, subject, source_type, out_f=None, lock=None, prompt_mode="full",
+                        verdicts=None, hits_f=None):
+    """
+    处理单个文件，按批生成任务行
+    传入 out_f 时每批生成后直接写入（lock 保证多线程时整批写入），返回写入的行数；否则返回结果列表
+    prompt_mode 为 compact 时每行只保存模板引用和 query/answer（见 prompt_dedup.py）
+    传入 verdicts 时命中判定缓存的记录写入 hits_f，不生成任务行（见 verdict_cache.py）
+    """
+    try:
+        renderer = loader.compile_check_availability(subject)
+    except Exception as e:
+        logging.error(f"构建prompt时发生错误: {e}")
+        return 0 if out_f is not None else []
+    only_q = 'only_q' in file_path
+    ref = template_ref(renderer) if check_prompt_mode(prompt_mode) == "compact" else None
+
+    results = []
+    count = 0
+    batch = []
+
+    def flush_batch():
+        nonlocal count
+        hits = []
+        lines = render_batch(renderer, batch, only_q, ref, verdicts, hits)
+        batch.clear()
+        if hits_f is not None:
+            with lock:
+                for line in hits:
+                    hits_f.write_line(line)
+        if out_f is None:
+            results.extend(lines)
+            return
+        with lock:
+            for line in lines:
+                out_f.write_line(line)
+        count += len(lines)
+
+    # 读取输入文件
+    for data in iter_input_records(file_path):
+        batch.append(data)
+        if len(batch) >= PROMPT_BATCH_SIZE:
+            flush_batch()
+    flush_batch()
+
+    return count if out_f is not None else results
 
-    return results
+def list_input_files(input_folder, ordered=False):
+    """子文件夹中需要生成任务的中间文件（JSON Lines 或 parquet，不含err文件），ordered 时按文件名排序"""
+    json_files = [os.path.join(input_folder, f) for f in os.listdir(input_folder) if is_qa_file(f)]
+    # 过滤掉err文件
+    json_files = [f for f in json_files if 'err' not in os.path.basename(f)]
+    return sorted(json_files) if ordered else json_files
+
+def finish_folder(output_file, subject, prompt_mode, hits_count=None):
+    """子文件夹的任务行写完后：输出命中判定缓存的统计，compact 方式写入模板旁路文件，并清理过期的旁路文件"""
+    if hits_count is not None:
+        print(f"命中判定缓存 {hits_count} 条，已保存到: {verdicts_path(output_file)}")
+    elif os.path.exists(verdicts_path(output_file)):
+        # 之前使用判定缓存生成过，删除过期的缓存结果文件
+        os.remove(verdicts_path(output_file))
 
-def process_folder(input_folder, output_file, max_workers=4):
-    """处理文件夹中的所有JSON文件并合并为一个输出文件"""
+    # compact 方式：模板写入旁路文件
+    if prompt_mode == "compact":
+        sidecar = PromptSidecar()
+        sidecar.add(loader.compile_check_availability(subject))
+        print(f"prompt 模板已保存到: {sidecar.save(output_file)}")
+    elif os.path.exists(sidecar_path(output_file)):
+        # 之前以 compact 方式生成过，删除过期的旁路文件，避免合并时被当作 compact 提单文件
+        os.remove(sidecar_path(output_file))
+
+def process_folder(input_folder, output_file, max_workers=4, prompt_mode="full", verdict_cache_path=None,
+                   ordered=False, verdict_model=""):
+    """
+    处理文件夹中的所有JSON文件并合并为一个输出文件
+    传入 verdict_cache_path（判定缓存库）时只为未命中缓存的记录生成任务行，命中的写入 {output_file}.verdicts，
+    verdict_model 为可用性检查使用的模型名，与模板摘要一起计入缓存键
+    ordered 为 True 时按文件名顺序逐个处理，输出顺序固定（与 process_folders_parallel 的 ordered 输出逐字节相同）；
+    否则多个文件在线程池中并发处理，各文件的批次交错写入
+    """
     source_type = os.path.basename(input_folder)
 
     # 动态加载第三阶段 prompt
     subject = extract_subject_from_source(source_type)
+    check_prompt_mode(prompt_mode)
 
     # 确保输出文件夹存在
     output_dir = os.path.dirname(output_file)
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
 
-    # 获取所有JSON文件
-    json_files = glob.glob(os.path.join(input_folder, "*.json"))
-    
-    # 过滤掉err文件
-    json_files = [f for f in json_files if 'err' not in os.path.basename(f)]
+    json_files = list_input_files(input_folder, ordered)
 
     processed_count = 0
     total_files = len(json_files)
     
+    verdict_store = VerdictCache(verdict_cache_path) if verdict_cache_path else None
+    verdicts = availability_lookup(verdict_store, subject, verdict_model)
+
     # 打开输出文件准备写入（JSON Lines格式）
-    with open(output_file, 'w', encoding='utf-8') as out_f:
-        # 使用线程池并发处理文件
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交所有任务
-            future_to_file = {
-                executor.submit(process_single_file, file_path, subject, source_type): file_path 
-                for file_path in json_files
-            }
-            
-            # 处理完成的任务
-            for future in tqdm(as_completed(future_to_file), total=total_files, desc="Processing files"):
-                file_path = future_to_file[future]
-                try:
-                    results = future.result()
-                    # 写入结果
-                    for result_line in results:
-                        out_f.write(result_line + "\n")
-                    processed_count += 1
-                except Exception as e:
-                    logging.error(f"处理文件 {file_path} 时出错: {e}")
+    write_lock = threading.Lock()
+    try:
+        with JsonlWriter(output_file) as out_f, \
+                (JsonlWriter(verdicts_path(output_file)) if verdicts is not None else nullcontext()) as hits_f:
+            # 使用线程池并发处理文件，每个文件按批生成后直接写入输出文件（ordered 时只用一个线程，按提交顺序执行）
+            with ThreadPoolExecutor(max_workers=1 if ordered else max_workers) as executor:
+                # 提交所有任务
+                future_to_file = {
+                    executor.submit(process_single_file, file_path, subject, source_type, out_f, write_lock, prompt_mode,
+                                    verdicts, hits_f): file_path
+                    for file_path in json_files
+                }
+
+                # 处理完成的任务
+                for future in tqdm(as_completed(future_to_file), total=total_files, desc="Processing files"):
+                    file_path = future_to_file[future]
+                    try:
+                        future.result()
+                        processed_count += 1
+                    except Exception as e:
+                        logging.error(f"处理文件 {file_path} 时出错: {e}")
+    finally:
+        if verdict_store is not None:
+            verdict_store.close()
+
+    finish_folder(output_file, subject, prompt_mode, hits_f.count if hits_f is not None else None)
     
     print(f"\n处理完成！已处理 {processed_count} 个文件。")
     print(f"结果已保存到: {output_file}")
 
+def shard_path(output_file, index):
+    """进程池模式下单个输入文件的分片输出路径（不以 .json 结尾，不会被合并步骤读到）"""
+    return f"{output_file}.shard{index:05d}"
+
+def process_file_shard(args):
+    """
+    进程池任务：处理单个输入文件，任务行写入分片文件（命中判定缓存的结果写入分片的 .verdicts）
+    返回 (分片路径, 任务行数, 命中缓存条数或None)
+    """
+    file_path, source_type, shard, prompt_mode, verdict_cache_path, verdict_model = args
+    subject = extract_subject_from_source(source_type)
+    # 每个子进程使用自己的数据库连接
+    verdict_store = VerdictCache(verdict_cache_path) if verdict_cache_path else None
+    verdicts = availability_lookup(verdict_store, subject, verdict_model)
+    try:
+        with JsonlWriter(shard) as out_f, \
+                (JsonlWriter(verdicts_path(shard)) if verdicts is not None else nullcontext()) as hits_f:
+            count = process_single_file(file_path, subject, source_type, out_f, threading.Lock(), prompt_mode,
+                                        verdicts, hits_f)
+    finally:
+        if verdict_store is not None:
+            verdict_store.close()
+    return shard, count, hits_f.count if hits_f is not None else None
+
+def concat_shards(shards, output_file):
+    """按给定顺序拼接分片文件（逐字节复制）并删除分片"""
+    with open(output_file, "wb") as out_f:
+        for shard in shards:
+            with open(shard, "rb") as shard_f:
+                shutil.copyfileobj(shard_f, out_f)
+            os.remove(shard)
+
+def process_folders_parallel(jobs, workers, prompt_mode="full", verdict_cache_path=None, ordered=False, verdict_model=""):
+    """
+    进程池模式：jobs 为 [(子文件夹路径, 输出文件)]，所有子文件夹的输入文件作为独立任务分发到 workers 个进程，
+    每个任务写一个分片文件，子文件夹的任务全部完成后拼接为该子文件夹的输出文件
+    ordered 为 True 时分片按文件名顺序拼接，输出与 process_folder(ordered=True) 逐字节相同；否则按完成顺序拼接
+    """
+    check_prompt_mode(prompt_mode)
+    tasks = []
+    folders = {}  # 输出文件 -> [学科, 待完成任务数, 已完成的 (任务序号, 分片) 列表, 命中缓存条数]
+    for input_folder, output_file in jobs:
+        source_type = os.path.basename(input_folder)
+        subject = extract_subject_from_source(source_type)
+        output_dir = os.path.dirname(output_file)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        json_files = list_input_files(input_folder, ordered)
+        folders[output_file] = [subject, len(json_files), [], None]
+        for index, file_path in enumerate(json_files):
+            tasks.append((output_file, index, (file_path, source_type, shard_path(output_file, index),
+                                               prompt_mode, verdict_cache_path, verdict_model)))
+
+    def finish(output_file):
+        subject, _, done, hits_count = folders[output_file]
+        shards = [shard for _, shard in (sorted(done) if ordered else done)]
+        concat_shards(shards, output_file)
+        if verdict_cache_path:
+            concat_shards([verdicts_path(shard) for shard in shards], verdicts_path(output_file))
+        finish_folder(output_file, subject, prompt_mode, (hits_count or 0) if verdict_cache_path else None)
+        print(f"结果已保存到: {output_file}（{len(shards)} 个文件）")
+
+    # 没有输入文件的子文件夹直接生成空输出
+    for output_file, (_, pending, _, _) in folders.items():
+        if not pending:
+            finish(output_file)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        future_to_task = {executor.submit(process_file_shard, args): (output_file, index, args[0])
+                          for output_file, index, args in tasks}
+        for future in tqdm(as_completed(future_to_task), total=len(tasks), desc="Processing files"):
+            output_file, index, file_path = future_to_task[future]
+            folder = folders[output_file]
+            folder[1] -= 1
+            try:
+                shard, _, hits_count = future.result()
+                folder[2].append((index, shard))
+                if hits_count is not None:
+                    folder[3] = (folder[3] or 0) + hits_count
+            except Exception as e:
+                logging.error(f"处理文件 {file_path} 时出错: {e}")
+                # 出错的文件跳过，删除其不完整的分片
+                for path in (shard_path(output_file, index), verdicts_path(shard_path(output_file, index))):
+                    if os.path.exists(path):
+                        os.remove(path)
+            if not folder[1]:
+                finish(output_file)
+
+def sub_folder_output_file(output_dir, sub_folder, batch):
+    """子文件夹对应的可用性检查提单文件路径"""
+    return os.path.join(output_dir, f'{sub_folder}_llm_filter可用性检查_{batch.replace(".", "")}.json')
+
 if __name__ == "__main__":
     # batch = '8.18重新传输文件-22'
     root = sys.argv[1]
     batch = sys.argv[2]
+    # 可选第三个参数：prompt 输出方式，full（默认，完整 prompt）或 compact（模板写入旁路文件，见 prompt_dedup.py）
+    prompt_mode = check_prompt_mode(sys.argv[3]) if len(sys.argv) > 3 else "full"
+    # 可选第四个参数：判定缓存库路径（SQLite），命中缓存的题目不再提单（见 verdict_cache.py），传空字符串表示不使用
+    verdict_cache_path = (sys.argv[4] if len(sys.argv) > 4 else "") or None
+    # 可选第五个参数：进程数，大于 1 时所有子文件夹的输入文件分发到进程池并行处理（prompt 拼接和序列化受 GIL 限制，线程池无法并行）
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 else 0
+    # 可选第六个参数：ordered，子文件夹和输入文件按名称顺序处理，输出顺序固定，进程池模式与串行模式的输出逐字节相同
+    ordered = len(sys.argv) > 6 and sys.argv[6] == "ordered"
+    # 可选第七个参数：可用性检查使用的模型名，计入判定缓存键，更换模型后不会命中旧模型的结果
+    verdict_model = sys.argv[7] if len(sys.argv) > 7 else ""
     w_size = 1
     s_size = 1
     input_png_dir = f'{root}/{batch}/7_qa_filter_{batch}'
@@ -200,6 +408,8 @@ if __name__ == "__main__":
     # 获取所有子文件夹
     sub_folders = [d for d in os.listdir(input_png_dir)
                    if os.path.isdir(os.path.join(input_png_dir, d))]
+    if ordered:
+        sub_folders.sort()
 
     if not sub_folders:
         print(f"在目录 {input_png_dir} 中未找到子文件夹")
@@ -208,9 +418,11 @@ if __name__ == "__main__":
     print(f"输出目录: {output_dir}")
     print(f"找到 {len(sub_folders)} 个子文件夹，开始处理...")
 
-    for sub_folder in sub_folders:
-        if 'err' in sub_folder:
-            continue
-        subfolder_path = os.path.join(input_png_dir, sub_folder)
-        output_file = os.path.join(output_dir, f'{sub_folder}_llm_filter可用性检查_{batch.replace(".", "")}.json')
-        process_folder(subfolder_path, output_file)
\ No newline at end of file
+    jobs = [(os.path.join(input_png_dir, sub_folder), sub_folder_output_file(output_dir, sub_folder, batch))
+            for sub_folder in sub_folders if 'err' not in sub_folder]
+    if workers > 1:
+        process_folders_parallel(jobs, workers, prompt_mode, verdict_cache_path, ordered, verdict_model)
+    else:
+        for subfolder_path, output_file in jobs:
+            process_folder(subfolder_path, output_file, prompt_mode=prompt_mode, verdict_cache_path=verdict_cache_path,
+                           ordered=ordered, verdict_model=verdict_model)
\ No newline at end of file
@@ -0,0 +1,419 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from jsonl_io import JsonlWriter, dumpb, iter_lines, loads
+from prompt_dedup import PromptSidecar, materialize_line, sidecar_path
+
+# 可用性检查（3_check_availability）提单文件的本地调用：
+# 读取第6步生成的提单文件（full 或 compact），逐条发送到 OpenAI 兼容接口（/chat/completions），
+# 结果按平台导出的格式（提单行 + "answer"）写入 9_model_res_filter_{batch}，供后续第7步使用
+#   - 并发：信号量上限为 concurrency，遇到 429/503 时减半，连续成功后逐步恢复（AIMD）
+#   - 分批：每批条数随当前并发上限调整，一批完成后再读取下一批
+#   - 重试：网络错误、超时、429 和 5xx 按指数退避重试，优先使用 Retry-After
+#   - 缓存：响应按 prompt 摘要追加写入缓存文件，重跑时已返回的 prompt 不再请求（中断后可续跑）
+
+# 可重试的 HTTP 状态码；其中 429/503 表示限流，会同时降低并发上限
+RETRY_STATUS = frozenset((408, 429, 500, 502, 503, 504))
+THROTTLE_STATUS = frozenset((429, 503))
+# 每批条数 = 当前并发上限 × BATCH_FACTOR（不少于 MIN_BATCH_SIZE）
+BATCH_FACTOR = 4
+MIN_BATCH_SIZE = 16
+# 缓存文件位于输出目录下，不以 .json 结尾，不会被按 *.json 收集结果文件的步骤读到
+CACHE_FILE_NAME = ".response_cache.jsonl"
+STUB_ANSWER = "【题目是否可用】：是,【答案是否可用】:是,【题目类型】:其他,【详细的判断理由】:stub"
+
+
+class RequestError(Exception):
+    """
+    单次请求失败；retry 表示是否可以重试，throttled 表示服务端限流，retry_after 为服务端建议的等待秒数
+    """
+
+    def __init__(self, message, retry=False, throttled=False, retry_after=None):
+        super().__init__(message)
+        self.retry = retry
+        self.throttled = throttled
+        self.retry_after = retry_after
+
+
+class ClientConfig:
+    """
+    接口配置：base_url 为 OpenAI 兼容接口地址（如 http://127.0.0.1:8000/v1），api_key 为空时读取环境变量 LLM_API_KEY
+    params 为附加的请求参数（如 temperature、max_tokens），参与缓存键计算
+    """
+
+    def __init__(self, base_url, model, api_key=None, concurrency=16, timeout=300, max_retries=5,
+                 backoff=1.0, max_backoff=60.0, params=None):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key if api_key is not None else os.environ.get("LLM_API_KEY", "")
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.params = dict(params or {})
+
+
+def prompt_key(config, query):
+    """
+    缓存键：模型、请求参数和 prompt 的摘要
+    """
+    return hashlib.sha256(dumpb([config.model, config.params, query])).hexdigest()
+
+
+class ResponseCache:
+    """
+    响应缓存：prompt 摘要 -> 模型回复，追加写入 JSON Lines 文件，每条写入后立即 flush
+    中断时最后一行可能不完整，加载时跳过
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.answers = {}
+        if os.path.exists(path):
+            for _, line in iter_lines(path):
+                try:
+                    item = loads(line)
+                except ValueError:
+                    continue
+                self.answers[item["key"]] = item["answer"]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.f = open(path, "ab")
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self.answers
+
+    def get(self, key):
+        return self.answers.get(key)
+
+    def put(self, key, answer):
+        with self.lock:
+            self.answers[key] = answer
+            self.f.write(dumpb({"key": key, "answer": answer}) + b"\n")
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class AdaptiveLimiter:
+    """
+    自适应并发上限（AIMD）：限流时上限减半并暂停 retry_after 秒，连续成功 limit 次后上限加一，不超过 max_limit
+
+    每次减半对应一个窗口：acquire 返回当前窗口编号，上次减半之前发出的请求再被限流时只延长暂停、不再减半，
+    避免同一波并发请求的限流响应把上限连续减到 1
+    """
+
+    def __init__(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.pause_until = 0.0
+        self.window = 0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            window = self.window
+        delay = self.pause_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return window
+
+    async def release(self, window, throttled=False, retry_after=None):
+        async with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                if window == self.window:
+                    self.limit = max(1, self.limit // 2)
+                    self.window += 1
+                self.successes = 0
+                if retry_after:
+                    self.pause_until = max(self.pause_until, time.monotonic() + retry_after)
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self.successes = 0
+            self.cond.notify_all()
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def post_chat(config, query):
+    """
+    同步发送一次 /chat/completions 请求，返回回复文本；失败时抛出 RequestError
+    """
+    body = {"model": config.model, "messages": [{"role": "user", "content": query}]}
+    body.update(config.params)
+    headers = {"Content-Type": "application/json"}
+    if config.api_key:
+        headers["Authorization"] = f"Bearer {config.api_key}"
+    request = urllib.request.Request(config.url, data=dumpb(body), headers=headers, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=config.timeout) as response:
+            data = loads(response.read())
+    except urllib.error.HTTPError as e:
+        raise RequestError(f"HTTP {e.code}: {e.read()[:200].decode('utf-8', 'replace')}",
+                           retry=e.code in RETRY_STATUS, throttled=e.code in THROTTLE_STATUS,
+                           retry_after=_retry_after(e.headers)) from e
+    except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+        raise RequestError(f"请求失败: {e}", retry=True) from e
+    except ValueError as e:
+        raise RequestError(f"响应不是合法的JSON: {e}", retry=True) from e
+    try:
+        return data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError) as e:
+        raise RequestError(f"响应格式异常: {str(data)[:200]}", retry=True) from e
+
+
+class AvailabilityClient:
+    """
+    异步批量调用：同一批内的请求并发执行，并发数由 AdaptiveLimiter 控制，请求在线程池中执行
+    """
+
+    def __init__(self, config, cache):
+        self.config = config
+        self.cache = cache
+        self.limiter = None
+        self.executor = None
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failed": 0}
+
+    def batch_size(self):
+        limit = self.limiter.limit if self.limiter else self.config.concurrency
+        return max(MIN_BATCH_SIZE, limit * BATCH_FACTOR)
+
+    async def _request(self, key, query):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.config.max_retries + 1):
+            window = await self.limiter.acquire()
+            self.stats["requests"] += 1
+            try:
+                answer = await loop.run_in_executor(self.executor, post_chat, self.config, query)
+            except RequestError as e:
+                await self.limiter.release(window, throttled=e.throttled, retry_after=e.retry_after)
+                self.stats["throttled"] += e.throttled
+                if not e.retry or attempt == self.config.max_retries:
+                    logging.error(f"prompt {key[:16]} 请求失败（已尝试 {attempt + 1} 次）: {e}")
+                    self.stats["failed"] += 1
+                    return
+                delay = min(self.config.max_backoff, self.config.backoff * 2 ** attempt) * (0.5 + random.random() / 2)
+                if e.retry_after:
+                    delay = max(delay, e.retry_after)
+                self.stats["retries"] += 1
+                logging.warning(f"prompt {key[:16]} 第 {attempt + 1} 次请求失败，{delay:.1f}s 后重试: {e}")
+                await asyncio.sleep(delay)
+                continue
+            await self.limiter.release(window)
+            self.cache.put(key, answer)
+            return
+
+    async def run_batch(self, pending):
+        """
+        并发请求一批 (缓存键, prompt)，结果写入缓存
+        """
+        await asyncio.gather(*(self._request(key, query) for key, query in pending))
+
+    async def run(self, batches):
+        """
+        依次处理 batches（生成器，每次取批时读取当前的 batch_size），请求在独立线程池中执行
+        """
+        self.limiter = AdaptiveLimiter(self.config.concurrency)
+        with ThreadPoolExecutor(max_workers=self.config.concurrency) as self.executor:
+            for pending in batches(self.batch_size):
+                await self.run_batch(pending)
+        self.executor = None
+
+
+def iter_prompt_lines(prompt_file):
+    """
+    逐行返回提单文件的 full 格式行（bytes）和解析后的记录；compact 格式按旁路文件还原
+    """
+    templates = PromptSidecar.load(prompt_file).templates if os.path.exists(sidecar_path(prompt_file)) else None
+    for line_num, line in iter_lines(prompt_file):
+        if templates is not None:
+            line = materialize_line(line, templates)
+        try:
+            record = loads(line)
+        except ValueError:
+            logging.error(f"{os.path.basename(prompt_file)} 第 {line_num} 行不是合法的JSON，跳过")
+            continue
+        if not isinstance(record, dict) or not isinstance(record.get("query"), str):
+            logging.error(f"{os.path.basename(prompt_file)} 第 {line_num} 行缺少 query，跳过")
+            continue
+        yield record
+
+
+def check_file(prompt_file, output_file, config, cache_path=None):
+    """
+    调用模型完成一个提单文件，输出与平台导出格式相同的结果文件（提单行 + "answer"，保持提单文件的顺序）
+    返回统计信息；有请求最终失败时 failed > 0，结果文件中不包含这些行，重跑时只会重新请求失败和未完成的 prompt
+    """
+    if cache_path is None:
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(output_file)), CACHE_FILE_NAME)
+    cache = ResponseCache(cache_path)
+    client = AvailabilityClient(config, cache)
+    stats = {"total": 0, "cached": 0}
+
+    def batches(batch_size):
+        pending = {}
+        for record in iter_prompt_lines(prompt_file):
+            stats["total"] += 1
+            key = prompt_key(config, record["query"])
+            if key in cache:
+                stats["cached"] += 1
+                continue
+            # 同一 prompt 在文件中重复出现时只请求一次
+            pending.setdefault(key, record["query"])
+            if len(pending) >= batch_size():
+                yield list(pending.items())
+                pending = {}
+        if pending:
+            yield list(pending.items())
+
+    start = time.time()
+    try:
+        asyncio.run(client.run(batches))
+
+        # 按提单文件顺序写出结果，先写临时文件，完成后再替换
+        tmp_path = f"{output_file}.tmp"
+        with JsonlWriter(tmp_path) as writer:
+            for record in iter_prompt_lines(prompt_file):
+                answer = cache.get(prompt_key(config, record["query"]))
+                if answer is not None:
+                    record["answer"] = answer
+                    writer.write(record)
+            stats["written"] = writer.count
+        os.replace(tmp_path, output_file)
+    finally:
+        cache.close()
+
+    stats.update(client.stats)
+    stats["seconds"] = round(time.time() - start, 1)
+    logging.info(f"{os.path.basename(prompt_file)} 可用性检查完成: {stats}")
+    return stats
+
+
+def output_file_for(output_dir, prompt_file):
+    return os.path.join(output_dir, os.path.basename(prompt_file))
+
+
+def check_batch(root, batch, config, prompt_files=None):
+    """
+    调用模型完成一个批次的可用性检查：默认处理 8_tidan_filter_{batch} 下的合并提单文件，结果写入 9_model_res_filter_{batch}
+    """
+    input_dir = f"{root}/{batch}/8_tidan_filter_{batch}"
+    output_dir = f"{root}/{batch}/9_model_res_filter_{batch}"
+    os.makedirs(output_dir, exist_ok=True)
+    if prompt_files is None:
+        prompt_files = [os.path.join(input_dir, f"全学科_可用性检查_{batch}.json")]
+
+    failed = 0
+    for prompt_file in prompt_files:
+        stats = check_file(prompt_file, output_file_for(output_dir, prompt_file), config)
+        print(f"{os.path.basename(prompt_file)}: 共 {stats['total']} 条，缓存命中 {stats['cached']} 条，"
+              f"请求 {stats['requests']} 次（重试 {stats['retries']} 次，限流 {stats['throttled']} 次），"
+              f"写出 {stats['written']} 条，失败 {stats['failed']} 条，耗时 {stats['seconds']}s")
+        failed += stats["failed"]
+    return failed
+
+
+# ================== 本地模拟服务（联调、压测用） ==================
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认监听队列只有 5，并发较高时会直接重置连接
+    request_queue_size = 256
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        with server.lock:
+            server.calls += 1
+            calls = server.calls
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttle_every and calls % server.throttle_every == 0:
+            self._reply(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0"})
+            return
+        if server.fail_every and calls % server.fail_every == 0:
+            self._reply(500, {"error": {"message": "stub failure"}})
+            return
+        answer = server.answer(body) if callable(server.answer) else server.answer
+        self._reply(200, {"choices": [{"index": 0, "message": {"role": "assistant", "content": answer}}]})
+
+    def _reply(self, status, payload, headers=None):
+        data = dumpb(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_stub(port=0, latency=0.0, throttle_every=0, fail_every=0, answer=STUB_ANSWER):
+    """
+    启动本地 OpenAI 兼容模拟服务（后台线程），返回 server，地址为 http://127.0.0.1:{server.server_port}/v1
+    每第 throttle_every 次请求返回 429，每第 fail_every 次返回 500；answer 可以是根据请求体生成回复的函数
+    """
+    server = _StubServer(("127.0.0.1", port), _StubHandler)
+    server.latency = latency
+    server.throttle_every = throttle_every
+    server.fail_every = fail_every
+    server.answer = answer
+    server.calls = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "stub":
+        stub = serve_stub(int(sys.argv[2]))
+        print(f"本地模拟服务已启动: http://127.0.0.1:{stub.server_port}/v1（Ctrl+C 退出）")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            stub.shutdown()
+        sys.exit(0)
+    if len(sys.argv) not in (5, 6):
+        print("用法：python availability_client.py <root> <batch> <base_url> <model> [并发数]")
+        print("      python availability_client.py stub <端口>   # 启动本地模拟服务")
+        sys.exit(1)
+    root, batch, base_url, model = sys.argv[1:5]
+    concurrency = int(sys.argv[5]) if len(sys.argv) == 6 else 16
+    os.makedirs(f"{root}/{batch}/9_model_res_filter_{batch}", exist_ok=True)
+    logging.basicConfig(
+        filename=f"{root}/{batch}/9_model_res_filter_{batch}/日志.log",
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    failed = check_batch(root, batch, ClientConfig(base_url, model, concurrency=concurrency))
+    if failed:
+        print(f"有 {failed} 条请求最终失败，重新运行将只请求失败和未完成的 prompt")
+        sys.exit(1)
@@ -1,10 +1,17 @@
 import re
-import jieba
+import time
 from functools import lru_cache
+from filter_rules import get_filter_rules
+from option_scanner import has_all_options
+from token_count import get_token_counter
 
 
 class DataFilter:
-    def __init__(self):
+    def __init__(self, token_counter=None, rules=None):
+        # 分词计数服务（长度过滤用），默认使用进程内共用的实例，jieba 在第一次计数时才加载
+        self.token_counter = token_counter
+        # 检查链配置（filter_rules.yaml），默认使用进程内共用的实例，执行统计跨文件累计
+        self.rules = rules or get_filter_rules()
         # 需要检查的字段
         self.CHECK_FIELDS1 = (
             "题目背景知识",
@@ -27,13 +34,8 @@ class DataFilter:
             "答案是否含表"
         )
         
-        # 编译正则表达式以提高性能
-        self.option_pattern = re.compile(
-            r'(?:[Aa][\.:：．、]|[Bb][\.:：．、]|[Cc][\.:：．、]|[Dd][\.:：．、])|'
-            r'(?:[Aa][\s]*[\u4e00-\u9fa5]|[Bb][\s]*[\u4e00-\u9fa5]|[Cc][\s]*[\u4e00-\u9fa5]|[Dd][\s]*[\u4e00-\u9fa5])|'
-            r'(?:[Aa][\s]*[^\w\s]|[Bb][\s]*[^\w\s]|[Cc][\s]*[^\w\s]|[Dd][\s]*[^\w\s])',
-            re.IGNORECASE
-        )
+        # 选择题需要具备的选项标签，由 option_scanner 预编译的单次扫描正则识别（含全角标签）
+        self.OPTION_LABELS = "ABCD"
         
         # 全角转半角映射表
         self.full_to_half_map = str.maketrans(
@@ -56,6 +58,54 @@ class DataFilter:
         # 特殊下划线关键词
         self.UNDERLINE_KEYWORDS = ('加点', '波浪线')
 
+        # 批量检查用的合并关键词正则：每段文本只扫描一次，得到命中的关键词集合，供听力、图片、下划线规则共用
+        self.keyword_pattern = self._compile_keywords(
+            ("听",) + tuple(sorted(self.LISTEN_KEYWORDS)) + self.IMAGE_KEYWORDS + self.UNDERLINE_KEYWORDS
+        )
+
+        # 各学科的检查链：(检查函数名, 参数)，按顺序执行，命中第一个即返回
+        self.RULE_CHAINS = self.rules.chains
+        for chain, rules in self.RULE_CHAINS.items():
+            for name, _ in rules:
+                if not callable(getattr(self, name, None)):
+                    raise ValueError(f"检查链 {chain} 中的检查函数 {name} 不存在")
+
+        # 检查函数对应的错误类型及批量版本（基于关键词命中集合），没有批量版本的沿用逐条检查
+        self.RULE_ERR_TYPES = {
+            "is_relevant_pic": '图片多模题',
+            "is_emptyQ": '题目缺失',
+            "is_emptyA": '答案缺失',
+            "is_litsen": '听力题',
+            "is_relevant_table": '题目含表',
+            "is_relevant_line_strict": '特殊下划线',
+            "is_relevant_line_lenient": '特殊下划线',
+            "option_not_complete": '选项不全',
+            "is_too_short": '题目过短',
+        }
+        self.BATCH_RULES = {
+            "is_relevant_pic": self._batch_relevant_pic,
+            "is_emptyQ": self._batch_emptyQ,
+            "is_emptyA": self._batch_emptyA,
+            "is_litsen": self._batch_litsen,
+            "is_relevant_table": self._batch_relevant_table,
+            "is_relevant_line_strict": self._batch_line_strict,
+            "is_relevant_line_lenient": self._batch_line_lenient,
+        }
+
+    @staticmethod
+    def _compile_keywords(keywords):
+        """
+        将关键词合并为一个正则；关键词之间可能重叠时使用前瞻匹配，保证每个出现位置都能被找到
+        """
+        alternation = "|".join(re.escape(k) for k in sorted(set(keywords), key=len, reverse=True))
+        overlapping = any(
+            a != b and (a in b or any(a.endswith(b[:i]) for i in range(1, len(b))))
+            for a in keywords for b in keywords
+        )
+        if overlapping:
+            return re.compile(f"(?=({alternation}))")
+        return re.compile(f"({alternation})")
+
     @lru_cache(maxsize=1000)
     def _normalize_answer(self, ans):
         """标准化答案文本"""
@@ -290,15 +340,7 @@ class DataFilter:
         """检查题目内容中是否包含完整的ABCD选项"""
         if not isinstance(question_content, str):
             return False
-            
-        # 使用预编译的正则表达式检测选项
-        found_options = set()
-        for match in self.option_pattern.finditer(question_content):
-            option_char = match.group()[0].upper()
-            found_options.add(option_char)
-            
-        # 确保找到所有基本选项（A-D）
-        return found_options.issuperset({'A', 'B', 'C', 'D'})
+        return has_all_options(question_content, self.OPTION_LABELS)
 
     def option_not_complete(self, entry):
         """检查选项是否完整"""
@@ -323,15 +365,16 @@ class DataFilter:
 
     def is_too_short(self, entry, th_length=20):
         """检查题目是否过短"""
+        counter = self.token_counter or get_token_counter()
         # 单题型
         if "sub_qa" not in entry:
             value = entry.get("题目内容")
             if value is None:
                 value = ""
-            if len(jieba.lcut(str(value))) < th_length:
+            if counter.is_below(th_length, str(value)):
                 return (True, '题目过短')
         
-        # 多题型
+        # 多题型：背景知识在每个小问中重复计数，由计数服务缓存
         if isinstance(entry.get("sub_qa"), list):
             value_bg = entry.get("题目背景知识")
             if value_bg is None:
@@ -346,82 +389,159 @@ class DataFilter:
                 else:
                     value = str(value)
 
-                total_tokens = len(jieba.lcut(value_bg) + jieba.lcut(value))
-                if total_tokens < (1.5 * th_length):
+                if counter.is_below(1.5 * th_length, value_bg, value):
                     return (True, '题目过短')
         
         return False
 
+    def check_chain(self, record, chain):
+        """按检查链逐条检查单条记录，返回第一个命中的检查结果，全部通过时返回 False"""
+        for name, param in self.rules.ordered(chain):
+            func = getattr(self, name)
+            result = func(record, param) if param is not None else func(record)
+            if result is not False:
+                return result
+        return False
+
     def check_english(self, record):
         """英语数据检查"""
-        functions = [
-            (self.is_relevant_pic, None),
-            (self.is_emptyQ, None),
-            (self.is_litsen, None),
-            (self.is_too_short, 20),
-            (self.is_emptyA, None),
-        ]
-
-        result = False
-        for func, param in functions:
-            if param is not None:
-                result = func(record, param)
-            else:
-                result = func(record)
-            if result is not False:
-                break
-        return result
+        return self.check_chain(record, "english")
 
     def check_politics(self, record):
         """政治数据检查"""
-        functions = [
-            (self.is_relevant_pic, None),
-            (self.is_emptyQ, None),
-            (self.is_emptyA, None),
-        ]
-
-        result = False
-        for func, param in functions:
-            result = func(record)
-            if result is not False:
-                break
-        return result
+        return self.check_chain(record, "politics")
 
     def check_history(self, record):
         """历史数据检查"""
-        functions = [
-            (self.is_relevant_pic, None),
-            (self.is_emptyQ, None),
-            (self.is_relevant_table, None),
-            (self.is_relevant_line_strict, None),
-            (self.is_emptyA, None),
-        ]
-
-        result = False
-        for func, param in functions:
-            result = func(record)
-            if result is not False:
-                break
-        return result
+        return self.check_chain(record, "history")
 
     def check_chinese(self, record):
         """语文数据检查"""
-        functions = [
-            (self.is_relevant_pic, None),
-            (self.is_emptyQ, None),
-            (self.is_relevant_table, None),
-            (self.is_relevant_line_lenient, None),
-            (self.option_not_complete, None),
-            (self.is_too_short, 10),
-            (self.is_emptyA, None),
-        ]
-
-        result = False
-        for func, param in functions:
-            if param is not None:
-                result = func(record, param)
-            else:
-                result = func(record)
-            if result is not False:
+        return self.check_chain(record, "chinese")
+
+    # ================== 批量检查 ==================
+    # 批量版本与逐条版本结果一致：每条记录的每段文本只用合并正则扫描一次，各规则复用命中的关键词集合
+
+    def _keyword_hits(self, cache, text):
+        """文本中命中的关键词集合（同一条记录内按文本缓存）"""
+        hits = cache.get(text)
+        if hits is None:
+            hits = cache[text] = frozenset(m.group(1) for m in self.keyword_pattern.finditer(text))
+        return hits
+
+    def _is_listen_hits(self, hits):
+        return "听" in hits and not hits.isdisjoint(self.LISTEN_KEYWORDS)
+
+    def _batch_emptyA(self, entry, cache):
+        if "sub_qa" not in entry:
+            return entry.get("对应答案", "") in self.INVALID_ANSWERS
+        sub_qa = entry["sub_qa"]
+        return isinstance(sub_qa, list) and any(sub.get("对应答案", "") in self.INVALID_ANSWERS for sub in sub_qa)
+
+    def _batch_emptyQ(self, entry, cache):
+        if "sub_qa" not in entry:
+            return entry.get("题目内容", "") in self.INVALID_QUESTION
+        sub_qa = entry["sub_qa"]
+        return isinstance(sub_qa, list) and any(sub.get("题目内容", "") in self.INVALID_QUESTION for sub in sub_qa)
+
+    def _batch_litsen(self, entry, cache):
+        bg = entry.get("题目背景知识")
+        if bg and isinstance(bg, str) and self._is_listen_hits(self._keyword_hits(cache, bg)):
+            return True
+
+        def is_listen(value):
+            return isinstance(value, str) and self._is_listen_hits(self._keyword_hits(cache, value))
+
+        if "sub_qa" not in entry:
+            return is_listen(entry.get("题目内容", ""))
+        sub_qa = entry["sub_qa"]
+        return isinstance(sub_qa, list) and any(is_listen(sub.get("题目内容", "")) for sub in sub_qa)
+
+    def _batch_relevant_pic(self, entry, cache):
+        entry_str = str(entry)
+        if '<picture>' in entry_str or '<fig>' in entry_str:
+            return True
+        if entry.get("背景知识是否含图", "") == "是":
+            return True
+
+        def has_image_keyword(data):
+            for field in self.CHECK_FIELDS1:
+                value = data.get(field, "")
+                if isinstance(value, str) and not self._keyword_hits(cache, value).isdisjoint(self.IMAGE_KEYWORDS):
+                    return True
+            return False
+
+        if "sub_qa" not in entry:
+            return has_image_keyword(entry)
+        sub_qa = entry["sub_qa"]
+        return isinstance(sub_qa, list) and any(has_image_keyword(sub) for sub in sub_qa)
+
+    def _batch_relevant_table(self, entry, cache):
+        # 逐条版本中 CHECK_FIELDS4 与 CHECK_FIELDS1 没有交集，实际只检查背景知识是否含表
+        return entry.get("背景知识是否含表", "") == "是"
+
+    def _batch_line_strict(self, entry, cache):
+        if entry.get("背景知识是否含下划线", "") == "是":
+            return True
+
+        def has_underline_keyword(data):
+            text = (data.get("对应答案", "") or "") + (data.get("题目内容", "") or "")
+            return not self._keyword_hits(cache, text).isdisjoint(self.UNDERLINE_KEYWORDS)
+
+        if "sub_qa" not in entry:
+            return has_underline_keyword(entry)
+        sub_qa = entry["sub_qa"]
+        return isinstance(sub_qa, list) and any(has_underline_keyword(sub) for sub in sub_qa)
+
+    def _batch_line_lenient(self, entry, cache):
+        def has_underline_keyword(data):
+            text = str(data.get("对应答案", "") or "") + str(data.get("题目内容", "") or "")
+            return not self._keyword_hits(cache, text).isdisjoint(self.UNDERLINE_KEYWORDS)
+
+        if "sub_qa" not in entry:
+            return has_underline_keyword(entry)
+        sub_qa = entry["sub_qa"]
+        return isinstance(sub_qa, list) and any(has_underline_keyword(sub) for sub in sub_qa)
+
+    def _rule_err_type(self, name, param, record, cache):
+        """单条记录执行一条检查，命中时返回错误类型，否则返回 None"""
+        batch_rule = self.BATCH_RULES.get(name)
+        if batch_rule is not None:
+            return self.RULE_ERR_TYPES[name] if batch_rule(record, cache) else None
+        func = getattr(self, name)
+        result = func(record, param) if param is not None else func(record)
+        return result[1] if result is not False else None
+
+    def check_batch(self, records, chain, column_flags=None, rows=None):
+        """
+        批量检查：对一组记录执行同一检查链，返回与 records 等长的错误类型列表，通过检查的记录为 None
+        结果与逐条调用 check_chain 一致；按检查逐条执行（每条检查处理完整批未命中的记录后再执行下一条），
+        并将每条检查的执行次数、命中次数和耗时记入 self.rules.stats
+        column_flags 为列式预判结果（qa_columnar.ColumnFlags），rows 为每条记录在其中的行号，
+        预判能确定结果的记录不再逐条检查
+        """
+        if rows is None:
+            rows = range(len(records))
+        err_types = [None] * len(records)
+        caches = [{} for _ in records]
+        pending = list(range(len(records)))
+        for name, param in self.rules.ordered(chain):
+            if not pending:
                 break
-        return result
\ No newline at end of file
+            start = time.perf_counter()
+            remaining = []
+            flags = column_flags.get(name, param) if column_flags is not None else None
+            for i in pending:
+                flag = flags[rows[i]] if flags is not None else None
+                if flag is None:
+                    err_type = self._rule_err_type(name, param, records[i], caches[i])
+                else:
+                    err_type = self.RULE_ERR_TYPES[name] if flag else None
+                if err_type is not None:
+                    err_types[i] = err_type
+                else:
+                    remaining.append(i)
+            self.rules.stats.add(chain, name, len(pending), len(pending) - len(remaining),
+                                 time.perf_counter() - start)
+            pending = remaining
+        return err_types
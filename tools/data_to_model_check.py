@@ -1,10 +1,14 @@
 import logging
 import os
 import sys
-import json
 import shutil
 import zipfile
 from tqdm import tqdm
+from jsonl_io import JsonlWriter, iter_lines, loads
+from prompt_dedup import PromptSidecar, check_prompt_mode, compact_record
+from prompt_loader import CompiledTemplate
+from qa_dedup_index import subject_key
+from verdict_cache import STAGE_MODEL_CHECK, VERDICT_KEY, VerdictCache, VerdictLookup, verdict_key, verdicts_path
 
 # -------------------------- 命令行参数解析（更新为8个参数） --------------------------
 # 接收Shell脚本传递的8个参数，顺序对应：
@@ -16,9 +20,11 @@ from tqdm import tqdm
 # 6. model2 (第二个模型名称)
 # 7. batch (shell中的$batch)
 # 8. root (shell中的$root)
-if len(sys.argv) != 9:
+# 9. prompt_mode（可选，full 或 compact，默认 full，见 prompt_dedup.py）
+# 10. verdict_cache（可选，判定缓存库路径，命中缓存的题目不再提单，见 verdict_cache.py）
+if len(sys.argv) not in (9, 10, 11):
     print("错误：参数数量不正确！")
-    print("正确用法：python script.py <file_path> <output_path1> <output_path2> <name> <model1> <model2> <batch> <root>")
+    print("正确用法：python script.py <file_path> <output_path1> <output_path2> <name> <model1> <model2> <batch> <root> [full|compact] [判定缓存库.db]")
     print("示例：python data_to_model_check.py /DL/xxx/14_select_check_xxx /DL/xxx/out1 /DL/xxx/out2 胡佳驹 gemini2.5-pro-多模 qwen3-vl-235b 10.9提交文件-290本 /DL/xxx/切题链路合并")
     sys.exit(1)
 
@@ -31,6 +37,8 @@ MODEL1 = sys.argv[5]          # 第一个模型名称
 MODEL2 = sys.argv[6]          # 第二个模型名称
 BATCH = sys.argv[7]           # 批次名称
 ROOT = sys.argv[8]            # 根目录
+PROMPT_MODE = check_prompt_mode(sys.argv[9] if len(sys.argv) >= 10 else "full")  # 提单文件 prompt 输出方式
+VERDICT_CACHE_PATH = sys.argv[10] if len(sys.argv) == 11 else ""  # 判定缓存库路径
 
 # -------------------------- 动态生成双model核心路径 --------------------------
 INPUT_DIR = FILE_PATH  # 输入目录=file_path（两个model共用同一输入）
@@ -115,6 +123,10 @@ UNIFIED_PROMPT = (
 "提供的题目：\n"
 "{query}"
 )
+# 预编译模板，compact 方式下静态部分写入提单文件的旁路文件，每行只保存 query 字段
+UNIFIED_TEMPLATE = CompiledTemplate(UNIFIED_PROMPT)
+PROMPT_SIDECAR = PromptSidecar()
+UNIFIED_TEMPLATE_REF = PROMPT_SIDECAR.add(UNIFIED_TEMPLATE)
 
 def safe_strip(value):
     """安全处理strip()，兼容字符串和非字符串类型"""
@@ -166,8 +178,11 @@ def collect_json_files(input_dir):
             json_files.append(file_path)
     return json_files
 
-def process_first_script(input_dir):
-    """第一个脚本的核心逻辑：处理输入目录的JSON文件，返回处理后的JSON行列表（双model共用同一处理结果）"""
+def process_first_script(input_dir, qa_texts=None):
+    """
+    第一个脚本的核心逻辑：处理输入目录的JSON文件，返回处理后的JSON行列表（双model共用同一处理结果）
+    传入 qa_texts 时按同样的顺序追加每行的 (学科, 题目文本)，用于查询判定缓存
+    """
     # 检查输入目录
     if not os.path.exists(input_dir):
         print(f"错误：输入目录不存在 → {input_dir}")
@@ -186,9 +201,7 @@ def process_first_script(input_dir):
     print("正在统计所有文件的有效数据行数...")
     for file_path in json_files:
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = [line.strip() for line in f.readlines() if line.strip()]
-                total_valid_lines += len(lines)
+            total_valid_lines += sum(1 for _ in iter_lines(file_path))
         except Exception as e:
             print(f"警告：统计文件 {os.path.basename(file_path)} 时出错 → {str(e)[:100]}，跳过该文件")
     
@@ -205,70 +218,69 @@ def process_first_script(input_dir):
             print(f"\n正在处理文件 {file_idx}/{len(json_files)}：{file_name}")
             
             try:
-                with open(file_path, 'r', encoding='utf-8') as in_f:
-                    lines = in_f.readlines()
-                    for line in lines:
-                        line = line.strip()
-                        if not line:
-                            continue
+                for _, line in iter_lines(file_path):
+                    try:
+                        data = loads(line)
+                        # 提取题目文本
+                        q_text = extract_qa_text(data)
                         
-                        try:
-                            data = json.loads(line)
-                            # 提取题目文本
-                            q_text = extract_qa_text(data)
-                            full_prompt = UNIFIED_PROMPT.format(query=q_text)
-                            
-                            # 构建id_info
-                            id_info = {
-                                "original_data": data,
-                                "source_type": safe_strip(data.get("source_type", "")),
-                                "section": safe_strip(data.get("section", "")),
-                                "url": safe_strip(data.get("url", "")),
-                                "img_path": data.get("img_path", [])
-                            }
-                            
-                            # 处理图片路径
-                            all_img_paths = data.get("img_path", [])
-                            merged_img_paths = []
-                            
-                            if "sub_qa" in data and isinstance(data["sub_qa"], list):
-                                temp_paths = []
-                                for sub_qa in data["sub_qa"]:
-                                    sub_target_page = sub_qa.get("题目位于第几张图片", 0)
-                                    try:
-                                        sub_target_index = int(sub_target_page) - 1
-                                    except (ValueError, TypeError):
-                                        sub_target_index = -1
-                                    sub_relevant_paths = get_relevant_img_paths(all_img_paths, sub_target_index)
-                                    temp_paths.extend(sub_relevant_paths)
-                                # 去重
-                                seen = set()
-                                for path in temp_paths:
-                                    if path not in seen:
-                                        seen.add(path)
-                                        merged_img_paths.append(path)
-                            else:
-                                target_page = data.get("题目位于第几张图片", 0)
+                        # 构建id_info
+                        id_info = {
+                            "original_data": data,
+                            "source_type": safe_strip(data.get("source_type", "")),
+                            "section": safe_strip(data.get("section", "")),
+                            "url": safe_strip(data.get("url", "")),
+                            "img_path": data.get("img_path", [])
+                        }
+                        
+                        # 处理图片路径
+                        all_img_paths = data.get("img_path", [])
+                        merged_img_paths = []
+                        
+                        if "sub_qa" in data and isinstance(data["sub_qa"], list):
+                            temp_paths = []
+                            for sub_qa in data["sub_qa"]:
+                                sub_target_page = sub_qa.get("题目位于第几张图片", 0)
                                 try:
-                                    target_index = int(target_page) - 1
+                                    sub_target_index = int(sub_target_page) - 1
                                 except (ValueError, TypeError):
-                                    target_index = -1
-                                merged_img_paths = get_relevant_img_paths(all_img_paths, target_index)
-                            
-                            # 构建输出对象（双model共用同一对象结构，仅后续输出路径不同）
+                                    sub_target_index = -1
+                                sub_relevant_paths = get_relevant_img_paths(all_img_paths, sub_target_index)
+                                temp_paths.extend(sub_relevant_paths)
+                            # 去重
+                            seen = set()
+                            for path in temp_paths:
+                                if path not in seen:
+                                    seen.add(path)
+                                    merged_img_paths.append(path)
+                        else:
+                            target_page = data.get("题目位于第几张图片", 0)
+                            try:
+                                target_index = int(target_page) - 1
+                            except (ValueError, TypeError):
+                                target_index = -1
+                            merged_img_paths = get_relevant_img_paths(all_img_paths, target_index)
+                        
+                        # 构建输出对象（双model共用同一对象结构，仅后续输出路径不同）
+                        if PROMPT_MODE == "compact":
+                            output_obj = compact_record(UNIFIED_TEMPLATE_REF, {"query": q_text},
+                                                        id=id_info, img_path=merged_img_paths)
+                        else:
                             output_obj = {
-                                "query": full_prompt,
+                                "query": UNIFIED_TEMPLATE.render(query=q_text),
                                 "id": id_info,
                                 "img_path": merged_img_paths
                             }
-                            
-                            processed_json_lines.append(output_obj)
-                            processed_lines += 1
-                            global_pbar.update(1)
-                            
-                        except Exception as e:
-                            logging.error(f"文件 {file_name} 处理数据行时出错 → {str(e)[:100]}，数据片段：{line[:200]}")
-                            continue
+                        
+                        processed_json_lines.append(output_obj)
+                        if qa_texts is not None:
+                            qa_texts.append((subject_key(id_info["source_type"]), q_text))
+                        processed_lines += 1
+                        global_pbar.update(1)
+                        
+                    except Exception as e:
+                        logging.error(f"文件 {file_name} 处理数据行时出错 → {str(e)[:100]}，数据片段：{line.decode('utf-8', 'replace')[:200]}")
+                        continue
             except Exception as e:
                 print(f"警告：读取文件 {file_name} 时出错 → {str(e)[:100]}，跳过该文件")
                 continue
@@ -381,13 +393,36 @@ def compress_image_folder(folder_path, zip_path, model_name):
             os.remove(zip_path)
         return False
 
-def update_json_img_paths(json_lines, dest_folder, output_json_path, model_name):
-    """更新JSON中的img_path并保存（适配双model分别输出）"""
+def split_cached(json_lines, qa_texts, verdict_store, model_name):
+    """
+    按判定缓存拆分质检任务：返回 (需要提单的行, 命中缓存的 (行, 题目文本, 缓存结果) 列表)
+    缓存按模型区分，每行在 id 中附带 verdict_key（两个model共用同一行对象，需在写出本model的文件前调用）
+    """
+    stage = f"{STAGE_MODEL_CHECK}/{model_name}"
+    keys = [verdict_key(subject, stage, q_text) for subject, q_text in qa_texts]
+    cached = VerdictLookup(verdict_store, None, stage).lookup(keys)
+    to_submit, hits = [], []
+    for data, (_, q_text), key in zip(json_lines, qa_texts, keys):
+        data["id"][VERDICT_KEY] = key
+        if key in cached:
+            hits.append((data, q_text, cached[key]))
+        else:
+            to_submit.append(data)
+    print(f"{model_name} 命中判定缓存 {len(hits)} 条，需要提单 {len(to_submit)} 条")
+    return to_submit, hits
+
+def update_json_img_paths(json_lines, dest_folder, output_json_path, model_name, hits=None):
+    """
+    更新JSON中的img_path并保存（适配双model分别输出）
+    传入 hits（命中判定缓存的 (行, 题目文本, 缓存结果)）时，同样更新图片路径后按模型结果的格式
+    （完整 query + answer）写入 {output_json_path}.verdicts
+    """
     dest_folder_name = os.path.basename(os.path.normpath(dest_folder))
     updated_lines = []
+    hits = hits or []
     
     print(f"\n开始更新JSON中的图片路径（{model_name} - 第二步：生成最终文件）...")
-    for data in tqdm(json_lines, desc=f"{model_name} 更新JSON进度"):
+    for data in tqdm(list(json_lines) + [data for data, _, _ in hits], desc=f"{model_name} 更新JSON进度"):
         if "img_path" in data and isinstance(data["img_path"], list):
             updated_img_paths = []
             for img_path in data["img_path"]:
@@ -396,15 +431,23 @@ def update_json_img_paths(json_lines, dest_folder, output_json_path, model_name)
                     new_path = f"{dest_folder_name}/{filename}"
                     updated_img_paths.append(new_path)
             data["img_path"] = updated_img_paths
-        updated_lines.append(json.dumps(data, ensure_ascii=False))
+        updated_lines.append(data)
     
     # 确保输出目录存在
     output_dir = os.path.dirname(output_json_path)
     if output_dir and not os.path.exists(output_dir):
         os.makedirs(output_dir, exist_ok=True)
     
-    with open(output_json_path, 'w', encoding='utf-8') as f:
-        f.write("\n".join(updated_lines) + "\n")
+    with JsonlWriter(output_json_path) as f:
+        for data in updated_lines[:len(updated_lines) - len(hits)]:
+            f.write(data)
+    if PROMPT_MODE == "compact":
+        PROMPT_SIDECAR.save(output_json_path)
+    if VERDICT_CACHE_PATH:
+        with JsonlWriter(verdicts_path(output_json_path)) as f:
+            for data, q_text, answer in hits:
+                f.write({"query": UNIFIED_TEMPLATE.render(query=q_text), "id": data["id"],
+                         "img_path": data["img_path"], "answer": answer})
     
     print(f"\n{model_name} 最终JSON文件已保存至：{os.path.abspath(output_json_path)}")
 
@@ -422,10 +465,13 @@ def main():
     print("="*80)
     
     # 第一步：生成质检任务（双model共用同一结果）
-    processed_json_lines = process_first_script(INPUT_DIR)
+    qa_texts = [] if VERDICT_CACHE_PATH else None
+    processed_json_lines = process_first_script(INPUT_DIR, qa_texts)
     if not processed_json_lines:
         print("没有生成任何质检任务，终止后续流程")
         sys.exit(1)
+    # 判定缓存：每个model只提单未命中缓存的题目，命中的结果写入 {提单JSON}.verdicts
+    verdict_store = VerdictCache(VERDICT_CACHE_PATH) if VERDICT_CACHE_PATH else None
     
     # 第二步：提取图片路径（双model共用同一图片集）
     image_abs_paths = extract_image_paths_from_json(processed_json_lines, BASE_IMG_DIR)
@@ -438,7 +484,9 @@ def main():
         success_paths1 = copy_unique_images(image_abs_paths, DEST_IMG_FOLDER1, MODEL1)
     else:
         print(f"{MODEL1} 未提取到任何图片路径，无需复制图片")
-    update_json_img_paths(processed_json_lines, DEST_IMG_FOLDER1, FINAL_OUTPUT_JSON_PATH1, MODEL1)
+    lines1, hits1 = (split_cached(processed_json_lines, qa_texts, verdict_store, MODEL1) if verdict_store is not None
+                     else (processed_json_lines, None))
+    update_json_img_paths(lines1, DEST_IMG_FOLDER1, FINAL_OUTPUT_JSON_PATH1, MODEL1, hits1)
     if success_paths1:
         compress_image_folder(DEST_IMG_FOLDER1, ZIP_FILE_PATH1, MODEL1)
     else:
@@ -452,7 +500,11 @@ def main():
         success_paths2 = copy_unique_images(image_abs_paths, DEST_IMG_FOLDER2, MODEL2)
     else:
         print(f"{MODEL2} 未提取到任何图片路径，无需复制图片")
-    update_json_img_paths(processed_json_lines, DEST_IMG_FOLDER2, FINAL_OUTPUT_JSON_PATH2, MODEL2)
+    lines2, hits2 = (split_cached(processed_json_lines, qa_texts, verdict_store, MODEL2) if verdict_store is not None
+                     else (processed_json_lines, None))
+    update_json_img_paths(lines2, DEST_IMG_FOLDER2, FINAL_OUTPUT_JSON_PATH2, MODEL2, hits2)
+    if verdict_store is not None:
+        verdict_store.close()
     if success_paths2:
         compress_image_folder(DEST_IMG_FOLDER2, ZIP_FILE_PATH2, MODEL2)
     else:
@@ -0,0 +1,154 @@
+import yaml
+from collections import defaultdict
+from functools import lru_cache
+from pathlib import Path
+
+# 检查顺序：fixed 按配置顺序，adaptive 按运行中统计的单次耗时 / 命中率排序（见 filter_rules.yaml）
+FILTER_ORDERINGS = ("fixed", "adaptive")
+DEFAULT_RULES_PATH = Path(__file__).parent / "filter_rules.yaml"
+
+
+class RuleStats:
+    """
+    各检查的执行统计：(检查链, 检查函数名) -> [执行次数, 命中次数, 累计耗时（秒）]
+    """
+
+    def __init__(self):
+        self.counters = defaultdict(lambda: [0, 0, 0.0])
+
+    def add(self, chain, rule, calls, hits, seconds):
+        counter = self.counters[(chain, rule)]
+        counter[0] += calls
+        counter[1] += hits
+        counter[2] += seconds
+
+    def get(self, chain, rule):
+        return self.counters.get((chain, rule))
+
+    def snapshot(self):
+        """
+        当前统计的副本（普通 dict，可以跨进程传输）
+        """
+        return {key: list(counter) for key, counter in self.counters.items()}
+
+    def since(self, snapshot):
+        """
+        相对 snapshot 新增的统计
+        """
+        delta = {}
+        for key, (calls, hits, seconds) in self.counters.items():
+            base_calls, base_hits, base_seconds = snapshot.get(key, (0, 0, 0.0))
+            if calls != base_calls:
+                delta[key] = [calls - base_calls, hits - base_hits, seconds - base_seconds]
+        return delta
+
+    def merge(self, counters):
+        """
+        合并子进程回传的统计
+        """
+        for (chain, rule), (calls, hits, seconds) in counters.items():
+            self.add(chain, rule, calls, hits, seconds)
+
+    def report_lines(self, keys=None):
+        """
+        输出每条检查的执行次数、命中次数和耗时，keys 为输出顺序（(检查链, 检查函数名) 列表），默认按名称排序
+        """
+        lines = []
+        for chain, rule in (keys if keys is not None else sorted(self.counters)):
+            calls, hits, seconds = self.counters.get((chain, rule), (0, 0, 0.0))
+            if not calls:
+                continue
+            lines.append(f"检查链 {chain} - {rule}: 执行 {calls} 次，命中 {hits} 次（{hits / calls:.1%}），"
+                         f"耗时 {seconds:.3f}s（{seconds / calls * 1e6:.1f}us/次）")
+        return lines
+
+
+class FilterRules:
+    """
+    初步筛选的检查链配置：source_type 到检查链的映射、各检查链的检查顺序，以及运行中的执行统计
+    """
+
+    def __init__(self, subjects, chains, ordering="fixed", adaptive_min_calls=200):
+        if ordering not in FILTER_ORDERINGS:
+            raise ValueError(f"未知的检查顺序：{ordering}，可选：{', '.join(FILTER_ORDERINGS)}")
+        self.chains = {
+            name: tuple((item["rule"], item.get("param")) for item in rules)
+            for name, rules in chains.items()
+        }
+        self.subjects = tuple((tuple(item["keywords"]), item["chain"]) for item in subjects)
+        for _, chain in self.subjects:
+            if chain not in self.chains:
+                raise ValueError(f"检查链 {chain} 未在配置中定义")
+        self.ordering = ordering
+        self.adaptive_min_calls = adaptive_min_calls
+        self.stats = RuleStats()
+        # 同一批次的 source_type 取值很少，匹配结果按 source_type 缓存
+        self.chain_for = lru_cache(maxsize=None)(self._chain_for)
+
+    @classmethod
+    def load(cls, path=DEFAULT_RULES_PATH):
+        with open(path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+        return cls(config["subjects"], config["chains"],
+                   config.get("ordering", "fixed"), config.get("adaptive_min_calls", 200))
+
+    def _chain_for(self, source_type):
+        """
+        根据 source_type 选择检查链，未知 source_type 返回 None
+        """
+        for keywords, chain in self.subjects:
+            if any(keyword in source_type for keyword in keywords):
+                return chain
+        return None
+
+    def ordered(self, chain):
+        """
+        检查链当前的执行顺序：(检查函数名, 参数) 元组
+        adaptive 模式下，每条检查都有足够的统计后，按 单次耗时 / 命中率 从小到大排序（命中率做加一平滑），
+        即拒绝一条记录的期望开销最小的检查先执行
+        """
+        rules = self.chains[chain]
+        if self.ordering != "adaptive":
+            return rules
+        counters = [self.stats.get(chain, name) for name, _ in rules]
+        if any(counter is None or counter[0] < self.adaptive_min_calls for counter in counters):
+            return rules
+
+        def score(index):
+            calls, hits, seconds = counters[index]
+            return (seconds / calls) / ((hits + 1) / (calls + 2))
+
+        return tuple(rules[index] for index in sorted(range(len(rules)), key=score))
+
+    def report_lines(self):
+        """
+        执行统计报告，按配置中检查链及检查的顺序输出，并附上 adaptive 模式下最终的执行顺序
+        """
+        keys = [(chain, name) for chain, rules in self.chains.items() for name, _ in rules]
+        lines = self.stats.report_lines(keys)
+        if self.ordering == "adaptive":
+            for chain in self.chains:
+                if self.ordered(chain) != self.chains[chain]:
+                    lines.append(f"检查链 {chain} 调整后的顺序: {' → '.join(name for name, _ in self.ordered(chain))}")
+        return lines
+
+
+_default_rules = None
+
+
+def get_filter_rules():
+    """
+    进程内共用的检查链配置（第5步每个文件新建一个 DataFilter，统计需要跨文件累计）
+    """
+    global _default_rules
+    if _default_rules is None:
+        _default_rules = FilterRules.load()
+    return _default_rules
+
+
+def set_filter_rules(rules):
+    """
+    替换进程内共用的检查链配置；多进程时在 fork 子进程之前调用
+    """
+    global _default_rules
+    _default_rules = rules
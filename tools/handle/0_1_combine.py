@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import functools
+import os
+import sys
+import time
+
+# pipeline_runner 位于上级 tools 目录
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from pipeline_runner import PipelineRunner, batch_dir, batch_dirs, script_step
+
+SOURCE_ROOT = "/DL_data_new/自动化切题/原始数据"
+
+def png_source_dir(source, batch):
+    """
+    第0步的原始图片目录（与 0_1_handle.sh 一致）
+    """
+    if source == "竞赛":
+        return f"{SOURCE_ROOT}/{source}/{batch}"
+    if source in ("筛选合格数据", "中高考真题"):
+        return f"{SOURCE_ROOT}/{source}/{batch}/{batch}"
+    if source == "教辅QA":
+        return f"{SOURCE_ROOT}/{source}/正式交付数据/图片包/{batch}"
+    raise ValueError(f"source_step1值不支持：{source}，只能是'竞赛'、'筛选合格数据'、'中高考真题'或'教辅QA'")
+
+def ocr_result_name(ctx):
+    """
+    第1步的结果目录（同名的 .zip 为压缩包，.json 为合并后的提单文件）
+    """
+    return f"{ctx['root']}/{ctx['batch']}/{ctx['name']}_{ctx['batch'].replace('.', '')}_{ctx['model']}_认知基础-SFT"
+
+def _cp_png_inputs(ctx, key, sub_folders):
+    return [ctx["png_source_dir"]]
+
+def _cp_png_argv(ctx):
+    # 教辅QA 只需要输入、输出路径和 batch，可选编码配置
+    argv = [ctx["png_source_dir"], batch_dir(ctx, "0_raw_png"), ctx["batch"]]
+    return argv + ([ctx["codec_profile"]] if ctx.get("codec_profile") else [])
+
+def _cp_png_cut_argv(png_cut_suffix, ctx):
+    png_cut_dir = f"{ctx['root']}/{ctx['batch']}/{ctx['batch']}{png_cut_suffix}"
+    return [ctx["png_source_dir"], png_cut_dir, batch_dir(ctx, "0_raw_png"), ctx["batch"]]
+
+def _tidan_ocr_inputs(ctx, key, sub_folders):
+    # 只取学科子文件夹：第1步会在 0_raw_png 目录下写入图片索引缓存（.page_index_*.jsonl）
+    input_dir = batch_dir(ctx, "0_raw_png")
+    return sorted(os.path.join(input_dir, d) for d in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, d)))
+
+# 第1步参数中影响结果的部分，修改后重跑（date 只是当天日期，不计入）
+TIDAN_OCR_OPTIONS = ("name", "model", "source_step2")
+
+def _tidan_ocr_argv(ctx):
+    return [ctx["root"], ctx["batch"], ctx["date"], ctx["name"], ctx["model"], ctx["source_step2"]]
+
+def _tidan_ocr_outputs(ctx, key, sub_folders):
+    result_name = ocr_result_name(ctx)
+    return [f"{result_name}.zip", f"{result_name}.json"]
+
+def build_steps(source_step1, source_step2):
+    """
+    step.0 原始图片复制/转换 -> step.1 生成ocr提单文件并压缩
+    """
+    if source_step1 == "教辅QA":
+        cp_step = script_step("0_cp_png", os.path.join(TOOLS_DIR, "0_1_cp_png.py"), argv=_cp_png_argv,
+                              inputs=_cp_png_inputs, outputs=batch_dirs("0_raw_png"), options=("codec_profile",))
+    elif source_step1 == "竞赛":
+        cp_step = script_step("0_cp_png", "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/0_1_cp_2png_race.py",
+                              argv=functools.partial(_cp_png_cut_argv, "-待转换png文件"),
+                              inputs=_cp_png_inputs, outputs=batch_dirs("0_raw_png"))
+    else:
+        cp_step = script_step("0_cp_png", "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/0_1_cp_2png.py",
+                              argv=functools.partial(_cp_png_cut_argv, "-png"),
+                              inputs=_cp_png_inputs, outputs=batch_dirs("0_raw_png"))
+
+    if source_step2 == "教辅":
+        # 教辅QA场景使用专用脚本
+        tidan_step = script_step("1_tidan_ocr", os.path.join(TOOLS_DIR, "1_tidan_ocr_edu.py"), argv=_tidan_ocr_argv,
+                                 inputs=_tidan_ocr_inputs, outputs=_tidan_ocr_outputs, options=TIDAN_OCR_OPTIONS)
+    else:
+        # 其他场景使用原脚本
+        tidan_step = script_step("1_tidan_ocr", "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/1_tidan_ocr.py",
+                                 argv=_tidan_ocr_argv, inputs=_tidan_ocr_inputs, outputs=_tidan_ocr_outputs,
+                                 options=TIDAN_OCR_OPTIONS)
+    return [cp_step, tidan_step]
+
+def main():
+    # 设置参数
+    batch = '1202-单模文件提交-437本'
+    root = '/DL_data_new/ftpdata/wjcui/code/教辅'
+    source_step1 = '教辅QA'  # 第一步的数据来源（筛选合格数据/中高考真题/竞赛/教辅QA）
+    source_step2 = '教辅'  # 第二步的数据来源（教辅/竞赛/真题/模拟题）
+    name = '崔文杰'
+    model = 'doubao-seed-1-6-thinking-250715-多模'  # gemini2.5-pro-多模、doubao-seed-1-6-thinking-250715-多模
+    date = time.strftime("%m%d")  # 当前日期，格式为月日(例如1127)
+    codec_profile = ''  # 第0步编码配置（见 image_codec.py），为空时使用默认配置，仅教辅QA
+    force = False  # True 时忽略完成标记，全部重跑
+
+    print(f"当前batch参数值：[{batch}]")
+
+    # 初始化工程结构（后续步骤导出的模型结果放到这些目录下）
+    for prefix in ("0_raw_png", "2_model_res_ocr", "5_model_res_qa", "9_model_res_filter"):
+        os.makedirs(f"{root}/{batch}/{prefix}_{batch}", exist_ok=True)
+
+    # 已完成且输入未变化的步骤会被跳过（第0步的原始图片目录不变时不再重新转换），失败后修复问题直接重新运行即可
+    runner = PipelineRunner(root, batch, build_steps(source_step1, source_step2), force=force,
+                            png_source_dir=png_source_dir(source_step1, batch), source_step2=source_step2,
+                            name=name, model=model, date=date, codec_profile=codec_profile)
+    if not runner.run():
+        print("处理失败，终止程序（重新运行将从失败的步骤继续）")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -2,140 +2,62 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
-import subprocess
 import sys
 
-def run_qa_extraction_dedup_filter(root, batch, source):
-    """执行qa提取、去重和过滤步骤"""
-    print("=================step.4 qa提取==================")
-    
+# pipeline_runner 位于上级 tools 目录
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOLS_DIR)
+from pipeline_runner import (PipelineRunner, availability_check_step, batch_dirs, merge_step, qa_groups, qa_steps,
+                             script_step)
+
+def build_steps(source, llm_check=False):
+    """
+    step.4 qa提取 -> step.5 去重及脚本过滤 -> step.6 二轮过滤提单 -> step.7 合并JSON文件
+    （-> step.8 调用模型接口完成可用性检查，结果写入9目录，仅教辅QA）
+    教辅QA 在进程内按子文件夹分片执行，其他场景仍整批调用原脚本
+    """
     if source == "教辅QA":
-        # 教辅QA场景使用专用脚本
-        script_path = "/DL_data_new/ftpdata/wjcui/code/教辅/tools/4_model_res_qa_process_edu.py"
-    else:
-        # 其他场景使用原脚本
-        script_path = "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/4_model_res_qa_process.py"
-    
-    try:
-        result = subprocess.run(["python", script_path, root, batch], check=True, capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
-    except subprocess.CalledProcessError as e:
-        print(f"QA提取步骤出错: {e}")
-        print(f"STDOUT: {e.stdout}")
-        print(f"STDERR: {e.stderr}")
-        return False
-    
-    print("=================step.5 去重及脚本过滤==================")
-    
-    if source == "教辅QA":
-        # 教辅QA场景使用专用脚本
-        script_path = "/DL_data_new/ftpdata/wjcui/code/教辅/tools/5_qa_dedup_optim_edu.py"
-    else:
-        # 其他场景使用原脚本
-        script_path = "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/5_qa_dedup_optim.py"
-    
-    try:
-        result = subprocess.run(["python", script_path, root, batch], check=True, capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
-    except subprocess.CalledProcessError as e:
-        print(f"去重及脚本过滤步骤出错: {e}")
-        print(f"STDOUT: {e.stdout}")
-        print(f"STDERR: {e.stderr}")
-        return False
-    
-    print("=================step.6 二轮过滤提单==================")
-    
-    if source == "教辅QA":
-        # 教辅QA场景使用专用脚本
-        script_path = "/DL_data_new/ftpdata/wjcui/code/教辅/tools/6_llm_filter_tidan_edu.py"
-    else:
-        # 其他场景使用原脚本
-        script_path = "/DL_data_new/ftpdata/wjcui/code/教辅/tools/6_llm_filter_tidan.py"
-    
-    try:
-        result = subprocess.run(["python", script_path, root, batch], check=True, capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print("STDERR:", result.stderr)
-    except subprocess.CalledProcessError as e:
-        print(f"二轮过滤提单步骤出错: {e}")
-        print(f"STDOUT: {e.stdout}")
-        print(f"STDERR: {e.stderr}")
-        return False
-    
-    return True
-
-def merge_json_files(input_dir, output_file):
-    """合并JSON文件"""
-    print("=================step.7 合并JSON文件==================")
-    
-    merged_data = []
-
-    # 获取文件夹中所有json文件，按文件名排序
-    json_files = sorted(
-        [f for f in os.listdir(input_dir) if f.endswith(".json")]
-    )
-
-    for file_name in json_files:
-        file_path = os.path.join(input_dir, file_name)
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        obj = json.loads(line)
-                        merged_data.append(obj)
-                    except json.JSONDecodeError as e:
-                        print(f"跳过无效JSON行：{file_name} 中的行 => {line}")
-        except Exception as e:
-            print(f"读取文件 {file_name} 时出错: {e}")
-
-    # 确保输出目录存在
-    output_dir = os.path.dirname(output_file)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
-
-    try:
-        with open(output_file, 'w', encoding='utf-8') as out_f:  # 使用'w'模式确保每次都是全新写入
-            for obj in merged_data:
-                json_line = json.dumps(obj, ensure_ascii=False)
-                out_f.write(json_line + '\n')
-
-        print(f"合并完成，共合并 {len(json_files)} 个文件，输出行数为 {len(merged_data)} 行")
-    except Exception as e:
-        print(f"写入输出文件时出错: {e}")
-        return False
-    
-    return True
+        return qa_steps() + ([availability_check_step()] if llm_check else [])
+
+    return [
+        script_step("4_qa_extract", "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/4_model_res_qa_process.py",
+                    inputs=batch_dirs("5_model_res_qa"), outputs=batch_dirs("6_extract_qa")),
+        script_step("5_qa_dedup", "/DL_data_new/ftpdata/clguo4/code/wenke_tools/tools/5_qa_dedup_optim.py",
+                    outputs=batch_dirs("7_qa_filter")),
+        script_step("6_availability_prompts", os.path.join(TOOLS_DIR, "6_llm_filter_tidan.py"),
+                    outputs=batch_dirs("8_tidan_filter")),
+        merge_step("7_merge_availability", "8_tidan_filter", "全学科_可用性检查"),
+    ]
 
 def main():
     # 设置参数
     batch = '1128-单模文件提交-239本'
     root = '/DL_data_new/ftpdata/wjcui/code/教辅'
     source = '教辅QA'  # 教辅QA、中高考、竞赛
-    
+    workers = 4  # 同时处理的学科子文件夹数
+    store_path = ''  # 跨批次去重库路径（SQLite），为空时第5步只做文件内去重
+    force = False  # True 时忽略完成标记，全部重跑
+    qa_format = 'jsonl'  # 第4~6步中间文件格式：jsonl 或 parquet（需要 pyarrow，仅教辅QA）
+    prompt_mode = 'full'  # 第6步提单文件 prompt 输出方式：full 或 compact（模板写入旁路文件，仅教辅QA，见 prompt_dedup.py）
+    ordered_output = False  # True 时第6步按文件名顺序生成提单文件，多次运行的输出逐字节相同（仅教辅QA）
+    # 可用性检查接口（OpenAI 兼容，如 http://127.0.0.1:8000/v1），为空时仍按原流程提单；密钥通过环境变量 LLM_API_KEY 传入
+    llm_base_url = ''
+    llm_model = 'gemini2.5pro'  # 同时计入判定缓存键，更换模型后不会命中旧模型的结果
+    llm_concurrency = 16  # 最大并发请求数，遇到限流时自动降低
+    # 跨批次判定缓存库路径（SQLite），为空时不使用；命中缓存的题目不再提单，结果收集时合并回来（见 verdict_cache.py）
+    verdict_cache_path = ''
+
     print(f"当前batch参数值：[{batch}]")
-    
-    # 执行qa提取、去重和过滤步骤
-    if not run_qa_extraction_dedup_filter(root, batch, source):
-        print("qa提取、去重和过滤处理失败，终止程序")
-        sys.exit(1)
-    
-    # 执行数据合并步骤
-    input_dir = f'{root}/{batch}/8_tidan_filter_{batch}'
-    output_file = f'{root}/{batch}/8_tidan_filter_{batch}/全学科_可用性检查_{batch}.json'
-    
-    if not merge_json_files(input_dir=input_dir, output_file=output_file):
-        print("JSON文件合并失败，终止程序")
+
+    # 已完成且输入未变化的（步骤, 子文件夹）会被跳过，某个学科失败不影响其他学科
+    runner = PipelineRunner(root, batch, build_steps(source, llm_check=bool(llm_base_url)), groups=qa_groups,
+                            workers=workers, force=force, store_path=store_path, qa_format=qa_format,
+                            prompt_mode=prompt_mode, ordered_output=ordered_output,
+                            llm_base_url=llm_base_url, llm_model=llm_model, llm_concurrency=llm_concurrency,
+                            verdict_cache_path=verdict_cache_path)
+    if not runner.run():
+        print("qa提取、去重和过滤处理失败，终止程序（重新运行将从失败的步骤继续）")
         sys.exit(1)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,117 @@
+import io
+import PIL
+from PIL import Image, features
+
+
+# 编码配置：按名称选择，第0步通过命令行参数指定
+#   quality       JPEG 质量
+#   subsampling   色度抽样（"4:4:4" / "4:2:2" / "4:2:0"），None 表示使用 Pillow 默认值
+#   max_side      长边上限（像素），超过时等比缩小，None 表示不缩放
+#   reencode_jpg  .jpg 源文件是否也重新编码（否则未超过 max_side 时原样复制）
+CODEC_PROFILES = {
+    # 与原有行为一致：.jpg 原样复制，其他格式以质量 85 转为 JPEG
+    "default": {"codec": "pil", "quality": 85, "subsampling": None, "max_side": None, "reencode_jpg": False},
+    # OCR 用：长边限制在 3000 像素以内，原始扫描件不需要 600dpi，压缩包体积和转换耗时都明显下降
+    "ocr": {"codec": "pil", "quality": 80, "subsampling": "4:2:0", "max_side": 3000, "reencode_jpg": True},
+}
+DEFAULT_PROFILE = "default"
+
+JPEG_EXTS = ('.jpg', '.jpeg')
+IMAGE_EXTS = ('.png', '.jpeg', '.tif', '.bmp', '.gif', '.webp', '.jpg')
+
+
+def get_profile(name=DEFAULT_PROFILE):
+    """
+    按名称获取编码配置（返回副本）
+    """
+    if name not in CODEC_PROFILES:
+        raise ValueError(f"未知的编码配置: {name}，可选: {', '.join(CODEC_PROFILES)}")
+    return dict(CODEC_PROFILES[name])
+
+
+def profile_id(profile):
+    """
+    编码配置的标识，写入转换清单，配置变化时目标文件需要重新生成
+    """
+    return (f"{profile['codec']}-q{profile['quality']}-ss{profile['subsampling']}"
+            f"-max{profile['max_side']}-rj{int(profile['reencode_jpg'])}")
+
+
+def backend_info():
+    """
+    当前 Pillow 的 JPEG 加速情况，Pillow-SIMD 的版本号带 .post 后缀
+    """
+    simd = ".post" in PIL.__version__
+    turbo = bool(features.check_feature("libjpeg_turbo"))
+    return f"Pillow {PIL.__version__}（SIMD: {'是' if simd else '否'}，libjpeg-turbo: {'是' if turbo else '否'}）"
+
+
+def scaled_size(size, max_side):
+    """
+    长边超过 max_side 时等比缩小后的尺寸，不需要缩放时返回 None
+    """
+    width, height = size
+    if not max_side or max(width, height) <= max_side:
+        return None
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+class PilCodec:
+    """
+    基于 Pillow 的转换：JPEG 源文件缩放时用 draft 在解码阶段按 1/2、1/4、1/8 直接缩小，
+    只解码需要的分辨率，其余格式完整解码后缩放
+    """
+
+    def __init__(self, quality=85, subsampling=None, max_side=None, reencode_jpg=False, **_):
+        self.max_side = max_side
+        self.reencode_jpg = reencode_jpg
+        self.save_kwargs = {"quality": quality, "optimize": False, "progressive": False}
+        if subsampling is not None:
+            self.save_kwargs["subsampling"] = subsampling
+
+    @staticmethod
+    def _copy(data, output_path):
+        with open(output_path, 'wb') as f:
+            f.write(data)
+        return True
+
+    def convert(self, data, ext, output_path):
+        """
+        将源文件内容（bytes）写为 JPEG 到 output_path
+        返回 True 表示原样复制（调用方可保留源文件属性），False 表示重新编码
+        """
+        copy_jpg = ext == '.jpg' and not self.reencode_jpg
+        if copy_jpg and not self.max_side:
+            return self._copy(data, output_path)
+
+        with Image.open(io.BytesIO(data)) as img:
+            # Image.open 只解析文件头，获取尺寸的开销很小
+            target_size = scaled_size(img.size, self.max_side)
+            if copy_jpg and target_size is None:
+                return self._copy(data, output_path)
+
+            if target_size is not None:
+                if ext in JPEG_EXTS:
+                    img.draft('RGB', target_size)
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                if img.size != target_size:
+                    img = img.resize(target_size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+            elif img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(output_path, "JPEG", **self.save_kwargs)
+        return False
+
+
+# 编码后端注册表：新增后端（如 turbojpeg、pyvips）时实现 convert 接口并在此登记
+CODECS = {
+    "pil": PilCodec,
+}
+
+
+def make_codec(profile):
+    """
+    按编码配置创建编码器
+    """
+    return CODECS[profile["codec"]](**profile)
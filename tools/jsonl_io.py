@@ -0,0 +1,150 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# 优先使用 orjson，其次 msgspec，都未安装时回退到标准库 json
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+elif msgspec is not None:
+    JSON_BACKEND = "msgspec"
+    _msgspec_encoder = msgspec.json.Encoder()
+    _msgspec_decoder = msgspec.json.Decoder()
+else:
+    JSON_BACKEND = "json"
+
+READ_BATCH_BYTES = 8 * 1024 * 1024   # 每批读取的字节数（按整行切分）
+WRITE_BUFFER_BYTES = 8 * 1024 * 1024  # 写缓冲达到该字节数后落盘
+
+
+def _stdlib_dumps(obj):
+    # 与 orjson / msgspec 的紧凑格式保持一致，保证不同环境输出相同
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(data):
+    """
+    解析一条 JSON（str 或 bytes），失败时统一抛出 json.JSONDecodeError
+    快速后端解析失败时回退到标准库，兼容 NaN 等标准库能接受的写法
+    """
+    if JSON_BACKEND == "orjson":
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    elif JSON_BACKEND == "msgspec":
+        try:
+            return _msgspec_decoder.decode(data)
+        except msgspec.DecodeError:
+            pass
+    return json.loads(data)
+
+
+def dumpb(obj):
+    """
+    序列化为 UTF-8 编码的 bytes（不转义中文）
+    """
+    if JSON_BACKEND == "orjson":
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # 非字符串键、超长整数等交给标准库处理
+    elif JSON_BACKEND == "msgspec":
+        try:
+            return _msgspec_encoder.encode(obj)
+        except (TypeError, msgspec.EncodeError):
+            pass
+    return _stdlib_dumps(obj).encode("utf-8")
+
+
+def dumps(obj):
+    """
+    序列化为 str（不转义中文），等价于 json.dumps(obj, ensure_ascii=False) 的紧凑格式
+    """
+    if JSON_BACKEND == "json":
+        return _stdlib_dumps(obj)
+    return dumpb(obj).decode("utf-8")
+
+
+def iter_lines(file_path, batch_bytes=READ_BATCH_BYTES):
+    """
+    按批读取 JSONL 文件，逐行返回 (行号, 去除首尾空白的行内容)
+    行内容为 bytes，可直接传给 loads；空行跳过但计入行号
+    """
+    line_num = 0
+    with open(file_path, "rb") as f:
+        while True:
+            lines = f.readlines(batch_bytes)
+            if not lines:
+                break
+            for line in lines:
+                line_num += 1
+                line = line.strip()
+                if line:
+                    yield line_num, line
+
+
+def iter_jsonl(file_path, batch_bytes=READ_BATCH_BYTES):
+    """
+    逐条返回 JSONL 文件中的记录，解析失败时抛出 json.JSONDecodeError
+    """
+    for _, line in iter_lines(file_path, batch_bytes):
+        yield loads(line)
+
+
+class JsonlWriter:
+    """
+    带缓冲的 JSONL 写入器，攒够 WRITE_BUFFER_BYTES 后一次性写入
+    """
+
+    def __init__(self, file_path, mode="w", buffer_bytes=WRITE_BUFFER_BYTES):
+        self.file = open(file_path, mode.replace("b", "") + "b")
+        self.buffer = []
+        self.buffer_size = 0
+        self.buffer_bytes = buffer_bytes
+        self.count = 0  # 已写入的行数
+
+    def write(self, obj):
+        """
+        序列化并写入一条记录
+        """
+        self.write_line(dumpb(obj))
+
+    def write_line(self, line):
+        """
+        写入一行已序列化的 JSON（str 或 bytes，不含换行符）
+        """
+        if isinstance(line, str):
+            line = line.encode("utf-8")
+        self.buffer.append(line)
+        self.buffer.append(b"\n")
+        self.buffer_size += len(line) + 1
+        self.count += 1
+        if self.buffer_size >= self.buffer_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.writelines(self.buffer)
+            self.buffer = []
+            self.buffer_size = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,108 @@
+import re
+import sys
+import time
+from functools import lru_cache
+
+# 选择题选项标签扫描：一次正则扫描找出题目中出现的选项字母
+# 选项标签：字母（大小写、全角半角均可）后接可选空白，再接汉字或标点，例如 "A." "B、" "Ｃ．" "d 春天"
+DEFAULT_OPTION_LABELS = "ABCD"
+
+_FULL_WIDTH_UPPER = "ＡＢＣＤＥＦＧＨＩＪＫＬＭＮＯＰＱＲＳＴＵＶＷＸＹＺ"
+_FULL_WIDTH_LOWER = "ａｂｃｄｅｆｇｈｉｊｋｌｍｎｏｐｑｒｓｔｕｖｗｘｙｚ"
+_HALF_WIDTH_UPPER = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+# 全角、小写字母统一为半角大写
+_LABEL_NORMALIZE_MAP = str.maketrans(_FULL_WIDTH_UPPER + _FULL_WIDTH_LOWER + _HALF_WIDTH_UPPER.lower(),
+                                     _HALF_WIDTH_UPPER * 3)
+
+# 原 DataFilter.option_pattern（三段分支 + IGNORECASE，逐个匹配后在 Python 中取首字母），仅用于基准对比
+LEGACY_OPTION_PATTERN = re.compile(
+    r'(?:[Aa][\.:：．、]|[Bb][\.:：．、]|[Cc][\.:：．、]|[Dd][\.:：．、])|'
+    r'(?:[Aa][\s]*[\u4e00-\u9fa5]|[Bb][\s]*[\u4e00-\u9fa5]|[Cc][\s]*[\u4e00-\u9fa5]|[Dd][\s]*[\u4e00-\u9fa5])|'
+    r'(?:[Aa][\s]*[^\w\s]|[Bb][\s]*[^\w\s]|[Cc][\s]*[^\w\s]|[Dd][\s]*[^\w\s])',
+    re.IGNORECASE
+)
+
+
+@lru_cache(maxsize=None)
+def option_label_pattern(labels=DEFAULT_OPTION_LABELS):
+    """
+    labels 对应的预编译正则：一个字符类匹配标签字母，后面的分隔符用前瞻判断不消耗字符
+    （原正则的三段分支中，"字母+分隔符" 已包含在 "字母+空白+标点" 中，合并为一个分支）
+    """
+    upper = labels.upper()
+    half = upper + upper.lower()
+    full = "".join(_FULL_WIDTH_UPPER[ord(c) - ord("A")] + _FULL_WIDTH_LOWER[ord(c) - ord("A")] for c in upper)
+    return re.compile(rf'([{half}{full}])(?=\s*(?:[\u4e00-\u9fa5]|[^\w\s]))')
+
+
+def scan_option_labels(text, labels=DEFAULT_OPTION_LABELS):
+    """
+    题目中出现的选项标签（半角大写），按首次出现的顺序返回，例如 ('A', 'B', 'C', 'D')
+    labels 为需要识别的标签字母，默认 A~D，选项更多时可传入 "ABCDEFG"
+    """
+    if not isinstance(text, str):
+        return ()
+    found = option_label_pattern(labels).findall(text)
+    if not found:
+        return ()
+    return tuple(dict.fromkeys("".join(found).translate(_LABEL_NORMALIZE_MAP)))
+
+
+def has_all_options(text, labels=DEFAULT_OPTION_LABELS):
+    """
+    labels 中的选项标签是否全部出现
+    """
+    return len(set(scan_option_labels(text, labels))) == len(set(labels.upper()))
+
+
+def legacy_option_labels(text):
+    """
+    原实现找到的选项字母集合（仅 A~D、半角），用于基准对比
+    """
+    return {match.group()[0].upper() for match in LEGACY_OPTION_PATTERN.finditer(text)}
+
+
+def iter_benchmark_texts(paths):
+    """
+    从 QA 中间文件（JSON Lines）中取出题目内容（含小问）
+    """
+    from jsonl_io import loads
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue
+                subs = entry.get("sub_qa") if isinstance(entry.get("sub_qa"), list) else [entry]
+                for sub in subs:
+                    if isinstance(sub, dict) and isinstance(sub.get("题目内容"), str):
+                        yield sub["题目内容"]
+
+
+def benchmark(texts, repeat=5):
+    """
+    原实现与单次扫描实现的单条耗时（微秒）及半角 A~D 结果不一致的条数
+    """
+    report = {}
+    for name, func in (("finditer 原实现", lambda t: legacy_option_labels(t) >= {'A', 'B', 'C', 'D'}),
+                       ("单次扫描", has_all_options)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                func(text)
+        report[name] = (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+    half_width = [t for t in texts if not any(c in t for c in _FULL_WIDTH_UPPER[:4] + _FULL_WIDTH_LOWER[:4])]
+    report["结果不一致（不含全角标签的题目）"] = sum(
+        legacy_option_labels(t) != set(scan_option_labels(t)) for t in half_width)
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python option_scanner.py <QA中间文件.json>...")
+        sys.exit(1)
+    texts = list(iter_benchmark_texts(sys.argv[1:]))
+    print(f"基准题目 {len(texts)} 条，平均长度 {sum(map(len, texts)) / max(1, len(texts)):.0f} 字")
+    for name, value in benchmark(texts).items():
+        print(f"  {name}: {value:.2f}" if isinstance(value, float) else f"  {name}: {value}")
@@ -0,0 +1,139 @@
+import os
+from collections import namedtuple
+from jsonl_io import JsonlWriter, iter_lines, loads
+
+# 一页图片的索引记录
+#   book        书籍文件夹名（根目录下第一级）
+#   package_num 试题包下的第一级目录名，直接位于试题包下时为 "."（与 os.path.relpath 一致），不在试题包内时为 None
+#   sub_type    所在目录对应的类型（题目/答案/题目/答案），不在试题包内时为 None
+#   path        文件绝对路径
+#   size        文件大小
+#   mtime_ns    修改时间（纳秒）
+PageRecord = namedtuple("PageRecord", ["book", "package_num", "sub_type", "path", "size", "mtime_ns"])
+
+PACKAGE_DIR_NAME = "试题包"
+# 缓存文件格式版本，索引内容的含义变化时加一，旧版本的缓存不再使用
+INDEX_VERSION = 2
+INDEX_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".gif")
+
+
+def sub_type_of(dir_name):
+    """
+    根据所在目录名判断类型（题目/答案/混合）
+    """
+    lower_name = dir_name.lower()
+    has_question = ("题目" in lower_name) or ("试题" in lower_name)
+    has_answer = "答案" in lower_name
+    if has_question and not has_answer:
+        return "题目"
+    elif has_answer and not has_question:
+        return "答案"
+    return "题目/答案"
+
+
+class PageIndex:
+    """
+    子文件夹（学段学科）下所有图片的索引，一次 os.scandir 遍历生成，图片合并和 OCR JSONL 生成共用
+    pages 的顺序与按名称排序的 os.walk 一致（先当前目录的文件，再依次进入子目录）
+    """
+
+    def __init__(self, root, books, pages, dir_mtimes):
+        self.root = root
+        self.books = books            # 书籍文件夹名 -> 是否包含试题包
+        self.pages = pages            # [PageRecord]
+        self.dir_mtimes = dir_mtimes  # 目录路径 -> 修改时间，用于判断缓存是否有效
+
+    @classmethod
+    def build(cls, root, extensions=INDEX_EXTENSIONS):
+        """
+        遍历 root 生成索引，每个目录只 scandir 一次
+        """
+        books = {}
+        pages = []
+        dir_mtimes = {root: os.stat(root).st_mtime_ns}
+
+        def scan(dir_path, rel_parts):
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+            sub_dirs = []
+            for entry in entries:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        sub_dirs.append(entry)
+                    continue
+                if not entry.name.lower().endswith(extensions) or not entry.is_file():
+                    continue
+                if not rel_parts:
+                    book = package_num = sub_type = None  # 直接位于根目录下的文件
+                else:
+                    book = rel_parts[0]
+                    package_num = sub_type = None
+                    if len(rel_parts) >= 2 and rel_parts[1] == PACKAGE_DIR_NAME:
+                        package_num = rel_parts[2] if len(rel_parts) > 2 else "."
+                        sub_type = sub_type_of(rel_parts[-1])
+                st = entry.stat()
+                pages.append(PageRecord(book, package_num, sub_type, entry.path, st.st_size, st.st_mtime_ns))
+            for entry in sub_dirs:
+                if not rel_parts:
+                    books[entry.name] = os.path.isdir(os.path.join(entry.path, PACKAGE_DIR_NAME))
+                dir_mtimes[entry.path] = entry.stat().st_mtime_ns
+                scan(entry.path, rel_parts + [entry.name])
+
+        scan(root, [])
+        return cls(root, books, pages, dir_mtimes)
+
+    def is_fresh(self):
+        """
+        所有目录的修改时间都未变化时索引仍然有效（新增、删除、重命名文件都会改变所在目录的修改时间）
+        """
+        for dir_path, mtime_ns in self.dir_mtimes.items():
+            try:
+                if os.stat(dir_path).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def save(self, cache_path):
+        """
+        写入缓存文件：第一行为根目录、书籍和目录修改时间，其后每行一条 PageRecord
+        """
+        tmp_path = f"{cache_path}.tmp"
+        with JsonlWriter(tmp_path) as writer:
+            writer.write({"version": INDEX_VERSION, "root": self.root, "books": self.books,
+                          "dir_mtimes": self.dir_mtimes})
+            for page in self.pages:
+                writer.write(list(page))
+        os.replace(tmp_path, cache_path)
+
+    @classmethod
+    def load(cls, cache_path):
+        """
+        读取缓存文件，文件不存在、损坏或版本不一致时返回 None
+        """
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            lines = iter_lines(cache_path)
+            _, header = next(lines)
+            header = loads(header)
+            if header.get("version") != INDEX_VERSION:
+                return None
+            pages = [PageRecord(*loads(line)) for _, line in lines]
+        except (StopIteration, ValueError, TypeError, KeyError):
+            return None
+        return cls(header["root"], header["books"], pages, header["dir_mtimes"])
+
+
+def load_page_index(root, cache_path=None):
+    """
+    获取 root 的图片索引：缓存存在、根目录一致且目录均未变化时直接使用，否则重新遍历并写入缓存
+    """
+    if cache_path:
+        index = PageIndex.load(cache_path)
+        if index is not None and index.root == root and index.is_fresh():
+            return index
+    index = PageIndex.build(root)
+    if cache_path:
+        index.save(cache_path)
+    return index
@@ -0,0 +1,490 @@
+import functools
+import hashlib
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from jsonl_io import JsonlWriter, iter_lines, loads
+from prompt_dedup import merge_sidecars, sidecar_path
+from qa_dedup_index import DedupStore, subject_key
+from verdict_cache import VerdictCache, collect_results, merge_verdict_files, verdicts_path
+
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+MARKER_DIR = ".pipeline"  # 完成标记目录，位于 {root}/{batch}/ 下
+BATCH_KEY = "_all"        # 整批执行的步骤使用的标记名
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def load_step(module_name):
+    """
+    导入 tools 下的步骤脚本（脚本名以数字开头，只能按名称导入）
+    """
+    if TOOLS_DIR not in sys.path:
+        sys.path.insert(0, TOOLS_DIR)
+    return importlib.import_module(module_name)
+
+
+def batch_dir(ctx, prefix):
+    """
+    批次下的步骤目录，如 {root}/{batch}/6_extract_qa_{batch}
+    """
+    return f"{ctx['root']}/{ctx['batch']}/{prefix}_{ctx['batch']}"
+
+
+def fingerprint(paths, options=None):
+    """
+    输入指纹：各路径下所有文件的相对路径、大小和修改时间的哈希，不读取文件内容
+    options 为影响步骤结果的参数（参数名 -> 值），一并计入指纹
+    """
+    h = hashlib.sha1()
+    if options:
+        h.update(json.dumps(options, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    for path in paths:
+        h.update(f"{path}\n".encode("utf-8"))
+        if os.path.isfile(path):
+            files = [(path, os.path.basename(path))]
+        else:
+            files = []
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    file_path = os.path.join(dirpath, filename)
+                    files.append((file_path, os.path.relpath(file_path, path)))
+        for file_path, rel_path in files:
+            st = os.stat(file_path)
+            h.update(f"{rel_path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+
+class Step:
+    """
+    流水线中的一步
+    name:     步骤名，同时是完成标记的子目录名
+    run:      run(ctx, key, sub_folders) 执行该步骤
+    inputs:   inputs(ctx, key, sub_folders) 返回参与指纹计算的输入路径
+    outputs:  outputs(ctx, key, sub_folders) 返回该步骤的产出路径，缺失时视为未完成
+    scope:    "batch" 整批执行一次；"group" 每个分组执行一次；"sub_folder" 每个子文件夹执行一次
+    log_file: log_file(ctx) 返回该步骤的日志文件，为 None 时沿用当前日志配置
+    options:  影响该步骤结果的 ctx 参数名，参数值计入指纹，修改后已完成的分片也会重跑
+    """
+
+    def __init__(self, name, run, inputs=None, outputs=None, scope="batch", log_file=None, options=()):
+        self.name = name
+        self.run = run
+        self.inputs = inputs
+        self.outputs = outputs
+        self.scope = scope
+        self.log_file = log_file
+        self.options = tuple(options)
+
+
+def _batch_dirs(prefixes, ctx, key, sub_folders):
+    return [batch_dir(ctx, prefix) for prefix in prefixes]
+
+
+def batch_dirs(*prefixes):
+    """
+    Step.inputs / Step.outputs 用：返回批次下的若干步骤目录
+    """
+    return functools.partial(_batch_dirs, prefixes)
+
+
+class _RootLogTo:
+    """
+    执行步骤期间把根日志重定向到步骤自己的日志文件（追加写入，续跑时保留之前的日志）
+    """
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+
+    def __enter__(self):
+        if self.log_file is None:
+            return
+        os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+        root_logger = logging.getLogger()
+        self.saved = (root_logger.handlers, root_logger.level)
+        handler = logging.FileHandler(self.log_file, mode="a", encoding="utf-8")
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        root_logger.handlers = [handler]
+        root_logger.setLevel(logging.INFO)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if self.log_file is None:
+            return
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers:
+            handler.close()
+        root_logger.handlers, level = self.saved
+        root_logger.setLevel(level)
+
+
+def marker_path(ctx, step, key):
+    return os.path.join(ctx["root"], ctx["batch"], MARKER_DIR, step.name, f"{key}.json")
+
+
+def is_done(path, input_fingerprint):
+    """
+    标记存在、指纹（输入文件和步骤参数）一致且产出都还在时视为已完成
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return marker.get("fingerprint") == input_fingerprint and all(os.path.exists(p) for p in marker.get("outputs", []))
+
+
+def run_node(ctx, step, key, sub_folders, dirty):
+    """
+    执行单个 (步骤, 分片)；上游有重跑（dirty）或输入变化时执行，否则跳过
+    返回是否实际执行了
+    """
+    path = marker_path(ctx, step, key)
+    input_fingerprint = fingerprint(step.inputs(ctx, key, sub_folders) if step.inputs else [],
+                                    {name: ctx.get(name) for name in step.options})
+    if not dirty and is_done(path, input_fingerprint):
+        print(f"[跳过] {step.name} / {key}：已完成且输入未变化")
+        return False
+
+    if os.path.exists(path):
+        os.remove(path)
+    print(f"[开始] {step.name} / {key}")
+    start = time.time()
+    with _RootLogTo(step.log_file(ctx) if step.log_file else None):
+        step.run(ctx, key, sub_folders)
+
+    # 先写临时文件再重命名，中途退出不会留下半个标记
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    marker = {
+        "fingerprint": input_fingerprint,
+        "outputs": step.outputs(ctx, key, sub_folders) if step.outputs else [],
+        "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "seconds": round(time.time() - start, 1),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(marker, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    print(f"[完成] {step.name} / {key}（耗时 {marker['seconds']}s）")
+    return True
+
+
+def run_chain(args):
+    """
+    进程池任务：对一个分组依次执行所有分片步骤，某一步失败时只中止本分组
+    返回 (分组名, 是否有步骤实际执行, 失败信息或None)
+    """
+    ctx, steps, key, sub_folders, dirty = args
+    ran_any = False
+    for step in steps:
+        try:
+            if step.scope == "group":
+                ran = run_node(ctx, step, key, sub_folders, dirty)
+            else:
+                ran = False
+                for sub_folder in sub_folders:
+                    ran = run_node(ctx, step, sub_folder, [sub_folder], dirty) or ran
+        except Exception:
+            return key, ran_any, (step.name, traceback.format_exc())
+        # 本分组上游重跑后，下游步骤即使指纹未变也要重跑
+        dirty = dirty or ran
+        ran_any = ran_any or ran
+    return key, ran_any, None
+
+
+class PipelineRunner:
+    """
+    可续跑的流水线：
+    按顺序执行整批步骤 -> 按分组并行执行分片步骤 -> 执行收尾的整批步骤
+    每个 (步骤, 分片) 完成后写入带输入指纹的完成标记，重跑时跳过已完成且输入未变化的分片
+    """
+
+    def __init__(self, root, batch, steps, groups=None, workers=1, force=False, **options):
+        self.ctx = dict(options, root=root, batch=batch)
+        self.groups = groups  # groups(ctx) -> [(分组名, [子文件夹, ...]), ...]
+        self.workers = workers
+        self.force = force
+
+        scopes = [step.scope for step in steps]
+        first = next((i for i, scope in enumerate(scopes) if scope != "batch"), len(steps))
+        last = max((i for i, scope in enumerate(scopes) if scope != "batch"), default=first - 1)
+        if "batch" in scopes[first:last + 1]:
+            raise ValueError("整批步骤不能位于分片步骤之间")
+        if first < len(steps) and groups is None:
+            raise ValueError("包含分片步骤时需要提供 groups")
+        self.pre_steps = steps[:first]
+        self.sharded_steps = steps[first:last + 1]
+        self.post_steps = steps[last + 1:]
+
+    def _run_batch_steps(self, steps, dirty):
+        for step in steps:
+            dirty = run_node(self.ctx, step, BATCH_KEY, None, dirty) or dirty
+        return dirty
+
+    def run(self):
+        """
+        执行流水线，全部成功返回 True
+        """
+        try:
+            dirty = self._run_batch_steps(self.pre_steps, self.force)
+        except Exception:
+            traceback.print_exc()
+            return False
+
+        failures = []
+        if self.sharded_steps:
+            groups = self.groups(self.ctx)
+            print(f"共 {len(groups)} 个分组，并发数 {self.workers}")
+            args_list = [(self.ctx, self.sharded_steps, key, sub_folders, dirty) for key, sub_folders in groups]
+            if self.workers > 1 and len(args_list) > 1:
+                with ProcessPoolExecutor(max_workers=min(self.workers, len(args_list))) as executor:
+                    results = [future.result() for future in as_completed(
+                        [executor.submit(run_chain, args) for args in args_list])]
+            else:
+                results = [run_chain(args) for args in args_list]
+            for key, ran_any, failure in results:
+                dirty = dirty or ran_any
+                if failure is not None:
+                    failures.append((key, *failure))
+
+        if failures:
+            print("\n以下分组执行失败（其余分组已完成，重新运行时会跳过）：")
+            for key, step_name, error in failures:
+                print(f"  - {key} @ {step_name}\n{error}")
+            return False
+
+        try:
+            self._run_batch_steps(self.post_steps, dirty)
+        except Exception:
+            traceback.print_exc()
+            return False
+        return True
+
+
+# ================== 通用步骤 ==================
+def _run_script(script_path, argv, ctx, key, sub_folders):
+    args = argv(ctx) if argv else [ctx["root"], ctx["batch"]]
+    # 不捕获输出，子进程的日志和进度条直接输出到终端
+    subprocess.run([sys.executable, script_path, *args], check=True)
+
+
+def script_step(name, script_path, inputs=None, outputs=None, argv=None, options=()):
+    """
+    以子进程方式整批执行外部步骤脚本（python script root batch）
+    脚本参数不是 root batch 时传入 argv(ctx)，返回命令行参数列表；options 为 argv 中影响结果的 ctx 参数名
+    """
+    return Step(name, functools.partial(_run_script, script_path, argv), inputs=inputs, outputs=outputs,
+                options=options)
+
+
+def _merge_output(prefix, output_name, ctx):
+    return os.path.join(batch_dir(ctx, prefix), f"{output_name}_{ctx['batch']}.json")
+
+
+def _merge_inputs(prefix, output_name, ctx, key, sub_folders):
+    input_dir = batch_dir(ctx, prefix)
+    output_file = _merge_output(prefix, output_name, ctx)
+    return sorted(
+        os.path.join(input_dir, f) for f in os.listdir(input_dir)
+        if f.endswith(".json") and os.path.join(input_dir, f) != output_file
+    )
+
+
+def _merge_outputs(prefix, output_name, ctx, key, sub_folders):
+    return [_merge_output(prefix, output_name, ctx)]
+
+
+def merge_jsonl_files(input_files, output_file):
+    """
+    按顺序合并多个 JSONL 文件，跳过无效 JSON 行
+    """
+    with JsonlWriter(output_file) as out_f:
+        for file_path in input_files:
+            for _, line in iter_lines(file_path):
+                try:
+                    loads(line)
+                except json.JSONDecodeError:
+                    print(f"跳过无效JSON行：{os.path.basename(file_path)} 中的行 => {line.decode('utf-8', 'replace')}")
+                    continue
+                out_f.write_line(line)
+    print(f"合并完成，共合并 {len(input_files)} 个文件，输出行数为 {out_f.count} 行")
+
+
+def _run_merge(prefix, output_name, ctx, key, sub_folders):
+    input_files = _merge_inputs(prefix, output_name, ctx, key, sub_folders)
+    output_file = _merge_output(prefix, output_name, ctx)
+    merge_jsonl_files(input_files, output_file)
+    # compact 方式的提单文件同时合并 prompt 模板旁路文件，使用判定缓存时同时合并命中缓存的结果
+    merge_sidecars(input_files, output_file)
+    merge_verdict_files(input_files, output_file)
+
+
+def merge_step(name, prefix, output_name):
+    """
+    将 {prefix}_{batch} 目录下的 JSON 文件合并为同目录下的 {output_name}_{batch}.json（不包含合并结果本身）
+    """
+    return Step(
+        name,
+        functools.partial(_run_merge, prefix, output_name),
+        inputs=functools.partial(_merge_inputs, prefix, output_name),
+        outputs=functools.partial(_merge_outputs, prefix, output_name),
+    )
+
+
+# ================== 教辅QA 第4~6步（进程内执行） ==================
+def _qa_extract(ctx, key, sub_folders):
+    output_dir = batch_dir(ctx, "6_extract_qa")
+    os.makedirs(output_dir, exist_ok=True)
+    load_step("4_model_res_qa_process_edu").process_and_split_jsonl(batch_dir(ctx, "5_model_res_qa"), output_dir,
+                                                                   ctx.get("qa_format", "jsonl"))
+
+
+def _qa_extract_log(ctx):
+    return f"{batch_dir(ctx, '6_extract_qa')}/日志.log"
+
+
+def _qa_dedup(ctx, key, sub_folders):
+    step5 = load_step("5_qa_dedup_optim_edu")
+    store = None
+    if ctx.get("store_path"):
+        # 使用去重库时分组即学科分区，重跑前只清理本批次该学科的旧数据
+        store = DedupStore(ctx["store_path"])
+        dropped = store.drop_batch(ctx["batch"], subject=key)
+        logging.info(f"去重库: {ctx['store_path']}，清理本批次{key}旧数据 {dropped} 条")
+    try:
+        for sub_folder in sub_folders:
+            step5.dedup_sub_folder(batch_dir(ctx, "6_extract_qa"), batch_dir(ctx, "7_qa_filter"), sub_folder, store, ctx["batch"])
+    finally:
+        if store is not None:
+            store.close()
+
+
+def _qa_dedup_inputs(ctx, key, sub_folders):
+    return [os.path.join(batch_dir(ctx, "6_extract_qa"), sub_folder) for sub_folder in sub_folders]
+
+
+def _qa_dedup_outputs(ctx, key, sub_folders):
+    output_dir = batch_dir(ctx, "7_qa_filter")
+    return [os.path.join(output_dir, sub_folder + suffix) for sub_folder in sub_folders for suffix in ("", "err")]
+
+
+def _qa_dedup_log(ctx):
+    return f"{batch_dir(ctx, '7_qa_filter')}/日志.log"
+
+
+def _availability_prompts(ctx, key, sub_folders):
+    # 与原脚本一致，跳过 err 子文件夹
+    if 'err' in key:
+        return
+    step6 = load_step("6_llm_filter_tidan_edu")
+    output_file = step6.sub_folder_output_file(batch_dir(ctx, "8_tidan_filter"), key, ctx["batch"])
+    step6.process_folder(os.path.join(batch_dir(ctx, "7_qa_filter"), key), output_file,
+                         prompt_mode=ctx.get("prompt_mode", "full"), verdict_cache_path=ctx.get("verdict_cache_path"),
+                         ordered=ctx.get("ordered_output", False), verdict_model=ctx.get("llm_model", ""))
+
+
+def _availability_prompts_inputs(ctx, key, sub_folders):
+    return [os.path.join(batch_dir(ctx, "7_qa_filter"), key)]
+
+
+def _availability_prompts_outputs(ctx, key, sub_folders):
+    if 'err' in key:
+        return []
+    step6 = load_step("6_llm_filter_tidan_edu")
+    output_file = step6.sub_folder_output_file(batch_dir(ctx, "8_tidan_filter"), key, ctx["batch"])
+    outputs = [output_file]
+    if ctx.get("prompt_mode", "full") == "compact":
+        outputs.append(sidecar_path(output_file))
+    if ctx.get("verdict_cache_path"):
+        outputs.append(verdicts_path(output_file))
+    return outputs
+
+
+def _availability_check_files(ctx):
+    prompt_file = _merge_output("8_tidan_filter", "全学科_可用性检查", ctx)
+    return prompt_file, os.path.join(batch_dir(ctx, "9_model_res_filter"), os.path.basename(prompt_file))
+
+
+def _availability_check(ctx, key, sub_folders):
+    client = load_step("availability_client")
+    config = client.ClientConfig(ctx["llm_base_url"], ctx["llm_model"], concurrency=ctx.get("llm_concurrency", 16))
+    prompt_file, output_file = _availability_check_files(ctx)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    stats = client.check_file(prompt_file, output_file, config)
+    print(f"可用性检查：共 {stats['total']} 条，缓存命中 {stats['cached']} 条，请求 {stats['requests']} 次，"
+          f"失败 {stats['failed']} 条，耗时 {stats['seconds']}s")
+    if ctx.get("verdict_cache_path"):
+        # 新结果写入判定缓存，提单时命中缓存的结果合并到结果文件中
+        verdict_store = VerdictCache(ctx["verdict_cache_path"])
+        try:
+            recorded, merged = collect_results(output_file, prompt_file, verdict_store, ctx["batch"])
+        finally:
+            verdict_store.close()
+        print(f"判定缓存：写入 {recorded} 条，合并缓存结果 {merged} 条")
+    # 有失败时不写完成标记，重跑时只请求失败和未完成的 prompt（已返回的结果在缓存中）
+    if stats["failed"]:
+        raise RuntimeError(f"可用性检查有 {stats['failed']} 条请求最终失败")
+
+
+def _availability_check_inputs(ctx, key, sub_folders):
+    prompt_file, _ = _availability_check_files(ctx)
+    return [prompt_file, sidecar_path(prompt_file), verdicts_path(prompt_file)]
+
+
+def _availability_check_outputs(ctx, key, sub_folders):
+    return [_availability_check_files(ctx)[1]]
+
+
+def _availability_check_log(ctx):
+    return f"{batch_dir(ctx, '9_model_res_filter')}/日志.log"
+
+
+def availability_check_step():
+    """
+    第8步：调用 OpenAI 兼容接口完成合并后的可用性检查提单文件，结果写入 9_model_res_filter（见 availability_client.py）
+    需要 ctx 中的 llm_base_url、llm_model，可选 llm_concurrency
+    """
+    return Step("8_availability_check", _availability_check,
+                inputs=_availability_check_inputs, outputs=_availability_check_outputs,
+                log_file=_availability_check_log, options=("llm_base_url", "llm_model", "verdict_cache_path"))
+
+
+def qa_groups(ctx):
+    """
+    第5、6步的分组：默认每个子文件夹一组；
+    使用跨批次去重库时同一学科的子文件夹放在同一组内按串行顺序处理，保证结果与串行一致
+    """
+    input_dir = batch_dir(ctx, "6_extract_qa")
+    sub_folders = [d for d in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, d))]
+    if not ctx.get("store_path"):
+        return [(sub_folder, [sub_folder]) for sub_folder in sub_folders]
+    groups = defaultdict(list)
+    for sub_folder in sub_folders:
+        groups[subject_key(sub_folder)].append(sub_folder)
+    return list(groups.items())
+
+
+def qa_steps():
+    """
+    教辅QA 第4步 qa提取、第5步去重过滤、第6步可用性检查提单，以及提单文件合并
+    """
+    return [
+        Step("4_qa_extract", _qa_extract,
+             inputs=batch_dirs("5_model_res_qa"), outputs=batch_dirs("6_extract_qa"),
+             log_file=_qa_extract_log, options=("qa_format",)),
+        Step("5_qa_dedup", _qa_dedup,
+             inputs=_qa_dedup_inputs, outputs=_qa_dedup_outputs,
+             scope="group", log_file=_qa_dedup_log, options=("store_path",)),
+        Step("6_availability_prompts", _availability_prompts,
+             inputs=_availability_prompts_inputs, outputs=_availability_prompts_outputs,
+             scope="sub_folder", options=("prompt_mode", "verdict_cache_path", "ordered_output", "llm_model")),
+        merge_step("7_merge_availability", "8_tidan_filter", "全学科_可用性检查"),
+    ]
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import sys
+from prompt_loader import CompiledTemplate
+from jsonl_io import JsonlWriter, dumpb, dumps, iter_lines, loads
+
+# 提单文件中 prompt 的输出方式：
+#   full     每行包含完整的 query（默认，与原格式一致）
+#   compact  每行只保存模板引用和动态字段，模板的静态部分按内容寻址写入同名旁路文件（{输出文件}.prompts，JSON）：
+#              {"query_ref": "<模板摘要>", "query_slots": {"query": ..., "answer": ...}, "id": ..., ...}
+#            需要完整格式时用 materialize_file（或本脚本命令行）还原，还原结果与 full 方式逐字节相同
+PROMPT_MODES = ("full", "compact")
+# 旁路文件不以 .json 结尾，避免被按 *.json 收集提单文件的合并步骤当作提单文件
+PROMPT_SIDECAR_SUFFIX = ".prompts"
+REF_KEY = "query_ref"
+SLOTS_KEY = "query_slots"
+
+
+def check_prompt_mode(prompt_mode):
+    if prompt_mode not in PROMPT_MODES:
+        raise ValueError(f"未知的 prompt 输出方式：{prompt_mode}，可选：{', '.join(PROMPT_MODES)}")
+    return prompt_mode
+
+
+def sidecar_path(output_path):
+    return f"{output_path}{PROMPT_SIDECAR_SUFFIX}"
+
+
+def template_ref(compiled):
+    """
+    模板的内容摘要（静态部分和动态字段相同的模板摘要相同）
+    """
+    return hashlib.sha256(dumpb(list(compiled.parts()))).hexdigest()[:16]
+
+
+def compact_record(ref, slots, **rest):
+    """
+    compact 方式的一行记录，字段顺序为 query_ref、query_slots，其后为 rest（对应 full 方式中 query 之后的字段）
+    """
+    record = {REF_KEY: ref, SLOTS_KEY: slots}
+    record.update(rest)
+    return record
+
+
+class PromptSidecar:
+    """
+    一个提单文件用到的模板集合：摘要 -> 模板，写入旁路文件
+    """
+
+    def __init__(self, templates=None):
+        self.templates = dict(templates or {})
+
+    def add(self, compiled):
+        """
+        登记模板，返回其摘要
+        """
+        ref = template_ref(compiled)
+        self.templates.setdefault(ref, compiled)
+        return ref
+
+    def save(self, output_path):
+        statics_fields = {ref: {"statics": list(compiled.statics), "fields": [list(f) for f in compiled.fields]}
+                          for ref, compiled in self.templates.items()}
+        path = sidecar_path(output_path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(dumps(statics_fields))
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, output_path):
+        with open(sidecar_path(output_path), "rb") as f:
+            data = loads(f.read())
+        return cls({ref: CompiledTemplate.from_parts(item["statics"], item["fields"]) for ref, item in data.items()})
+
+
+def merge_sidecars(input_files, output_file):
+    """
+    合并提单文件时同时合并旁路文件（模板按摘要去重），输入都没有旁路文件时删除上次合并留下的旁路文件并返回 None
+    """
+    merged = PromptSidecar()
+    found = False
+    for file_path in input_files:
+        if os.path.exists(sidecar_path(file_path)):
+            merged.templates.update(PromptSidecar.load(file_path).templates)
+            found = True
+    if found:
+        return merged.save(output_file)
+    if os.path.exists(sidecar_path(output_file)):
+        os.remove(sidecar_path(output_file))
+    return None
+
+
+def materialize_line(line, templates):
+    """
+    将 compact 方式的一行（bytes）还原为 full 方式的一行：query 为渲染后的完整 prompt，其余字段顺序不变
+    不含 query_ref 的行原样返回
+    """
+    record = loads(line)
+    ref = record.pop(REF_KEY, None) if isinstance(record, dict) else None
+    if ref is None:
+        return line
+    slots = record.pop(SLOTS_KEY)
+    query_json = templates[ref].render_json(**slots)
+    if not record:
+        return b'{"query":' + query_json + b'}'
+    return b'{"query":' + query_json + b',' + dumpb(record)[1:]
+
+
+def materialize_file(compact_path, output_path):
+    """
+    还原整个 compact 提单文件，返回还原的行数
+    """
+    templates = PromptSidecar.load(compact_path).templates
+    with JsonlWriter(output_path) as writer:
+        for _, line in iter_lines(compact_path):
+            writer.write_line(materialize_line(line, templates))
+        return writer.count
+
+
+def iter_materialized(compact_path):
+    """
+    逐条返回还原后的记录（dict），供直接在 Python 中读取 compact 提单文件的下游使用
+    """
+    templates = PromptSidecar.load(compact_path).templates
+    for _, line in iter_lines(compact_path):
+        yield loads(materialize_line(line, templates))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("用法：python prompt_dedup.py <compact提单文件.json> <还原后的输出文件.json>")
+        sys.exit(1)
+    count = materialize_file(sys.argv[1], sys.argv[2])
+    print(f"已还原 {count} 行：{sys.argv[1]} → {sys.argv[2]}")
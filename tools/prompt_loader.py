@@ -1,6 +1,270 @@
-import yaml
+import os
+import pickle
+import threading
 from pathlib import Path
+from string import Formatter
+from types import MappingProxyType
 from typing import Optional, Dict, Any
+from jsonl_io import dumpb
+
+
+class CompiledTemplate:
+    """
+    预编译的 prompt 模板：编译时填入已知字段（学科、题型、检查规则等），
+    其余字段（如 query/answer）在渲染时按位置拼接，渲染结果与 template.format(...) 完全一致
+    """
+
+    def __init__(self, template: str, **fixed: Any):
+        """
+        Args:
+            template: str.format 格式的模板
+            **fixed: 编译时填入的字段值
+        """
+        formatter = Formatter()
+        statics = [""]
+        fields = []
+        for literal, field_name, format_spec, conversion in formatter.parse(template):
+            statics[-1] += literal
+            if field_name is None:
+                continue
+            if format_spec and "{" in format_spec:
+                raise ValueError(f"模板字段 {field_name} 的格式说明中包含嵌套字段，不支持预编译")
+            if field_name in fixed:
+                value = formatter.convert_field(fixed[field_name], conversion)
+                statics[-1] += format(value, format_spec or "")
+            else:
+                fields.append((field_name, conversion, format_spec or ""))
+                statics.append("")
+        self._set_parts(statics, fields)
+
+    def _set_parts(self, statics, fields):
+        self.statics = tuple(statics)
+        self.fields = tuple(tuple(field) for field in fields)
+        self.field_names = frozenset(name for name, _, _ in self.fields)
+        # JSON 字符串转义逐字符进行，静态部分预先转义，渲染 JSON 时只需转义动态字段
+        self.json_statics = tuple(dumpb(text)[1:-1] for text in self.statics)
+
+    @classmethod
+    def literal(cls, text: str) -> "CompiledTemplate":
+        """
+        不做任何格式化的模板（原样返回 text）
+        """
+        return cls.from_parts((text,), ())
+
+    @classmethod
+    def from_parts(cls, statics, fields) -> "CompiledTemplate":
+        """
+        由 parts() 的结果还原（用于注册表缓存）
+        """
+        compiled = cls.__new__(cls)
+        compiled._set_parts(statics, fields)
+        return compiled
+
+    def parts(self):
+        """
+        模板的纯数据表示：(静态文本元组, 动态字段元组)
+        """
+        return self.statics, self.fields
+
+    def _values(self, values: Dict[str, Any]):
+        formatter = Formatter()
+        for name, conversion, format_spec in self.fields:
+            value = values[name]
+            if conversion:
+                value = formatter.convert_field(value, conversion)
+            yield value if type(value) is str and not format_spec else format(value, format_spec)
+
+    def render(self, **values: Any) -> str:
+        """
+        填入剩余字段，返回完整 prompt
+        """
+        parts = [self.statics[0]]
+        for text, static in zip(self._values(values), self.statics[1:]):
+            parts.append(text)
+            parts.append(static)
+        return "".join(parts)
+
+    def render_json(self, **values: Any) -> bytes:
+        """
+        填入剩余字段，返回完整 prompt 序列化后的 JSON 字符串（UTF-8 bytes，含两侧引号），与 dumpb(render(...)) 相同
+        """
+        parts = [b'"', self.json_statics[0]]
+        for text, static in zip(self._values(values), self.json_statics[1:]):
+            parts.append(dumpb(text)[1:-1])
+            parts.append(static)
+        parts.append(b'"')
+        return b"".join(parts)
+
+    def render_json_batch(self, rows):
+        """
+        批量渲染：rows 为字段值字典的可迭代对象，返回对应的 JSON 字符串列表
+        """
+        render_json = self.render_json
+        return [render_json(**values) for values in rows]
+
+
+def _freeze(obj):
+    """
+    将配置转换为只读结构：dict -> MappingProxyType，list -> tuple
+    """
+    if isinstance(obj, dict):
+        return MappingProxyType({key: _freeze(value) for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(value) for value in obj)
+    return obj
+
+
+class PromptRegistry:
+    """
+    只读的 prompt 注册表：配置只解析一次，各阶段、各学科的模板预先编译
+    构建完成后不再修改，可以在线程间直接共享，不需要线程局部的 PromptLoader
+    
+    templates 的键：
+        ("1_ocr", workflow)                  OCR 模板（原样使用）
+        ("2_extract_qa", subject)             提取问答模板（已填入全部字段）
+        ("3_check_availability", subject)     可用性检查模板（待填入 query/answer）
+        ("质检单轮", None)                     待填入 query
+        ("质检多轮-1", None)                   已格式化
+        ("质检多轮-2", 模板名)                 待填入 query
+    配置缺失或格式化失败的模板不编译，PromptLoader 回退到逐次构建并抛出原有的异常
+    """
+
+    # 缓存格式版本，CompiledTemplate 的纯数据表示变化时递增
+    CACHE_VERSION = 1
+    OCR_TEMPLATE_KEYS = {"中高考": "template", "教辅QA": "template_edu"}
+    QUALITY_CHECK_2_KEYS = ("template-多轮2", "template-地理信息多轮2")
+
+    def __init__(self, config: dict, templates: Dict[tuple, CompiledTemplate]):
+        self.config = _freeze(config)
+        self.templates = MappingProxyType(dict(templates))
+
+    def get(self, stage: str, key: Any = None) -> Optional[CompiledTemplate]:
+        return self.templates.get((stage, key))
+
+    @staticmethod
+    def _compile_all(config: dict) -> Dict[tuple, CompiledTemplate]:
+        templates = {}
+
+        def add(key, build):
+            try:
+                templates[key] = build()
+            except (KeyError, TypeError, ValueError, IndexError, AttributeError):
+                pass
+
+        prompts = config.get("prompts") or {}
+        ocr_prompts = prompts.get("1_ocr") or {}
+        for workflow, template_key in PromptRegistry.OCR_TEMPLATE_KEYS.items():
+            add(("1_ocr", workflow), lambda: CompiledTemplate.literal(ocr_prompts[template_key]))
+
+        for subject, subject_config in (config.get("subjects") or {}).items():
+            def subject_rules(name):
+                rules = subject_config.get(name, "")
+                return rules if rules is not None else ""
+
+            add(("2_extract_qa", subject), lambda: CompiledTemplate(
+                prompts["2_extract_qa"]["template"],
+                subject=subject,
+                question_types=subject_config["question_types"],
+                extract_qa_rules=subject_rules("extract_qa_rules"),
+            ))
+            check_prompts = prompts.get("3_check_availability") or {}
+            if subject in PromptLoader.SPECIAL_SUBJECTS:
+                template_key = "template_special"
+            elif subject == PromptLoader.CHINESE_SUBJECT:
+                template_key = "template_chinese"
+            else:
+                template_key = "template"
+            add(("3_check_availability", subject), lambda: CompiledTemplate(
+                check_prompts[template_key],
+                subject=subject,
+                question_types=subject_config["question_types"],
+                check_rules=subject_rules("check_rules"),
+            ))
+
+        check = config.get("Prompt_check") or {}
+        add(("质检单轮", None), lambda: CompiledTemplate(check["template-单轮"]))
+        add(("质检多轮-1", None), lambda: CompiledTemplate.literal(check["template-多轮1"].format()))
+        for template_key in PromptRegistry.QUALITY_CHECK_2_KEYS:
+            add(("质检多轮-2", template_key), lambda: CompiledTemplate(check[template_key]))
+        return templates
+
+    @staticmethod
+    def read_config(config_path: Path) -> dict:
+        """
+        解析 YAML 配置（只在缓存失效时执行，yaml 延迟导入）
+        """
+        import yaml
+        with open(config_path, "r", encoding="utf-8") as f:
+            return yaml.safe_load(f)
+
+    @staticmethod
+    def cache_path(config_path: Path) -> Path:
+        return config_path.with_name(f".{config_path.name}.pkl")
+
+    @staticmethod
+    def _cache_key(config_path: Path) -> tuple:
+        st = os.stat(config_path)
+        return (PromptRegistry.CACHE_VERSION, str(config_path.resolve()), st.st_mtime_ns, st.st_size)
+
+    @classmethod
+    def load(cls, config_path: Path) -> "PromptRegistry":
+        """
+        优先读取缓存（键为 YAML 的路径、修改时间和大小），缓存缺失或失效时重新构建并写入缓存
+        缓存中只保存纯数据（配置字典和模板的静态/动态部分），不依赖类的模块路径
+        """
+        key = cls._cache_key(config_path)
+        cache_path = cls.cache_path(config_path)
+        try:
+            with open(cache_path, "rb") as f:
+                payload = pickle.load(f)
+            if payload["key"] == key:
+                templates = {name: CompiledTemplate.from_parts(*parts) for name, parts in payload["templates"].items()}
+                return cls(payload["config"], templates)
+        except Exception:
+            pass  # 缓存不存在或损坏时重新构建
+
+        config = cls.read_config(config_path)
+        templates = cls._compile_all(config)
+        payload = {
+            "key": key,
+            "config": config,
+            "templates": {name: compiled.parts() for name, compiled in templates.items()},
+        }
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # 配置目录不可写时不使用缓存
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        return cls(config, templates)
+
+
+# 进程内共用的注册表：按配置文件路径保存，YAML 修改后重新加载
+_registries: Dict[str, tuple] = {}
+_registries_lock = threading.Lock()
+
+
+def get_prompt_registry(config_path) -> PromptRegistry:
+    """
+    获取配置文件对应的进程内共用注册表（线程安全，首次加载时加锁）
+    """
+    config_path = Path(config_path)
+    path_key = str(config_path.resolve())
+    mtime_ns = os.stat(config_path).st_mtime_ns
+    cached = _registries.get(path_key)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    with _registries_lock:
+        cached = _registries.get(path_key)
+        if cached is None or cached[0] != mtime_ns:
+            cached = (mtime_ns, PromptRegistry.load(config_path))
+            _registries[path_key] = cached
+    return cached[1]
 
 
 class PromptLoader:
@@ -20,8 +284,9 @@ class PromptLoader:
         self.config_path = Path(config_path)
         if not self.config_path.exists():
             raise FileNotFoundError(f"配置文件 {config_path} 不存在")
-        with open(self.config_path, "r", encoding="utf-8") as f:
-            self.config = yaml.safe_load(f)
+        # 配置和预编译模板来自进程内共用的只读注册表，多次创建 PromptLoader 不会重复解析 YAML
+        self.registry = get_prompt_registry(self.config_path)
+        self.config = self.registry.config
 
     def get_subject_config(self, subject: str) -> dict:
         """
@@ -89,6 +354,9 @@ class PromptLoader:
         Returns:
             OCR阶段的prompt字符串
         """
+        compiled = self.registry.get("1_ocr", workflow)
+        if compiled is not None:
+            return compiled.render()
         ocr_prompts = self.config["prompts"]["1_ocr"]
         template_key = "template" if workflow == "中高考" else "template_edu"
         
@@ -106,6 +374,9 @@ class PromptLoader:
         Returns:
             提取问答阶段的prompt字符串
         """
+        compiled = self.registry.get("2_extract_qa", subject)
+        if compiled is not None:
+            return compiled.render()
         question_types = self.get_question_types(subject)
         extract_qa_rules = self.get_extract_qa_rules(subject)
         template = self.config["prompts"]["2_extract_qa"]["template"]
@@ -115,6 +386,38 @@ class PromptLoader:
             extract_qa_rules=extract_qa_rules
         )
 
+    def _check_availability_template(self, subject: str) -> str:
+        """
+        根据学科选择可用性检查阶段的模板
+        """
+        if subject in self.SPECIAL_SUBJECTS:
+            return self.config["prompts"]["3_check_availability"]["template_special"]
+        elif subject == self.CHINESE_SUBJECT:
+            return self.config["prompts"]["3_check_availability"]["template_chinese"]
+        else:
+            return self.config["prompts"]["3_check_availability"]["template"]
+
+    def compile_check_availability(self, subject: str) -> CompiledTemplate:
+        """
+        获取学科的可用性检查预编译模板：学科、题型、检查规则和模板选择只解析一次，渲染时只需填入 query/answer
+        
+        Args:
+            subject: 学科名称
+            
+        Returns:
+            CompiledTemplate，调用 render(query=..., answer=...) 或 render_json(...) 生成 prompt
+        """
+        compiled = self.registry.get("3_check_availability", subject)
+        if compiled is None:
+            # 注册表中没有的学科按原方式构建，抛出原有的异常
+            compiled = CompiledTemplate(
+                self._check_availability_template(subject),
+                subject=subject,
+                question_types=self.get_question_types(subject),
+                check_rules=self.get_check_rules(subject),
+            )
+        return compiled
+
     def _build_check_availability_prompt(self, subject: str, query: str, answer: str) -> str:
         """
         构建可用性检查阶段的prompt
@@ -127,24 +430,7 @@ class PromptLoader:
         Returns:
             可用性检查阶段的prompt字符串
         """
-        question_types = self.get_question_types(subject)
-        check_rules = self.get_check_rules(subject)
-        
-        # 根据学科选择模板
-        if subject in self.SPECIAL_SUBJECTS:
-            template = self.config["prompts"]["3_check_availability"]["template_special"]
-        elif subject == self.CHINESE_SUBJECT:
-            template = self.config["prompts"]["3_check_availability"]["template_chinese"]
-        else:
-            template = self.config["prompts"]["3_check_availability"]["template"]
-            
-        return template.format(
-            subject=subject,
-            question_types=question_types,
-            check_rules=check_rules,
-            query=query,
-            answer=answer,
-        )
+        return self.compile_check_availability(subject).render(query=query, answer=answer)
 
     def _build_quality_check_prompt(self, stage: str, query: Optional[str] = None) -> str:
         """
@@ -158,9 +444,15 @@ class PromptLoader:
             质检阶段的prompt字符串
         """
         if stage == "质检单轮":
+            compiled = self.registry.get(stage)
+            if compiled is not None:
+                return compiled.render(query=query)
             template = self.config["Prompt_check"]["template-单轮"]
             return template.format(query=query)
         elif stage == "质检多轮-1":
+            compiled = self.registry.get(stage)
+            if compiled is not None:
+                return compiled.render()
             template = self.config["Prompt_check"]["template-多轮1"]
             return template.format()
         elif stage == "质检多轮-2":
@@ -168,6 +460,9 @@ class PromptLoader:
                 raise ValueError("质检多轮-2阶段需要提供query参数")
                 
             template_key = "template-地理信息多轮2" if query in self.SPECIAL_SUBJECTS else "template-多轮2"
+            compiled = self.registry.get(stage, template_key)
+            if compiled is not None:
+                return compiled.render(query=query)
             template = self.config["Prompt_check"][template_key]
             return template.format(query=query)
         else:
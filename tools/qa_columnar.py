@@ -0,0 +1,314 @@
+import os
+from collections import defaultdict
+from jsonl_io import JsonlWriter, dumps, iter_jsonl, loads
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+
+# 第4~6步之间的 QA 中间文件格式：
+#   jsonl   每行一条记录（默认，文件名 {section}.json）
+#   parquet 列式存储（需要 pyarrow），每个 section 两个文件：
+#           {section}.parquet        记录表，一条记录一行
+#           {section}.sub_qa.parquet 共享题干的小问表，一个小问一行，通过 record_id 与记录表关联
+QA_FORMATS = ("jsonl", "parquet")
+PARQUET_SUFFIX = ".parquet"
+SUB_QA_SUFFIX = ".sub_qa.parquet"
+
+# 拆成独立列的字段（字符串），其余字段保存在 extra 列（JSON）中
+RECORD_COLUMNS = ("source_type", "section", "题目背景知识", "题目编号", "题目内容", "对应答案")
+SUB_QA_COLUMNS = ("题目编号", "题目内容", "对应答案")
+
+
+def require_arrow():
+    if pa is None:
+        raise ImportError("parquet 中间格式需要安装 pyarrow：pip install pyarrow")
+
+
+def qa_file_name(name, qa_format="jsonl"):
+    """
+    section 对应的中间文件名
+    """
+    if qa_format not in QA_FORMATS:
+        raise ValueError(f"未知的中间文件格式：{qa_format}，可选：{', '.join(QA_FORMATS)}")
+    return f"{name}{PARQUET_SUFFIX}" if qa_format == "parquet" else f"{name}.json"
+
+
+def is_qa_file(filename):
+    """
+    是否为 QA 中间文件（小问表随记录表一起读写，不单独计入）
+    """
+    if filename.endswith(SUB_QA_SUFFIX):
+        return False
+    return filename.endswith(".json") or filename.endswith(PARQUET_SUFFIX)
+
+
+def is_parquet(file_path):
+    return file_path.endswith(PARQUET_SUFFIX)
+
+
+def qa_file_stem(filename):
+    """
+    去掉中间文件后缀的 section 名
+    """
+    for suffix in (PARQUET_SUFFIX, ".json"):
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def sub_qa_path(file_path):
+    return file_path[:-len(PARQUET_SUFFIX)] + SUB_QA_SUFFIX
+
+
+def remove_other_formats(file_path):
+    """
+    删除与 file_path 同目录、同 section 但格式不同的中间文件（切换 qa_format 后重跑时清理旧格式的文件，
+    避免下游步骤把两种格式的同一 section 都读一遍）
+    """
+    dir_name, filename = os.path.split(file_path)
+    for qa_format in QA_FORMATS:
+        other = os.path.join(dir_name, qa_file_name(qa_file_stem(filename), qa_format))
+        if other == file_path:
+            continue
+        for path in ((other, sub_qa_path(other)) if is_parquet(other) else (other,)):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _split_fields(obj, columns):
+    """
+    取出 obj 中值为字符串的列字段，extra 中对应位置留空字符串占位，保证还原后字段顺序不变
+    """
+    extra = dict(obj)
+    values = {}
+    for field in columns:
+        value = obj.get(field)
+        if isinstance(value, str):
+            values[field] = value
+            extra[field] = ""
+        else:
+            values[field] = None  # 缺失或非字符串的值保留在 extra 中
+    return values, extra
+
+
+def flatten_records(records):
+    """
+    将记录拆分为记录表和小问表的列数据（dict: 列名 -> 列表）
+    """
+    record_cols = defaultdict(list)
+    sub_cols = defaultdict(list)
+    for record_id, record in enumerate(records):
+        values, extra = _split_fields(record, RECORD_COLUMNS)
+        sub_qa = record.get("sub_qa")
+        n_sub = None
+        if isinstance(sub_qa, list) and all(isinstance(sub, dict) for sub in sub_qa):
+            n_sub = len(sub_qa)
+            extra["sub_qa"] = []
+            for sub_index, sub in enumerate(sub_qa):
+                sub_values, sub_extra = _split_fields(sub, SUB_QA_COLUMNS)
+                sub_cols["record_id"].append(record_id)
+                sub_cols["sub_index"].append(sub_index)
+                for field in SUB_QA_COLUMNS:
+                    sub_cols[field].append(sub_values[field])
+                sub_cols["extra"].append(dumps(sub_extra))
+
+        record_cols["record_id"].append(record_id)
+        record_cols["has_sub_qa"].append("sub_qa" in record)
+        record_cols["n_sub"].append(n_sub)
+        for field in RECORD_COLUMNS:
+            record_cols[field].append(values[field])
+        record_cols["extra"].append(dumps(extra))
+    return record_cols, sub_cols
+
+
+def records_to_tables(records):
+    """
+    记录列表 -> (记录表, 小问表)
+    """
+    require_arrow()
+    record_cols, sub_cols = flatten_records(records)
+    record_schema = pa.schema(
+        [("record_id", pa.int64()), ("has_sub_qa", pa.bool_()), ("n_sub", pa.int32())]
+        + [(field, pa.string()) for field in RECORD_COLUMNS]
+        + [("extra", pa.string())]
+    )
+    sub_schema = pa.schema(
+        [("record_id", pa.int64()), ("sub_index", pa.int32())]
+        + [(field, pa.string()) for field in SUB_QA_COLUMNS]
+        + [("extra", pa.string())]
+    )
+    record_table = pa.table({name: record_cols.get(name, []) for name in record_schema.names}, schema=record_schema)
+    sub_table = pa.table({name: sub_cols.get(name, []) for name in sub_schema.names}, schema=sub_schema)
+    return record_table, sub_table
+
+
+def _restore(row, columns):
+    """
+    由一行列数据还原字典
+    """
+    obj = loads(row["extra"])
+    for field in columns:
+        value = row[field]
+        if value is not None:
+            obj[field] = value
+    return obj
+
+
+def tables_to_records(record_table, sub_table=None):
+    """
+    (记录表, 小问表) -> 逐条返回记录，与写入前的记录相同（字段及顺序一致）
+    """
+    subs = defaultdict(list)
+    if sub_table is not None:
+        for row in sub_table.to_pylist():
+            subs[row["record_id"]].append(_restore(row, SUB_QA_COLUMNS))
+    for row in record_table.to_pylist():
+        record = _restore(row, RECORD_COLUMNS)
+        if row.get("n_sub") is not None:
+            record["sub_qa"] = subs.get(row["record_id"], [])
+        yield record
+
+
+def write_qa_file(file_path, records):
+    """
+    写入 QA 中间文件，按后缀选择格式
+    """
+    if is_parquet(file_path):
+        record_table, sub_table = records_to_tables(records)
+        pq.write_table(record_table, file_path)
+        pq.write_table(sub_table, sub_qa_path(file_path))
+        return
+    with JsonlWriter(file_path) as writer:
+        for record in records:
+            writer.write(record)
+
+
+def read_qa_tables(file_path):
+    """
+    读取 parquet 中间文件，返回 (记录表, 小问表)
+    第6步提单行中保存完整的原始记录（original_data），各步骤都需要读取全部列
+    """
+    require_arrow()
+    return pq.read_table(file_path), pq.read_table(sub_qa_path(file_path))
+
+
+def iter_qa_records(file_path):
+    """
+    逐条读取 QA 中间文件中的记录，按后缀选择格式
+    """
+    if is_parquet(file_path):
+        yield from tables_to_records(*read_qa_tables(file_path))
+    else:
+        yield from iter_jsonl(file_path)
+
+
+# ================== 列式过滤 ==================
+# 结果为每条记录的判定：True/False 为可以直接确定的结果，None 表示需要逐条调用 DataFilter 检查
+# 第5步读取 parquet 中间文件时，通过 ColumnFlags 交给 DataFilter.check_batch 使用
+
+def _sub_record_ids(sub_table, mask):
+    return set(pc.filter(sub_table["record_id"], mask).to_pylist())
+
+
+def empty_answer_flags(record_table, sub_table, invalid_answers):
+    """
+    DataFilter.is_emptyA 的列式版本：答案在无效答案集合中即判定为答案缺失
+    """
+    value_set = pa.array(sorted(invalid_answers), pa.string())
+    single_hit = pc.is_in(record_table["对应答案"], value_set=value_set).to_pylist()
+    single_null = pc.is_null(record_table["对应答案"]).to_pylist()
+    sub_hit = _sub_record_ids(sub_table, pc.fill_null(pc.is_in(sub_table["对应答案"], value_set=value_set), False))
+    sub_null = _sub_record_ids(sub_table, pc.is_null(sub_table["对应答案"]))
+
+    flags = []
+    for record_id, has_sub, n_sub, hit, null in zip(record_table["record_id"].to_pylist(),
+                                                     record_table["has_sub_qa"].to_pylist(),
+                                                     record_table["n_sub"].to_pylist(),
+                                                     single_hit, single_null):
+        if not has_sub:
+            flags.append(None if null else bool(hit))
+        elif n_sub is None:
+            flags.append(None)
+        elif record_id in sub_hit:
+            flags.append(True)
+        else:
+            flags.append(None if record_id in sub_null else False)
+    return flags
+
+
+def too_short_flags(record_table, sub_table, th_length=20):
+    """
+    DataFilter.is_too_short 的列式预判：分词数不超过字符数，字符数已低于阈值的记录一定过短，
+    其余记录需要分词后判断
+    """
+    single_len = pc.utf8_length(record_table["题目内容"]).to_pylist()
+    bg_len = dict(zip(record_table["record_id"].to_pylist(),
+                      pc.utf8_length(record_table["题目背景知识"]).to_pylist()))
+    sub_short = set()
+    for record_id, q_len in zip(sub_table["record_id"].to_pylist(),
+                                pc.utf8_length(sub_table["题目内容"]).to_pylist()):
+        b_len = bg_len.get(record_id)
+        if q_len is not None and b_len is not None and b_len + q_len < 1.5 * th_length:
+            sub_short.add(record_id)
+
+    flags = []
+    for record_id, has_sub, n_sub, q_len in zip(record_table["record_id"].to_pylist(),
+                                                record_table["has_sub_qa"].to_pylist(),
+                                                record_table["n_sub"].to_pylist(), single_len):
+        if not has_sub:
+            flags.append(True if q_len is not None and q_len < th_length else None)
+        elif n_sub is None:
+            flags.append(None)
+        elif n_sub == 0:
+            flags.append(False)
+        else:
+            flags.append(True if record_id in sub_short else None)
+    return flags
+
+
+class ColumnFlags:
+    """
+    一个中间文件的列式预判结果，按 (检查函数名, 参数) 计算一次后缓存，行号与记录表的行一一对应
+    没有列式版本的检查返回 None
+    """
+
+    def __init__(self, record_table, sub_table, invalid_answers):
+        self.record_table = record_table
+        self.sub_table = sub_table
+        self.invalid_answers = invalid_answers
+        self.cache = {}
+
+    def get(self, name, param=None):
+        key = (name, param)
+        if key not in self.cache:
+            if name == "is_emptyA":
+                self.cache[key] = empty_answer_flags(self.record_table, self.sub_table, self.invalid_answers)
+            elif name == "is_too_short":
+                # 未配置参数时与 DataFilter.is_too_short 的默认阈值一致
+                th_length = param if param is not None else 20
+                self.cache[key] = too_short_flags(self.record_table, self.sub_table, th_length)
+            else:
+                self.cache[key] = None
+        return self.cache[key]
+
+
+def convert_qa_file(input_path, output_path):
+    """
+    在 jsonl 与 parquet 之间转换单个中间文件
+    """
+    write_qa_file(output_path, list(iter_qa_records(input_path)))
+    return output_path
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("用法：python qa_columnar.py <输入文件(.json/.parquet)> <输出文件(.json/.parquet)>")
+        sys.exit(1)
+    convert_qa_file(sys.argv[1], sys.argv[2])
+    print(f"已转换：{sys.argv[1]} → {sys.argv[2]}")
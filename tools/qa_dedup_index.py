@@ -0,0 +1,646 @@
+import hashlib
+import logging
+import math
+import sqlite3
+from array import array
+from collections import defaultdict
+from operator import itemgetter
+from rapidfuzz import fuzz
+
+
+def check_dedup(text1, text2, ps_th=80, fs_th=80):
+    """
+    使用 rapidfuzz 进行文本相似度比较，提高去重效率
+    """
+    partial_similarity = fuzz.partial_ratio(text1, text2)  # 部分匹配比率
+    full_similarity = fuzz.ratio(text1, text2)  # 完全匹配比率
+    # 两个相似度任意一个超过阈值都判定重复
+    return partial_similarity >= ps_th or full_similarity >= fs_th
+
+
+def char_ngrams(text, n=2):
+    """
+    文本的字符 n-gram 多重集合，不足 n 个字时整体作为一个 gram
+
+    相似度按字符计数，重复出现的 gram（如填空的"____"）也要逐次计入：
+    同一 gram 第 k 次（k >= 1）出现记为 "gram#k"，集合大小即 gram 总数，两个集合的交集大小即多重集合交集。
+    带序号的 gram 长度大于 n，不会与原始 gram 冲突。
+    """
+    if len(text) < n:
+        return {text} if text else set()
+    grams = set()
+    seen = {}
+    for i in range(len(text) - n + 1):
+        gram = text[i:i + n]
+        k = seen.get(gram, 0)
+        seen[gram] = k + 1
+        grams.add(f"{gram}#{k}" if k else gram)
+    return grams
+
+
+def band_of(size, base=1.25):
+    """
+    gram 集合大小对应的档位，同一档内集合大小相差不超过 base 倍
+    """
+    if size <= 1:
+        return 0
+    return int(math.log(size, base))
+
+
+def min_overlap(size_a, size_b, overlap_ratio=0.3):
+    """
+    两条文本判重所需的最少共享 gram 数（按多重集合计数）
+
+    较短文本有 m 个字时，check_dedup 为真意味着它与另一文本（或其中的窗口）的公共子序列至少约 2m/3 个字，
+    扣除两侧未匹配字符造成的断点后，按位置对齐的共享 bigram 至少 (m - 3) / 3 个，
+    overlap_ratio 取 0.3 时 int(0.3 * (m - 1)) 不超过该下界向上取整后的值。
+    """
+    return max(1, int(overlap_ratio * min(size_a, size_b)))
+
+
+def text_digest(text):
+    """
+    文本摘要（16字节），代替文本本身作为完全相同文本的查找键
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+# 前缀之外、文档频率不超过该值的 gram 也继续探查，用廉价的命中计数代替逐个候选校验
+PROBE_DF_LIMIT = 1000
+
+
+def probe_length(ordered, t, get_df):
+    """
+    按文档频率升序排列的 gram 中需要探查的个数
+
+    前缀过滤要求至少探查最稀有的 (g - t + 1) 个 gram；
+    之后的 gram 只要倒排表不太长也一并探查，未探查的 gram 越少，命中计数的下界越紧。
+    """
+    size = len(ordered)
+    probe_n = size - t + 1
+    limit = max(get_df(ordered[probe_n - 1], 0), PROBE_DF_LIMIT)
+    while probe_n < size and get_df(ordered[probe_n], 0) <= limit:
+        probe_n += 1
+    return probe_n
+
+
+class NearDupIndex:
+    """
+    基于字符 n-gram 倒排索引的近似重复检索器
+
+    check_dedup 的 80/80 阈值要求较短文本的大部分字符按顺序出现在另一文本中，
+    因此两者共享的 bigram 数（多重集合，重复的 gram 逐次计数）至少为较短文本 bigram 数的一定比例（overlap_ratio）。
+    检索时：
+      1. 按 gram 集合大小分档，每档内用"共享 gram 数下界"确定需要探查的 gram 数；
+      2. 前缀过滤：只探查查询文本中当前最稀有的 (g - t + 1) 个 gram 的倒排表，
+         高频 gram（如"下列"、"的是"）不会被扫描；
+      3. 对候选计算精确 gram 交集，再用 check_dedup 校验，返回最相似的一条。
+    单次查询代价只与稀有 gram 的倒排表长度相关，整体接近线性。
+    少于 SHORT_TEXT_LEN 个字的极短文本（单字等）部分匹配几乎总会命中，gram 过滤不再成立，
+    这类文本数量很少，直接与全部入库文本比对。
+
+    传入 text_source 时索引不保存文本：text_source(题目索引) 返回入库时的文本（如按偏移从输入文件回读），
+    只在校验候选时调用，常驻内存的只有 gram 计数、文档频率、倒排表和文本摘要。
+    倒排表和文档频率随不同 gram 的数量增长，需要限制内存时使用 SpilledNearDupIndex。
+    """
+
+    # 极短文本长度上限（不含）
+    SHORT_TEXT_LEN = 4
+
+    def __init__(self, ngram=2, overlap_ratio=0.3, ps_th=80, fs_th=80, text_source=None):
+        self.ngram = ngram
+        self.overlap_ratio = overlap_ratio
+        self.ps_th = ps_th
+        self.fs_th = fs_th
+        self.text_source = text_source
+        self.texts = []  # 所有入库文本，下标即题目索引（传入 text_source 时不保存）
+        self.gram_counts = array('I')  # 每条文本的 gram 集合大小，下标即题目索引
+        self.exact = defaultdict(list)  # 完全相同文本的摘要 -> 题目索引列表
+        self.df = {}  # gram -> 出现该 gram 的文本数
+        self.bands = defaultdict(dict)  # 档位 -> gram -> 题目索引数组
+        self.band_min_size = {}  # 档位 -> 档内最小 gram 集合大小
+        self.short_ids = []  # 极短文本的题目索引
+
+    def __len__(self):
+        return len(self.gram_counts)
+
+    def text(self, idx):
+        """
+        按题目索引取入库文本
+        """
+        if self.text_source is not None:
+            return self.text_source(idx)
+        return self.texts[idx]
+
+    def add(self, text):
+        """
+        将文本加入索引，返回其题目索引
+        """
+        idx = len(self.gram_counts)
+        grams = char_ngrams(text, self.ngram)
+        if self.text_source is None:
+            self.texts.append(text)
+        self.gram_counts.append(len(grams))
+        self.exact[text_digest(text)].append(idx)
+        if len(text) < self.SHORT_TEXT_LEN:
+            self.short_ids.append(idx)
+
+        band = band_of(len(grams))
+        self._add_postings(idx, band, grams)
+        if band not in self.band_min_size or len(grams) < self.band_min_size[band]:
+            self.band_min_size[band] = len(grams)
+        return idx
+
+    def _add_postings(self, idx, band, grams):
+        """
+        将题目的 gram 写入倒排表并更新文档频率
+        """
+        postings = self.bands[band]
+        df = self.df
+        for gram in grams:
+            df[gram] = df.get(gram, 0) + 1
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = array('I', (idx,))
+            else:
+                posting.append(idx)
+
+    def _doc_freqs(self, grams):
+        """
+        返回 gram -> 文档频率，索引中不存在的 gram 不返回
+        """
+        df = self.df
+        return {gram: df[gram] for gram in grams if gram in df}
+
+    def _band_hits(self, band, grams):
+        """
+        返回档内题目索引 -> 在给定 gram 的倒排表中的命中次数
+        """
+        postings = self.bands[band]
+        hits = {}
+        for gram in grams:
+            for idx in postings.get(gram, ()):
+                hits[idx] = hits.get(idx, 0) + 1
+        return hits
+
+    def candidates(self, text):
+        """
+        返回通过 gram 计数过滤的候选题目索引（未经过 check_dedup 校验）
+        """
+        if len(text) < self.SHORT_TEXT_LEN:
+            return set(range(len(self)))
+
+        found = set(self.exact.get(text_digest(text), ()))
+        found.update(self.short_ids)
+        grams = char_ngrams(text, self.ngram)
+        size = len(grams)
+        if not size:
+            return found
+
+        # 索引中不存在的 gram 没有倒排表，但仍占用前缀名额
+        df = self._doc_freqs(grams)
+        ordered = sorted(grams, key=lambda g: df.get(g, 0))
+        for band, min_size in self.band_min_size.items():
+            t = min_overlap(size, min_size, self.overlap_ratio)
+            probe_n = probe_length(ordered, t, df.get)
+            skipped = size - probe_n
+            # 探查的倒排表中累计命中次数，命中数 + 未探查 gram 数是共享 gram 数的上界
+            hits = self._band_hits(band, [g for g in ordered[:probe_n] if g in df])
+            for idx, hit in hits.items():
+                # 档内下界 t 不超过任一候选所需的共享数，先用它廉价地排除绝大多数候选
+                if hit + skipped < t:
+                    continue
+                need = min_overlap(size, self.gram_counts[idx], self.overlap_ratio)
+                if hit + skipped < need or idx in found:
+                    continue
+                # 上界够但命中数不够时，按需从文本重新计算候选的 gram 集合（索引中不常驻）
+                if hit >= need or len(grams & char_ngrams(self.text(idx), self.ngram)) >= need:
+                    found.add(idx)
+        return found
+
+    def find_best(self, text):
+        """
+        查找与 text 判重（check_dedup 为真）且最相似的入库文本
+
+        Returns:
+            (最相似文本, 题目索引)，不存在时返回 None
+        """
+        best = None
+        best_score = -1
+        for idx in self.candidates(text):
+            other = self.text(idx)
+            if not check_dedup(text, other, self.ps_th, self.fs_th):
+                continue
+            score = fuzz.ratio(text, other)
+            # 相似度相同时保留最新入库的文本
+            if score > best_score or (score == best_score and idx > best[1]):
+                best, best_score = (other, idx), score
+        return best
+
+
+class SpilledNearDupIndex(NearDupIndex):
+    """
+    倒排表和文档频率落在临时 SQLite 库中的 NearDupIndex，检索策略和结果与 NearDupIndex 完全一致
+
+    表结构与 DedupStore 的 grams、gram_df 相同（不分学科），库文件由 SQLite 在临时目录创建、关闭连接时删除。
+    新加入的倒排表先放在内存中（即 NearDupIndex 的 df、bands），累计 FLUSH_POSTINGS 条后排序批量写入库中，
+    查询时合并库中和内存中的结果。
+    常驻内存的只有每条文本的 gram 数、文本摘要、未写入的倒排表和 SQLite 页缓存（CACHE_KB），
+    用于流式去重等需要限制内存的场景。
+    """
+
+    CACHE_KB = 64 * 1024  # SQLite 页缓存上限
+    FLUSH_POSTINGS = 200000  # 内存中倒排表条数达到该值时写入库中
+    SQL_VAR_LIMIT = 500  # 单条 IN 查询的参数个数上限
+
+    def __init__(self, ngram=2, overlap_ratio=0.3, ps_th=80, fs_th=80, text_source=None):
+        super().__init__(ngram, overlap_ratio, ps_th, fs_th, text_source)
+        # 文件名为空时 SQLite 使用临时库，缓存放不下时才写入磁盘
+        self.conn = sqlite3.connect("", isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(f"PRAGMA cache_size=-{self.CACHE_KB}")
+        self.conn.executescript("""
+            CREATE TABLE grams (
+                gram TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                qid INTEGER NOT NULL,
+                PRIMARY KEY (gram, band, qid)
+            ) WITHOUT ROWID;
+            CREATE TABLE gram_df (
+                gram TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        # 临时库无需落盘，整个生命周期只开一个事务，避免每次提交都把脏页写回文件
+        self.conn.execute("BEGIN")
+        self.pending = 0  # 内存中未写入库的倒排表条数
+
+    def _chunks(self, items):
+        for i in range(0, len(items), self.SQL_VAR_LIMIT):
+            yield items[i:i + self.SQL_VAR_LIMIT]
+
+    def _add_postings(self, idx, band, grams):
+        super()._add_postings(idx, band, grams)
+        self.pending += len(grams)
+        if self.pending >= self.FLUSH_POSTINGS:
+            self._flush()
+
+    def _flush(self):
+        """
+        将内存中的倒排表和文档频率按 gram 排序后批量写入库中
+        """
+        cur = self.conn.cursor()
+        rows = [(gram, band, idx) for band, postings in self.bands.items() for gram, ids in postings.items() for idx in ids]
+        # 按 gram 排序后插入，B 树上的写入位置连续
+        rows.sort(key=itemgetter(0))
+        cur.executemany("INSERT INTO grams (gram, band, qid) VALUES (?, ?, ?)", rows)
+        cur.executemany(
+            "INSERT INTO gram_df (gram, df) VALUES (?, ?) ON CONFLICT(gram) DO UPDATE SET df = df + excluded.df",
+            sorted(self.df.items())
+        )
+        self.df = {}
+        self.bands = defaultdict(dict)
+        self.pending = 0
+
+    def _doc_freqs(self, grams):
+        df = {}
+        for chunk in self._chunks(list(grams)):
+            marks = ",".join("?" * len(chunk))
+            df.update(self.conn.execute(f"SELECT gram, df FROM gram_df WHERE gram IN ({marks})", chunk))
+        for gram, n in super()._doc_freqs(grams).items():
+            df[gram] = df.get(gram, 0) + n
+        return df
+
+    def _band_hits(self, band, grams):
+        hits = defaultdict(int, super()._band_hits(band, grams))
+        for chunk in self._chunks(grams):
+            marks = ",".join("?" * len(chunk))
+            for idx, hit in self.conn.execute(
+                f"SELECT qid, COUNT(*) FROM grams WHERE gram IN ({marks}) AND band=? GROUP BY qid", (*chunk, band)
+            ):
+                hits[idx] += hit
+        return hits
+
+    def close(self):
+        self.conn.close()
+
+
+def recall_check(texts, ps_th=80, fs_th=80):
+    """
+    暴力校验索引召回：按顺序逐条入库，与之前每条文本两两 check_dedup，
+    判重为真但不在 candidates 中的记为漏检
+
+    Returns:
+        (判重为真的文本对数, 漏检的 (先入库下标, 后入库下标) 列表)
+    """
+    index = NearDupIndex(ps_th=ps_th, fs_th=fs_th)
+    pairs = 0
+    missed = []
+    for j, text in enumerate(texts):
+        found = index.candidates(text)
+        for i in range(j):
+            if check_dedup(text, texts[i], ps_th, fs_th):
+                pairs += 1
+                if i not in found:
+                    missed.append((i, j))
+        index.add(text)
+    return pairs, missed
+
+
+# 去重库按学科划分，与 0实时更新的去重路径/{subject}.txt 的划分保持一致
+SUBJECT_KEYWORDS = {
+    '英语': '英语',
+    '政治': '政治',
+    '道德与法治': '政治',
+    '历史': '历史',
+    '语文': '语文',
+    '地理': '地理',
+    '文综': '文综',
+    '信息': '信息科技',
+    '雅思托福': '英语',
+}
+
+
+def subject_key(source_type):
+    """
+    从 source_type（或子文件夹名）中提取去重库使用的学科，无法识别时原样返回
+    """
+    for keyword, subject in SUBJECT_KEYWORDS.items():
+        if keyword in source_type:
+            return subject
+    return source_type
+
+
+class DedupStore:
+    """
+    基于 SQLite 的持久化跨批次去重库，按学科存储历次留存的题目
+
+    与 NearDupIndex 使用相同的 gram 分档、计数下界和前缀过滤策略，
+    倒排表、gram 文档频率和档位信息都落在库中，每次运行直接查询、增量追加，无需重建。
+    同一批次重跑前先调用 drop_batch 清掉该批次旧数据，避免与自身判重。
+    极短文本只做完全匹配和极短文本之间的比对。
+    库文件记录格式版本（PRAGMA user_version），gram 的计算方式变化后打开旧库时按题目文本重建 gram 相关的表。
+    """
+
+    SQL_VAR_LIMIT = 500  # 单条 IN 查询的参数个数上限
+    # 库格式版本：2 起 gram 按多重集合计数（见 char_ngrams）
+    STORE_VERSION = 2
+    REBUILD_CHUNK = 10000  # 重建时每次读取的题目数
+
+    def __init__(self, db_path, ngram=2, overlap_ratio=0.3, ps_th=80, fs_th=80):
+        self.db_path = db_path
+        self.ngram = ngram
+        self.overlap_ratio = overlap_ratio
+        self.ps_th = ps_th
+        self.fs_th = fs_th
+        # 并行去重时多个进程共用同一个库，写锁等待时间放宽
+        self.conn = sqlite3.connect(db_path, timeout=600)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY,
+                subject TEXT NOT NULL,
+                text TEXT NOT NULL,
+                gram_count INTEGER NOT NULL,
+                is_short INTEGER NOT NULL,
+                batch TEXT,
+                section TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_questions_text ON questions(subject, text);
+            CREATE INDEX IF NOT EXISTS idx_questions_short ON questions(subject, is_short);
+            CREATE INDEX IF NOT EXISTS idx_questions_batch ON questions(batch);
+            CREATE TABLE IF NOT EXISTS grams (
+                subject TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                gram TEXT NOT NULL,
+                qid INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_grams ON grams(subject, gram, band);
+            CREATE INDEX IF NOT EXISTS idx_grams_qid ON grams(qid);
+            CREATE TABLE IF NOT EXISTS gram_df (
+                subject TEXT NOT NULL,
+                gram TEXT NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (subject, gram)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS bands (
+                subject TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                min_size INTEGER NOT NULL,
+                PRIMARY KEY (subject, band)
+            ) WITHOUT ROWID;
+        """)
+        self._upgrade()
+
+    def _upgrade(self):
+        """
+        库格式版本低于 STORE_VERSION 时重建 grams、gram_df、bands 表和题目的 gram 数
+        """
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] >= self.STORE_VERSION:
+            return
+        cur = self.conn.cursor()
+        # 多个进程同时打开旧库时只有一个进程重建，其余进程拿到写锁后发现版本已更新直接返回
+        cur.execute("BEGIN IMMEDIATE")
+        if cur.execute("PRAGMA user_version").fetchone()[0] >= self.STORE_VERSION:
+            self.conn.commit()
+            return
+        cur.execute("DELETE FROM grams")
+        cur.execute("DELETE FROM gram_df")
+        cur.execute("DELETE FROM bands")
+        df = defaultdict(int)
+        band_min_size = {}
+        last_id = rebuilt = 0
+        while True:
+            rows = cur.execute(
+                "SELECT id, subject, text FROM questions WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, self.REBUILD_CHUNK)
+            ).fetchall()
+            if not rows:
+                break
+            counts, gram_rows = [], []
+            for qid, subject, text in rows:
+                grams = char_ngrams(text, self.ngram)
+                band = band_of(len(grams))
+                counts.append((len(grams), qid))
+                gram_rows.extend((subject, band, g, qid) for g in grams)
+                for g in grams:
+                    df[(subject, g)] += 1
+                key = (subject, band)
+                band_min_size[key] = min(band_min_size.get(key, len(grams)), len(grams))
+            cur.executemany("UPDATE questions SET gram_count=? WHERE id=?", counts)
+            cur.executemany("INSERT INTO grams (subject, band, gram, qid) VALUES (?, ?, ?, ?)", gram_rows)
+            last_id = rows[-1][0]
+            rebuilt += len(rows)
+        cur.executemany("INSERT INTO gram_df (subject, gram, df) VALUES (?, ?, ?)",
+                        [(subject, g, n) for (subject, g), n in df.items()])
+        cur.executemany("INSERT INTO bands (subject, band, min_size) VALUES (?, ?, ?)",
+                        [(subject, band, n) for (subject, band), n in band_min_size.items()])
+        cur.execute(f"PRAGMA user_version={self.STORE_VERSION}")
+        self.conn.commit()
+        if rebuilt:
+            logging.info(f"去重库 {self.db_path} 升级到版本 {self.STORE_VERSION}，重建 {rebuilt} 道题目的 gram 索引")
+
+    def _chunks(self, items):
+        items = list(items)
+        for i in range(0, len(items), self.SQL_VAR_LIMIT):
+            yield items[i:i + self.SQL_VAR_LIMIT]
+
+    def _candidates(self, subject, text):
+        """
+        返回通过 gram 计数过滤的候选 (题目id, 文本)
+        """
+        cur = self.conn.cursor()
+        rows = cur.execute(
+            "SELECT id, text FROM questions WHERE subject=? AND (text=? OR is_short=1)",
+            (subject, text)
+        ).fetchall()
+        found = dict(rows)
+        if len(text) < NearDupIndex.SHORT_TEXT_LEN:
+            return found
+
+        grams = char_ngrams(text, self.ngram)
+        size = len(grams)
+        df = {}
+        for chunk in self._chunks(grams):
+            marks = ",".join("?" * len(chunk))
+            df.update(cur.execute(
+                f"SELECT gram, df FROM gram_df WHERE subject=? AND gram IN ({marks})",
+                (subject, *chunk)
+            ).fetchall())
+        # 库中不存在的 gram 没有倒排表，但仍占用前缀名额
+        ordered = sorted(grams, key=lambda g: df.get(g, 0))
+
+        verify = {}  # 需要重新计算 gram 交集的候选 -> 所需共享数
+        bands = cur.execute("SELECT band, min_size FROM bands WHERE subject=?", (subject,)).fetchall()
+        for band, min_size in bands:
+            t = min_overlap(size, min_size, self.overlap_ratio)
+            probe_n = probe_length(ordered, t, df.get)
+            skipped = size - probe_n
+            probe = [g for g in ordered[:probe_n] if g in df]
+            hits = defaultdict(int)
+            for chunk in self._chunks(probe):
+                marks = ",".join("?" * len(chunk))
+                for qid, hit in cur.execute(
+                    f"SELECT qid, COUNT(*) FROM grams WHERE subject=? AND gram IN ({marks}) AND band=? GROUP BY qid",
+                    (subject, *chunk, band)
+                ):
+                    hits[qid] += hit
+            for qid, hit in hits.items():
+                if hit + skipped >= t and qid not in found:
+                    verify[qid] = hit
+
+        for chunk in self._chunks(verify):
+            marks = ",".join("?" * len(chunk))
+            for qid, other, gram_count in cur.execute(
+                f"SELECT id, text, gram_count FROM questions WHERE id IN ({marks})", chunk
+            ):
+                need = min_overlap(size, gram_count, self.overlap_ratio)
+                if verify[qid] >= need or len(grams & char_ngrams(other, self.ngram)) >= need:
+                    found[qid] = other
+        return found
+
+    def find_best(self, subject, text):
+        """
+        查找去重库中与 text 判重（check_dedup 为真）且最相似的题目
+
+        Returns:
+            (最相似文本, 题目id)，不存在时返回 None
+        """
+        best = None
+        best_score = -1
+        for qid, other in self._candidates(subject, text).items():
+            if not check_dedup(text, other, self.ps_th, self.fs_th):
+                continue
+            score = fuzz.ratio(text, other)
+            if score > best_score or (score == best_score and qid > best[1]):
+                best, best_score = (other, qid), score
+        return best
+
+    def add(self, subject, text, batch="", section=""):
+        """
+        追加一条题目，需调用 commit 落盘
+        """
+        grams = char_ngrams(text, self.ngram)
+        band = band_of(len(grams))
+        cur = self.conn.cursor()
+        cur.execute(
+            "INSERT INTO questions (subject, text, gram_count, is_short, batch, section) VALUES (?, ?, ?, ?, ?, ?)",
+            (subject, text, len(grams), int(len(text) < NearDupIndex.SHORT_TEXT_LEN), batch, section)
+        )
+        qid = cur.lastrowid
+        cur.executemany(
+            "INSERT INTO grams (subject, band, gram, qid) VALUES (?, ?, ?, ?)",
+            [(subject, band, g, qid) for g in grams]
+        )
+        cur.executemany(
+            "INSERT INTO gram_df (subject, gram, df) VALUES (?, ?, 1) "
+            "ON CONFLICT(subject, gram) DO UPDATE SET df = df + 1",
+            [(subject, g) for g in grams]
+        )
+        cur.execute(
+            "INSERT INTO bands (subject, band, min_size) VALUES (?, ?, ?) "
+            "ON CONFLICT(subject, band) DO UPDATE SET min_size = MIN(min_size, excluded.min_size)",
+            (subject, band, len(grams))
+        )
+        return qid
+
+    def drop_batch(self, batch, subject=None):
+        """
+        删除某一批次写入的全部题目（批次重跑前调用），传入subject时只删除该学科分区
+        """
+        cur = self.conn.cursor()
+        where, params = "batch=?", (batch,)
+        if subject is not None:
+            where, params = "batch=? AND subject=?", (batch, subject)
+        rows = cur.execute(f"SELECT id, subject, text FROM questions WHERE {where}", params).fetchall()
+        df_delta = defaultdict(int)
+        for _, row_subject, text in rows:
+            for g in char_ngrams(text, self.ngram):
+                df_delta[(row_subject, g)] += 1
+        cur.executemany(
+            "UPDATE gram_df SET df = df - ? WHERE subject=? AND gram=?",
+            [(n, row_subject, g) for (row_subject, g), n in df_delta.items()]
+        )
+        cur.execute("DELETE FROM gram_df WHERE df <= 0")
+        cur.executemany("DELETE FROM grams WHERE qid=?", [(qid,) for qid, _, _ in rows])
+        cur.execute(f"DELETE FROM questions WHERE {where}", params)
+        self.conn.commit()
+        return len(rows)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # 用历史去重列表初始化去重库：python qa_dedup_index.py <去重库.db> <学科> <去重列表.txt>
+    # 去重列表每行一道题目文本
+    # 校验索引召回（两两比对，只适合几千条以内）：python qa_dedup_index.py --recall <文本.txt>
+    import sys
+    from tqdm import tqdm
+
+    if sys.argv[1] == "--recall":
+        with open(sys.argv[2], 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+        pairs, missed = recall_check(texts)
+        print(f"{len(texts)} 条文本，判重 {pairs} 对，漏检 {len(missed)} 对")
+        for i, j in missed[:10]:
+            print(f"  {texts[i]!r} <-> {texts[j]!r}")
+        sys.exit(1 if missed else 0)
+
+    db_path, subject, txt_path = sys.argv[1], sys.argv[2], sys.argv[3]
+    store = DedupStore(db_path)
+    added = 0
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        for line in tqdm(f, desc=f"导入{subject}"):
+            text = line.strip()
+            if text:
+                store.add(subject, text, batch="历史去重列表", section=txt_path)
+                added += 1
+    store.close()
+    print(f"{subject}: 导入 {added} 道题目 -> {db_path}")
@@ -0,0 +1,202 @@
+import re
+import sys
+import time
+from functools import lru_cache
+from jsonl_io import dumps, loads
+
+# 分词计数服务：DataFilter.is_too_short 只需要分词个数，不需要分词结果
+#   jieba   精确计数（与 len(jieba.lcut(text)) 一致），默认
+#   approx  近似计数：按汉字、字母数字串、其他字符分别计数，系数在基准集上相对 jieba 标定；
+#           与阈值的差距在标定误差范围内时回退 jieba 精确计数，因此只有误差超出标定范围的极少数文本判定会不同
+TOKEN_COUNT_MODES = ("jieba", "approx")
+
+# 未标定时使用的默认系数（按常见教辅中文文本估计）：平均每个词 1.6 个汉字，误差范围 ±6 个词
+DEFAULT_CALIBRATION = {"cjk_per_token": 1.6, "margin": 6.0}
+
+# 每段文本的计数缓存条数：共享题干的背景知识在每个小问中重复出现，只需分词一次
+COUNT_CACHE_SIZE = 1 << 16
+
+_CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+# jieba 对非汉字部分的切分：字母数字串整体一个词，其余每个字符（标点、空白）一个词
+_RUN_PATTERN = re.compile(r'[A-Za-z0-9]+|[^\u4e00-\u9fffA-Za-z0-9]')
+
+_jieba = None
+
+
+def get_jieba():
+    """
+    延迟加载 jieba：只有实际需要精确计数时才导入并加载词典，不做长度过滤的学科完全不付出加载开销
+    """
+    global _jieba
+    if _jieba is None:
+        import jieba
+        jieba.setLogLevel(60)
+        jieba.initialize()
+        _jieba = jieba
+    return _jieba
+
+
+def jieba_count(text):
+    """
+    jieba 分词个数（不保留分词结果）
+    """
+    return sum(1 for _ in get_jieba().cut(text))
+
+
+def text_features(text):
+    """
+    近似计数用的特征：(汉字数, 非汉字部分的词数)
+    """
+    _, n_cjk = _CJK_PATTERN.subn('', text)
+    _, n_runs = _RUN_PATTERN.subn('', text)
+    return n_cjk, n_runs
+
+
+class TokenCounter:
+    """
+    分词计数服务，按文本缓存计数结果；同一进程内的 DataFilter 共用一个实例（见 get_token_counter）
+    """
+
+    def __init__(self, mode="jieba", calibration=None, cache_size=COUNT_CACHE_SIZE):
+        if mode not in TOKEN_COUNT_MODES:
+            raise ValueError(f"未知的分词计数方式：{mode}，可选：{', '.join(TOKEN_COUNT_MODES)}")
+        calibration = calibration or DEFAULT_CALIBRATION
+        self.mode = mode
+        self.cjk_per_token = float(calibration["cjk_per_token"])
+        self.margin = float(calibration["margin"])
+        self.count = lru_cache(maxsize=cache_size)(jieba_count)
+        self.approx_count = lru_cache(maxsize=cache_size)(self._approx_count)
+
+    def _approx_count(self, text):
+        n_cjk, n_runs = text_features(text)
+        return n_cjk / self.cjk_per_token + n_runs
+
+    def total(self, *texts):
+        """
+        多段文本的精确分词总数
+        """
+        return sum(self.count(text) for text in texts)
+
+    def is_below(self, threshold, *texts):
+        """
+        多段文本的分词总数是否小于 threshold
+        approx 方式下，字符数或近似计数足以确定结果时不分词，只有落在标定误差范围内时才精确计数
+        """
+        # 分词数不超过字符数，字符数已低于阈值时一定过短
+        if sum(len(text) for text in texts) < threshold:
+            return True
+        if self.mode == "approx":
+            estimate = sum(self.approx_count(text) for text in texts)
+            if estimate + self.margin < threshold:
+                return True
+            if estimate - self.margin >= threshold:
+                return False
+        return self.total(*texts) < threshold
+
+    def cache_info(self):
+        return {"count": self.count.cache_info(), "approx": self.approx_count.cache_info()}
+
+
+_default_counter = None
+
+
+def get_token_counter():
+    """
+    进程内共用的分词计数服务（第5步每个文件新建一个 DataFilter，缓存需要跨文件保留）
+    """
+    global _default_counter
+    if _default_counter is None:
+        _default_counter = TokenCounter()
+    return _default_counter
+
+
+def set_token_counter(counter):
+    """
+    替换进程内共用的分词计数服务，例如切换为 approx 方式；多进程时在 fork 子进程之前调用
+    """
+    global _default_counter
+    _default_counter = counter
+
+
+def load_calibration(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return loads(f.read())
+
+
+def calibrate(texts, quantile=0.999, max_tokens=200):
+    """
+    在基准文本上相对 jieba 标定近似计数：
+      cjk_per_token  平均每个词的汉字数（比值估计）
+      margin         分词数不超过 max_tokens 的文本上近似误差绝对值的 quantile 分位数
+                     （长度过滤的阈值在 10~30 之间，只有较短文本的误差会影响判定）
+    """
+    samples = []
+    for text in texts:
+        if not text:
+            continue
+        n_cjk, n_runs = text_features(text)
+        samples.append((n_cjk, n_runs, jieba_count(text)))
+    if not samples:
+        raise ValueError("基准文本为空，无法标定")
+
+    cjk_total = sum(n_cjk for n_cjk, _, _ in samples)
+    cjk_tokens = sum(exact - n_runs for _, n_runs, exact in samples)
+    cjk_per_token = cjk_total / cjk_tokens if cjk_tokens > 0 else DEFAULT_CALIBRATION["cjk_per_token"]
+
+    errors = sorted(abs(n_cjk / cjk_per_token + n_runs - exact)
+                    for n_cjk, n_runs, exact in samples if exact <= max_tokens)
+    margin = errors[min(len(errors) - 1, int(quantile * len(errors)))] if errors else DEFAULT_CALIBRATION["margin"]
+    return {"cjk_per_token": round(cjk_per_token, 4), "margin": round(margin + 0.5, 2), "samples": len(samples)}
+
+
+def iter_benchmark_texts(paths):
+    """
+    从 QA 中间文件（JSON Lines）中取出 is_too_short 会计数的文本：题目内容与背景知识
+    """
+    for path in paths:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    continue
+                for value in (entry.get("题目背景知识"), entry.get("题目内容")):
+                    if value:
+                        yield str(value)
+                for sub in entry.get("sub_qa") or ():
+                    if isinstance(sub, dict) and sub.get("题目内容"):
+                        yield str(sub["题目内容"])
+
+
+def benchmark(texts, calibration, threshold=20):
+    """
+    对比各计数方式的单条耗时（微秒）及 approx 方式与 jieba 判定不一致的条数
+    """
+    exact = TokenCounter("jieba")
+    approx = TokenCounter("approx", calibration)
+    report = {}
+    for name, func in (("jieba（首次）", lambda t: exact.is_below(threshold, t)),
+                       ("jieba（缓存）", lambda t: exact.is_below(threshold, t)),
+                       ("approx", lambda t: approx.is_below(threshold, t))):
+        start = time.perf_counter()
+        results = [func(text) for text in texts]
+        report[name] = (time.perf_counter() - start) / len(texts) * 1e6
+        if name.startswith("jieba"):
+            expected = results
+    report["approx 判定不一致"] = sum(a != b for a, b in zip(results, expected))
+    report["approx 回退 jieba"] = approx.count.cache_info().misses
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("用法：python token_count.py <标定结果输出文件.json> <QA中间文件.json>...")
+        sys.exit(1)
+    texts = list(iter_benchmark_texts(sys.argv[2:]))
+    get_jieba()
+    calibration = calibrate(texts)
+    with open(sys.argv[1], 'w', encoding='utf-8') as f:
+        f.write(dumps(calibration))
+    print(f"基准文本 {len(texts)} 条，标定结果：{calibration}")
+    for name, value in benchmark(texts, calibration).items():
+        print(f"  {name}: {value:.2f}" if isinstance(value, float) else f"  {name}: {value}")
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+
+from jsonl_io import JsonlWriter, dumpb, iter_lines, loads
+
+# 跨批次的模型判定结果缓存：同一道题（学科、检查阶段、归一化后的题目和答案相同）只请求一次模型
+# 生成提单文件时（第6步可用性检查、data_to_model_check 单轮质检）：
+#   - 命中缓存的题目不再写入提单文件，而是连同缓存的判定结果（answer）写入同名旁路文件 {提单文件}.verdicts，
+#     格式与模型结果导出的行相同（提单行 + "answer"）
+#   - 未命中的题目照常写入提单文件，并在 id 中附带 verdict_key，结果返回后据此写回缓存
+# 收集结果时（collect_results / 本脚本命令行）：把新结果写入缓存，再把旁路文件中的缓存结果合并进结果文件
+VERDICT_KEY = "verdict_key"
+VERDICTS_SUFFIX = ".verdicts"
+STAGE_AVAILABILITY = "3_check_availability"
+STAGE_MODEL_CHECK = "质检单轮"
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    题目/答案归一化：全角转半角（NFKC），连续空白合并为一个空格，去掉首尾空白
+    """
+    if not isinstance(text, str):
+        return ""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def verdict_key(subject, stage, q_text, a_text=""):
+    """
+    缓存键：学科、检查阶段和归一化后的题目、答案的摘要
+    stage 中应包含影响判定结果的其他因素（如质检使用的模型名）
+    """
+    return hashlib.sha256(dumpb([subject, stage, normalize_text(q_text), normalize_text(a_text)])).hexdigest()
+
+
+def availability_stage(ref, model=""):
+    """
+    可用性检查的检查阶段：包含 prompt 模板摘要（prompt_dedup.template_ref）和模型名，
+    修改 prompts.yaml 中的检查规则/模板或更换模型后不再命中旧的判定结果
+    """
+    return f"{STAGE_AVAILABILITY}/{ref}/{model}"
+
+
+def verdicts_path(prompt_file):
+    return f"{prompt_file}{VERDICTS_SUFFIX}"
+
+
+def with_answer(line, answer):
+    """
+    在一行 JSON 对象（bytes）末尾追加 "answer" 字段，与 {**record, "answer": answer} 序列化结果相同
+    """
+    return line[:-1] + b',"answer":' + dumpb(answer) + b'}'
+
+
+class VerdictCache:
+    """
+    基于 SQLite 的持久化判定结果缓存：verdict_key -> 模型回复
+    连接可以在线程间共享（第6步在线程池中查询）
+    """
+
+    SQL_VAR_LIMIT = 500  # 单条 IN 查询的参数个数上限
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        # 多个进程可能共用同一个库，写锁等待时间放宽
+        self.conn = sqlite3.connect(db_path, timeout=600, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS verdicts (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                batch TEXT,
+                updated TEXT
+            ) WITHOUT ROWID;
+        """)
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        """
+        批量查询，返回命中的 {verdict_key: 回复}
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            cur = self.conn.cursor()
+            for i in range(0, len(keys), self.SQL_VAR_LIMIT):
+                chunk = keys[i:i + self.SQL_VAR_LIMIT]
+                marks = ",".join("?" * len(chunk))
+                found.update(cur.execute(f"SELECT key, answer FROM verdicts WHERE key IN ({marks})", chunk).fetchall())
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items, batch=""):
+        """
+        写入 (verdict_key, 回复) 列表，已存在的键用新结果覆盖
+        """
+        updated = time.strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO verdicts (key, answer, batch, updated) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET answer=excluded.answer, batch=excluded.batch, updated=excluded.updated",
+                [(key, answer, batch, updated) for key, answer in items]
+            )
+            self.conn.commit()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+class VerdictLookup:
+    """
+    生成提单文件时的缓存查询：cache 为 None 时不查询、不附加 verdict_key（输出与不使用缓存时相同）
+    """
+
+    def __init__(self, cache, subject, stage):
+        self.cache = cache
+        self.subject = subject
+        self.stage = stage
+
+    def keys(self, qa_pairs):
+        return [verdict_key(self.subject, self.stage, q_text, a_text) for q_text, a_text in qa_pairs]
+
+    def lookup(self, keys):
+        return self.cache.get_many(keys) if self.cache is not None else {}
+
+
+def merge_verdict_files(input_files, output_file):
+    """
+    合并提单文件时同时合并命中缓存的旁路文件，输入都没有旁路文件时删除上次合并留下的旁路文件并返回 None
+    """
+    existing = [verdicts_path(f) for f in input_files if os.path.exists(verdicts_path(f))]
+    if not existing:
+        if os.path.exists(verdicts_path(output_file)):
+            os.remove(verdicts_path(output_file))
+        return None
+    with JsonlWriter(verdicts_path(output_file)) as writer:
+        for path in existing:
+            for _, line in iter_lines(path):
+                writer.write_line(line)
+    return verdicts_path(output_file)
+
+
+def collect_results(result_file, prompt_file, cache=None, batch=""):
+    """
+    收集模型结果：结果中带 verdict_key 的回复写入缓存，再把提单文件旁路文件中命中缓存的行合并到结果文件末尾
+    可以重复执行：结果文件中已合并过的缓存行会先去掉再重新合并
+    返回 (写入缓存条数, 合并的缓存行数)
+    """
+    cached_lines = []
+    cached_keys = set()
+    if os.path.exists(verdicts_path(prompt_file)):
+        for _, line in iter_lines(verdicts_path(prompt_file)):
+            cached_lines.append(line)
+            cached_keys.add(loads(line).get("id", {}).get(VERDICT_KEY))
+
+    recorded = []
+    tmp_path = f"{result_file}.tmp"
+    with JsonlWriter(tmp_path) as writer:
+        for _, line in iter_lines(result_file):
+            try:
+                entry = loads(line)
+            except ValueError:
+                writer.write_line(line)
+                continue
+            key = entry.get("id", {}).get(VERDICT_KEY) if isinstance(entry.get("id"), dict) else None
+            if key is not None and key in cached_keys:
+                continue
+            if key is not None and isinstance(entry.get("answer"), str) and entry["answer"].strip():
+                recorded.append((key, entry["answer"]))
+            writer.write_line(line)
+        for line in cached_lines:
+            writer.write_line(line)
+    os.replace(tmp_path, result_file)
+
+    if cache is not None and recorded:
+        cache.put_many(recorded, batch)
+    return len(recorded), len(cached_lines)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5):
+        print("用法：python verdict_cache.py <缓存库.db> <提单文件.json> <模型结果文件.json> [batch]")
+        print("      模型结果写入缓存，并把提单时命中缓存的结果合并到模型结果文件中")
+        sys.exit(1)
+    cache = VerdictCache(sys.argv[1])
+    try:
+        recorded, merged = collect_results(sys.argv[3], sys.argv[2], cache, sys.argv[4] if len(sys.argv) == 5 else "")
+    finally:
+        cache.close()
+    print(f"写入缓存 {recorded} 条，合并缓存结果 {merged} 条：{sys.argv[3]}")
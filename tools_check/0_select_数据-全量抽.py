@@ -1,7 +1,8 @@
 import os
-import json
 import random
 import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import JsonlWriter, iter_lines
 
 # 关键修改：接收4个参数（原2个 + 新增level、subject）
 if len(sys.argv) != 5:
@@ -24,9 +25,7 @@ for root, dirs, files in os.walk(input_dir):
         if file.lower().endswith(".json"):
             file_path = os.path.join(root, file)
             try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    lines = [line.strip() for line in f if line.strip()]
-                    all_lines.extend(lines)
+                all_lines.extend(line for _, line in iter_lines(file_path))
             except Exception as e:
                 print(f"读取失败: {file_path}, 错误: {e}")
 
@@ -63,8 +62,8 @@ output_file = os.path.join(output_dir, f"select-{level}{subject}.json")
 os.makedirs(output_dir, exist_ok=True)
 
 # 写入文件（逻辑不变）
-with open(output_file, "w", encoding="utf-8") as f:
+with JsonlWriter(output_file) as f:
     for line in sampled_results:
-        f.write(line + "\n")
+        f.write_line(line)
 
 print(f"总数据量: {total_count} 条，根据数据量确定抽取 {total_sample_size} 条，输出到: {output_file}")
\ No newline at end of file
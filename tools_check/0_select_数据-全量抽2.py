@@ -1,8 +1,9 @@
 import os
-import json
 import random
 import sys
 from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import JsonlWriter, iter_lines
 
 # 接收3个参数：输入根目录、输出目录、批次标识
 if len(sys.argv) != 4:
@@ -31,9 +32,7 @@ for root, dirs, files in os.walk(input_root_dir):
     for file in json_files:
         file_path = os.path.join(root, file)
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                lines = [line.strip() for line in f if line.strip()]
-                folder_lines.extend(lines)
+            folder_lines.extend(line for _, line in iter_lines(file_path))
         except Exception as e:
             print(f"❌ 读取失败: {file_path}, 错误: {str(e)}")
     
@@ -71,9 +70,9 @@ stats_file = os.path.join(output_dir, f"抽取统计_{batch}.txt")
 os.makedirs(output_dir, exist_ok=True)
 
 # 写入JSON结果文件
-with open(output_file, "w", encoding="utf-8") as f:
+with JsonlWriter(output_file) as f:
     for line in all_sampled:
-        f.write(line + "\n")
+        f.write_line(line)
 
 # 写入简化的统计文件（仅保留子文件夹名称和抽取数量）
 with open(stats_file, "w", encoding="utf-8") as f:
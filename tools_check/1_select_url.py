@@ -1,6 +1,8 @@
 import json
 import sys
 import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import iter_lines, loads
 
 # 关键修改：参数数量改为4个（input_dir + output_dir + level + subject）
 if len(sys.argv) != 5:
@@ -28,15 +30,14 @@ urls = set()
 
 # 读取 jsonl 文件并提取 url（核心逻辑不变）
 try:
-    with open(input_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                data = json.loads(line)
-                url = data.get('url')
-                if url:
-                    urls.add(url)  # 用set自动去重
-            except json.JSONDecodeError:
-                continue  # 跳过无效JSON行
+    for _, line in iter_lines(input_file):
+        try:
+            data = loads(line)
+            url = data.get('url')
+            if url:
+                urls.add(url)  # 用set自动去重
+        except json.JSONDecodeError:
+            continue  # 跳过无效JSON行
 
     # 写入去重后的URL（逻辑不变）
     with open(output_file, 'w', encoding='utf-8') as f:
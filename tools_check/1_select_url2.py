@@ -1,6 +1,8 @@
 import json
 import sys
 import os
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import iter_lines, loads
 
 # 关键修改：参数数量改为4个（input_dir + output_dir + level + subject）
 if len(sys.argv) != 5:
@@ -43,19 +45,18 @@ def process_url(path):
 
 # 读取 jsonl 文件并提取 url（核心逻辑：新增路径处理）
 try:
-    with open(input_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            try:
-                data = json.loads(line)
-                raw_url = data.get('url')
-                if not raw_url:
-                    continue  # 跳过空url
-                # 关键修改：处理url，排除最后两个层级
-                processed_url = process_url(raw_url)
-                if processed_url:  # 仅保留处理后非空的路径
-                    urls.add(processed_url)
-            except json.JSONDecodeError:
-                continue  # 跳过无效JSON行
+    for _, line in iter_lines(input_file):
+        try:
+            data = loads(line)
+            raw_url = data.get('url')
+            if not raw_url:
+                continue  # 跳过空url
+            # 关键修改：处理url，排除最后两个层级
+            processed_url = process_url(raw_url)
+            if processed_url:  # 仅保留处理后非空的路径
+                urls.add(processed_url)
+        except json.JSONDecodeError:
+            continue  # 跳过无效JSON行
 
     # 写入去重后的URL（逻辑不变）
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -1,7 +1,8 @@
-import json
 import sys
 import os
 from collections import defaultdict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import JsonlWriter, iter_lines, loads
 
 def get_last_path_segment(path):
     """提取路径中最后一个文件/文件夹层级"""
@@ -111,17 +112,13 @@ def convert_to_jsonl(input_path, output_path):
 
     # 2. 读取原始文件，转换并分组
     print(f"正在读取并转换原始数据：{input_path}")
-    with open(input_path, 'r', encoding='utf-8') as infile:
-        for idx, line in enumerate(infile, 1):
-            line = line.strip()
-            if not line:
-                continue  # 跳过空行
-            try:
-                entry = json.loads(line)  # 解析原始JSON行
-                category_desc, platform_entry = transform_entry(entry)  # 转换并获取分组key
-                category_groups[category_desc].append(platform_entry)  # 加入对应分组
-            except Exception as e:
-                print(f"[第{idx}行] 解析/转换错误，已跳过。错误信息: {str(e)[:100]}")  # 截取长错误信息
+    for idx, line in iter_lines(input_path):
+        try:
+            entry = loads(line)  # 解析原始JSON行
+            category_desc, platform_entry = transform_entry(entry)  # 转换并获取分组key
+            category_groups[category_desc].append(platform_entry)  # 加入对应分组
+        except Exception as e:
+            print(f"[第{idx}行] 解析/转换错误，已跳过。错误信息: {str(e)[:100]}")  # 截取长错误信息
 
     # 3. 确保输出目录存在
     output_dir = os.path.dirname(output_path)
@@ -129,14 +126,13 @@ def convert_to_jsonl(input_path, output_path):
 
     # 4. 按分组写入输出文件（相同categoryDesc的对象连续存储）
     print(f"正在按categoryDesc分组写入输出文件：{output_path}")
-    with open(output_path, 'w', encoding='utf-8') as outfile:
+    with JsonlWriter(output_path) as outfile:
         # 遍历所有分组（按key排序，保证输出顺序稳定）
         for category_desc in sorted(category_groups.keys()):
             group_entries = category_groups[category_desc]
             # 写入该分组的所有对象
             for entry in group_entries:
-                json.dump(entry, outfile, ensure_ascii=False)
-                outfile.write('\n')
+                outfile.write(entry)
 
     # 5. 输出分组统计信息
     print(f"\n分组统计（共{len(category_groups)}个不同categoryDesc）：")
@@ -1,6 +1,8 @@
-import json
 import os
+import sys
 from collections import defaultdict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import JsonlWriter, iter_lines, loads
 
 def get_last_path_segment(path):
     """提取路径中最后一个文件/文件夹层级"""
@@ -30,18 +32,14 @@ def load_data_by_answer(input_path):
     """加载JSONL文件，以“对应答案”为key构建数据字典（一个key可能对应多个记录）"""
     answer_data_dict = defaultdict(list)
     print(f"正在加载文件：{input_path}")
-    with open(input_path, 'r', encoding='utf-8') as infile:
-        for idx, line in enumerate(infile, 1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entry = json.loads(line)
-                original_data = entry.get('id', {}).get('original_data', {}) or entry.get('original_data', {})
-                answer_key = extract_answer_key(original_data)
-                answer_data_dict[answer_key].append(entry)
-            except Exception as e:
-                print(f"[第{idx}行] 解析错误，已跳过。错误信息: {str(e)[:150]}")
+    for idx, line in iter_lines(input_path):
+        try:
+            entry = loads(line)
+            original_data = entry.get('id', {}).get('original_data', {}) or entry.get('original_data', {})
+            answer_key = extract_answer_key(original_data)
+            answer_data_dict[answer_key].append(entry)
+        except Exception as e:
+            print(f"[第{idx}行] 解析错误，已跳过。错误信息: {str(e)[:150]}")
     print(f"加载完成：共处理{idx}行 → 生成{len(answer_data_dict)}个答案key → 累计{sum(len(v) for v in answer_data_dict.values())}条记录")
     return answer_data_dict
 
@@ -163,7 +161,7 @@ def convert_to_jsonl(input_path1, input_path2, output_dir):
     for st in source_types:
         filename = f"select-{st}-单轮质检-to平台.json"
         file_path = os.path.join(output_dir, filename)
-        output_files[st] = open(file_path, 'w', encoding='utf-8')
+        output_files[st] = JsonlWriter(file_path)
 
     category_groups = defaultdict(list)
     matched_count = 0
@@ -191,8 +189,7 @@ def convert_to_jsonl(input_path1, input_path2, output_dir):
                 # 修复点3：使用返回的source_type，为空则设为“未知”
                 st = source_type if source_type.strip() else '未知'
                 if st in output_files:
-                    json.dump(platform_entry, output_files[st], ensure_ascii=False)
-                    output_files[st].write('\n')
+                    output_files[st].write(platform_entry)
             except Exception as e:
                 conversion_failed += 1
                 print(f"警告：答案key={answer_key} 对应的第{i+1}组记录转换失败。错误：{str(e)[:150]}")
@@ -4,6 +4,8 @@ import sys
 import shutil
 from tqdm import tqdm
 from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tools"))
+from jsonl_io import loads
 
 # -------------------------- 固定配置 --------------------------
 IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp', '.tiff', '.svg')
@@ -33,7 +35,7 @@ def extract_unique_pics_from_jsonl(jsonl_path):
 
             try:
                 # 严格匹配平台JSON格式层级
-                json_obj = json.loads(line_stripped)
+                json_obj = loads(line_stripped)
                 stats["valid_json_lines"] += 1
 
                 if "dialogContent" not in json_obj or not isinstance(json_obj["dialogContent"], list) or len(json_obj["dialogContent"]) == 0: